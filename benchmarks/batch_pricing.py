@@ -0,0 +1,77 @@
+"""
+    Benchmark: pricing rate plans one at a time and in a batch
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Prices the rate plans of a generated catalog with
+    get_product_rate_plan_charge_pricing() per rate plan, and with one
+    get_product_rate_plans_pricing() call. Queries are answered from the
+    generated records after `latency` ms, and run concurrently by
+    query_chunked() as they would against Zuora.
+
+    $ python benchmarks/batch_pricing.py [rate_plans] [latency]
+"""
+from os import path
+import re
+import sys
+import time
+
+sys.path.insert(0, path.join(path.dirname(path.abspath(__file__)), '..'))
+
+from suds.sudsobject import Factory
+
+from catalog_fixture import catalog_rows
+from zuora import Zuora
+from zuora.query_cache import query_type
+
+condition_re = re.compile(r"(\w+) = '([^']*)'")
+
+
+class Endpoint(object):
+    """
+    Answers the queries with the records matching any of their conditions
+    """
+    def __init__(self, rows, latency):
+        self.rows = rows
+        self.latency = latency
+        self.queries = 0
+
+    def query(self, query_string):
+        self.queries += 1
+        time.sleep(self.latency)
+        values = {}
+        for field, value in condition_re.findall(query_string):
+            values.setdefault(field, set()).add(value)
+        records = [record for record in self.rows[query_type(query_string)]
+                   if any(str(getattr(record, field, None)) in field_values
+                          for field, field_values in values.items())]
+        return Factory.object('QueryResult', {'done': True, 'size':
+                                              len(records),
+                                              'records': records})
+
+
+def main(rate_plans='50', latency='50'):
+    rate_plans, latency = int(rate_plans), float(latency) / 1000
+    rows = catalog_rows((rate_plans + 9) // 10)
+    rate_plan_ids = [record.Id
+                     for record in rows['ProductRatePlan'][:rate_plans]]
+
+    print('%d rate plans, %.0fms per query' % (rate_plans, latency * 1000))
+    print('%-12s %10s %10s' % ('pricing', 'time', 'queries'))
+    for name in ('one by one', 'batch'):
+        endpoint = Endpoint(rows, latency)
+        z = Zuora({'username': 'username', 'password': 'password',
+                   'wsdl_file': 'zuora.a.48.0.wsdl'})
+        z.login = lambda: None
+        z.query = endpoint.query
+        start = time.time()
+        if name == 'batch':
+            z.get_product_rate_plans_pricing(rate_plan_ids)
+        else:
+            for rate_plan_id in rate_plan_ids:
+                z.get_product_rate_plan_charge_pricing(rate_plan_id)
+        print('%-12s %8.0fms %10d' % (name, (time.time() - start) * 1000,
+                                      endpoint.queries))
+
+
+if __name__ == '__main__':
+    main(*sys.argv[1:])
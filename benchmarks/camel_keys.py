@@ -0,0 +1,78 @@
+"""
+    Benchmark: serialized keys converted per field and looked up per type
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Time of zuora_serialize_list() over a page of InvoiceItem records, and
+    of get_camel_converted_product_rate_plan_charge_tiers() over the tiers
+    of a generated catalog, converting every field name with the regexes
+    (as before the key maps) and with the memoized KeyMap of each type.
+
+    $ python benchmarks/camel_keys.py [records] [rounds]
+"""
+from os import path
+import sys
+import time
+
+sys.path.insert(0, path.join(path.dirname(path.abspath(__file__)), '..'))
+
+import mock
+from suds.sudsobject import Factory
+
+from catalog_fixture import catalog_rows
+from query_fixture import INVOICE_ITEM_FIELDS
+from zuora import Zuora, zuora_serialize_list
+from zuora import client
+from zuora.catalog import Catalog
+from zuora.query_cache import query_type
+
+
+class RegexKeys(object):
+    """
+    The keys converted on every field, as before the key maps
+    """
+    def __getitem__(self, name):
+        name = name.replace("__c", "")
+        s1 = client.first_cap_re.sub(r'\1_\2', name)
+        return client.all_cap_re.sub(r'\1_\2', s1).lower()
+
+
+def best(fn, rounds):
+    times = []
+    for _ in range(rounds):
+        start = time.time()
+        fn()
+        times.append(time.time() - start)
+    return min(times)
+
+
+def main(records='2000', rounds='5'):
+    records, rounds = int(records), int(rounds)
+    page = [Factory.object('InvoiceItem', dict(
+                (field, '%s %d' % (field, i))
+                for field in INVOICE_ITEM_FIELDS))
+            for i in range(records)]
+
+    rows = catalog_rows(records // 90 or 1)
+    z = Zuora({'username': 'username', 'password': 'password',
+               'wsdl_file': 'zuora.a.48.0.wsdl', 'catalog': Catalog()})
+    z.query_all = lambda query_string: rows[query_type(query_string)]
+    charge_ids = [record.Id for record in rows['ProductRatePlanCharge']]
+
+    print('%d InvoiceItem records, %d tiers' % (
+        records, len(rows['ProductRatePlanChargeTier'])))
+    print('%-30s %12s %12s' % ('call', 'regex', 'key maps'))
+    for name, fn in (
+            ('zuora_serialize_list', lambda: zuora_serialize_list(page)),
+            ('camel converted tiers',
+             lambda: z.get_camel_converted_product_rate_plan_charge_tiers(
+                            product_rate_plan_charge_id_list=charge_ids))):
+        with mock.patch.object(client, 'key_map',
+                               lambda obj: RegexKeys()):
+            regex = best(fn, rounds)
+        key_maps = best(fn, rounds)
+        print('%-30s %10.1fms %10.1fms' % (name, regex * 1000,
+                                           key_maps * 1000))
+
+
+if __name__ == '__main__':
+    main(*sys.argv[1:])
@@ -0,0 +1,52 @@
+"""
+    Catalog fixtures for the benchmarks
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Generates the Product, ProductRatePlan, ProductRatePlanCharge and
+    ProductRatePlanChargeTier records of a catalog: 10 rate plans per
+    product, 3 charges per rate plan and 3 tiers per charge.
+"""
+from datetime import datetime
+
+from suds.sudsobject import Factory
+
+SITES = ['mapmyrun', 'mapmyride', '(run|ride)', 'mapmywalk', '.*']
+
+
+def catalog_rows(products):
+    start, end = datetime(2000, 1, 1), datetime(2100, 1, 1)
+    rows = dict((name, []) for name in (
+        'Product', 'ProductRatePlan', 'ProductRatePlanCharge',
+        'ProductRatePlanChargeTier'))
+    for p in range(products):
+        rows['Product'].append(Factory.object('Product', {
+            'Id': 'p%d' % p, 'Name': 'Product %d' % p,
+            'ShortCode__c': 'code_%d' % p, 'SKU': 'SKU-%d' % p,
+            'EffectiveStartDate': start, 'EffectiveEndDate': end}))
+        for rp in range(10):
+            rp_id = 'p%d-rp%d' % (p, rp)
+            rows['ProductRatePlan'].append(
+                Factory.object('ProductRatePlan', {
+                    'Id': rp_id, 'ProductId': 'p%d' % p, 'Name': rp_id,
+                    'Site__c': SITES[rp % len(SITES)], 'Gender__c': 'female',
+                    'AgeGroup__c': 'adult|senior', 'ActivityLevel__c': 'high',
+                    'Priority__c': str(rp % 3), 'Term__c': '12',
+                    'EffectiveStartDate': start, 'EffectiveEndDate': end}))
+            for c in range(3):
+                charge_id = '%s-c%d' % (rp_id, c)
+                rows['ProductRatePlanCharge'].append(
+                    Factory.object('ProductRatePlanCharge', {
+                        'Id': charge_id, 'ProductRatePlanId': rp_id,
+                        'Name': charge_id, 'ChargeModel': 'Tiered Pricing',
+                        'ChargeType': 'Recurring', 'SortOrder__c': str(c),
+                        'BillingPeriod': 'Month'}))
+                for t in range(3):
+                    rows['ProductRatePlanChargeTier'].append(
+                        Factory.object('ProductRatePlanChargeTier', {
+                            'Id': '%s-t%d' % (charge_id, t),
+                            'ProductRatePlanChargeId': charge_id,
+                            'Tier': t + 1, 'Price': 9.99 * (t + 1),
+                            'IsOveragePrice': False, 'Currency': 'USD',
+                            'StartingUnit': t * 10.0,
+                            'EndingUnit': (t + 1) * 10.0}))
+    return rows
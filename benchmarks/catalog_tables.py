@@ -0,0 +1,130 @@
+"""
+    Benchmark: catalog aggregations over camel dicts and CatalogTables
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Builds the charges and tiers of every rate plan of a generated catalog
+    with the get_camel_converted_* helpers and as CatalogTables, and
+    compares their size, the total non-overage price per rate plan and the
+    tier lookup of a quantity for every charge.
+
+    $ python benchmarks/catalog_tables.py [products]
+"""
+from os import path
+import sys
+import time
+
+sys.path.insert(0, path.join(path.dirname(path.abspath(__file__)), '..'))
+
+from catalog_fixture import catalog_rows
+from zuora import Zuora
+from zuora.catalog import Catalog
+from zuora.catalog_tables import CatalogTables
+from zuora.query_cache import query_type
+
+QUANTITY = 15
+
+
+def deep_size(value, seen=None):
+    """
+    Bytes held by the value and the containers it references, each object
+    counted once
+    """
+    if seen is None:
+        seen = set()
+    if id(value) in seen:
+        return 0
+    seen.add(id(value))
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(deep_size(key, seen) + deep_size(item, seen)
+                    for key, item in value.items())
+    elif isinstance(value, (list, tuple)):
+        size += sum(deep_size(item, seen) for item in value)
+    elif hasattr(value, '__dict__'):
+        size += deep_size(vars(value), seen)
+    return size
+
+
+def timed(fn):
+    start = time.time()
+    result = fn()
+    return result, time.time() - start
+
+
+def dict_totals(rate_plan_ids, charges, tiers):
+    totals = {}
+    for rate_plan_id in rate_plan_ids:
+        total = 0.0
+        for charge_id in charges.get(rate_plan_id, {}):
+            for rpct in tiers.get(charge_id, {}).values():
+                if rpct['is_overage_price'] != 'True':
+                    total += float(rpct['price'])
+        totals[rate_plan_id] = total
+    return totals
+
+
+def dict_lookups(tiers, quantity):
+    rows = {}
+    for charge_id, charge_tiers in tiers.items():
+        rows[charge_id] = None
+        for tier_id, rpct in charge_tiers.items():
+            if rpct['is_overage_price'] != 'True' and \
+                    float(rpct['starting_unit']) <= quantity <= \
+                    float(rpct['ending_unit']):
+                rows[charge_id] = tier_id
+                break
+    return rows
+
+
+def main(products='500'):
+    rows = catalog_rows(int(products))
+    settings = {'username': 'username', 'password': 'password',
+                'wsdl_file': 'zuora.a.48.0.wsdl', 'catalog': Catalog()}
+    z = Zuora(settings)
+    z.query_all = lambda query_string: rows[query_type(query_string)]
+    z.catalog.snapshot(z)
+    rate_plan_ids = [record.Id for record in rows['ProductRatePlan']]
+    charge_ids = [record.Id for record in rows['ProductRatePlanCharge']]
+
+    def build_dicts():
+        return (z.get_camel_converted_product_rate_plan_charges(
+                    product_rate_plan_id_list=rate_plan_ids),
+                z.get_camel_converted_product_rate_plan_charge_tiers(
+                    product_rate_plan_charge_id_list=charge_ids))
+
+    def build_tables():
+        return CatalogTables(rows['ProductRatePlan'],
+                             rows['ProductRatePlanCharge'],
+                             rows['ProductRatePlanChargeTier'])
+
+    (charges, tiers), dicts_built = timed(build_dicts)
+    tables, tables_built = timed(build_tables)
+    dict_totals_result, dicts_summed = timed(
+        lambda: dict_totals(rate_plan_ids, charges, tiers))
+    tables_totals_result, tables_summed = timed(tables.rate_plan_totals)
+    assert all(abs(dict_totals_result[rate_plan_id] -
+                   tables_totals_result[rate_plan_id]) < 1e-6
+               for rate_plan_id in rate_plan_ids)
+    dict_rows, dicts_found = timed(lambda: dict_lookups(tiers, QUANTITY))
+    table_rows, tables_found = timed(lambda: [
+        tables.find_tier(charge_id, QUANTITY) for charge_id in charge_ids])
+    assert [dict_rows[charge_id] for charge_id in charge_ids] == \
+        [tables.tier_ids[row] for row in table_rows]
+
+    print('%d rate plans, %d charges, %d tiers' % (
+        len(rate_plan_ids), len(charge_ids),
+        len(rows['ProductRatePlanChargeTier'])))
+    print('%-14s %10s %10s %12s %12s' % (
+        'form', 'size', 'build', 'totals', 'lookups'))
+    for name, size, built, summed, found in (
+            ('camel dicts', deep_size((charges, tiers)),
+             dicts_built, dicts_summed, dicts_found),
+            ('tables', deep_size(tables), tables_built, tables_summed,
+             tables_found)):
+        print('%-14s %8.1fMB %8.1fms %10.1fms %10.1fms' % (
+            name, size / 1048576.0, built * 1000, summed * 1000,
+            found * 1000))
+
+
+if __name__ == '__main__':
+    main(*sys.argv[1:])
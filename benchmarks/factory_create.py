@@ -0,0 +1,52 @@
+"""
+    Benchmark: suds factory.create against the PrototypeFactory
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Objects built per second for the types created on the hot paths
+    (make_account, make_contact, make_rate_plan_data, make_subscription,
+    subscribe and the amendment builders).
+
+    $ python benchmarks/factory_create.py [wsdl_file] [seconds]
+"""
+from os import path
+import sys
+import time
+
+sys.path.insert(0, path.join(path.dirname(path.abspath(__file__)), '..'))
+
+import zuora
+from zuora.soap_client import ClientRegistry
+
+TYPES = ['ns2:Account', 'ns2:Contact', 'ns2:Subscription', 'ns2:Amendment',
+         'ns2:RatePlanCharge', 'ns0:RatePlan', 'ns0:RatePlanData',
+         'ns0:RatePlanChargeData', 'ns0:SubscribeOptions',
+         'ns0:SubscriptionData', 'ns0:SubscribeRequest', 'ns0:AmendRequest']
+
+
+def rate(create, name, seconds):
+    count = 0
+    start = time.time()
+    while time.time() - start < seconds:
+        for _ in range(10):
+            create(name)
+        count += 10
+    return count / (time.time() - start)
+
+
+def main(wsdl_file='zuora.a.48.0.wsdl', seconds='1'):
+    wsdl_path = path.join(path.abspath(path.dirname(zuora.__file__)),
+                          wsdl_file)
+    factory = ClientRegistry().checkout(wsdl_path).factory
+    seconds = float(seconds)
+
+    print('%-28s %14s %14s %8s' % ('type', 'suds/s', 'prototype/s',
+                                   'speedup'))
+    for name in TYPES:
+        built = rate(factory.factory.create, name, seconds)
+        copied = rate(factory.create, name, seconds)
+        print('%-28s %14.0f %14.0f %7.1fx' % (name, built, copied,
+                                              copied / built))
+
+
+if __name__ == '__main__':
+    main(*sys.argv[1:])
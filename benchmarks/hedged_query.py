@@ -0,0 +1,69 @@
+"""
+    Benchmark: query latency with and without hedging
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Sequential queries against a simulated endpoint answering in 20-30ms,
+    except for `tail` % of the requests which take 10 times longer. Hedged
+    queries are sent again after the 95th percentile of the recent
+    latencies.
+
+    $ python benchmarks/hedged_query.py [queries] [tail]
+"""
+from os import path
+import random
+import sys
+import time
+
+sys.path.insert(0, path.join(path.dirname(path.abspath(__file__)), '..'))
+
+from zuora.hedging import LatencyTracker, hedged_call
+
+
+class Endpoint(object):
+
+    def __init__(self, tail):
+        self.tail = tail
+        self.requests = 0
+        self.random = random.Random(42)
+
+    def query(self, query_string):
+        self.requests += 1
+        latency = self.random.uniform(0.02, 0.03)
+        if self.random.random() * 100 < self.tail:
+            latency *= 10
+        time.sleep(latency)
+        return query_string
+
+
+def run(queries, tail, hedge):
+    endpoint = Endpoint(tail)
+    tracker = LatencyTracker()
+    timings = []
+    for number in range(queries):
+        start = time.time()
+        if hedge:
+            hedged_call(tracker, 95, endpoint.query, number)
+        else:
+            endpoint.query(number)
+        timings.append(time.time() - start)
+    # Leave out the queries sent while the tracker was learning
+    timings = sorted(timings[tracker.min_samples:])
+    return (sum(timings) / len(timings), timings[len(timings) // 2],
+            timings[int(len(timings) * 0.99)], endpoint.requests)
+
+
+def main(queries='500', tail='3'):
+    queries, tail = int(queries), float(tail)
+    print('%d queries, %.0f%% of them 10x slower' % (queries, tail))
+    print('%-8s %10s %10s %10s %10s' % ('client', 'mean', 'median', 'p99',
+                                        'requests'))
+    for name, hedge in (('plain', False), ('hedged', True)):
+        mean, median, p99, requests = run(queries, tail, hedge)
+        print('%-8s %8.1fms %8.1fms %8.1fms %10d' % (
+            name, mean * 1000, median * 1000, p99 * 1000, requests))
+    # Let the cancelled hedge timers end before the interpreter does
+    time.sleep(0.1)
+
+
+if __name__ == '__main__':
+    main(*sys.argv[1:])
@@ -0,0 +1,93 @@
+"""
+    Local HTTPS stand-in for the Zuora endpoints
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    A threaded HTTP/1.1 server with a throwaway self-signed certificate
+    (made with the openssl command), answering every request with the same
+    json body and keeping connections alive.
+"""
+import os
+from os import path
+import shutil
+import ssl
+import subprocess
+import tempfile
+import threading
+import time
+
+try:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+except ImportError:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+
+BODY = b'{"success": true}'
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # One write per response, or delayed acks stall every reused connection
+    wbufsize = -1
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        BaseHTTPRequestHandler.setup(self)
+        self.server.connections += 1
+        # Stands in for the network round trips of a new connection
+        time.sleep(self.server.connect_latency)
+
+    def answer(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        if length:
+            self.rfile.read(length)
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(BODY)))
+        self.end_headers()
+        self.wfile.write(BODY)
+
+    do_GET = do_POST = do_PUT = do_DELETE = answer
+
+    def log_message(self, *args):
+        pass
+
+
+class StandIn(ThreadingMixIn, HTTPServer):
+    """
+    Usage example:
+    with StandIn() as server:
+        requests.get(server.url, verify=False)
+    """
+    daemon_threads = True
+
+    def __init__(self, connect_latency=0):
+        HTTPServer.__init__(self, ('127.0.0.1', 0), Handler)
+        self.connect_latency = connect_latency
+        self.connections = 0
+        self.certificate_dir = tempfile.mkdtemp()
+        certificate = path.join(self.certificate_dir, 'standin.pem')
+        with open(os.devnull, 'w') as devnull:
+            subprocess.check_call(
+                ['openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes',
+                 '-subj', '/CN=localhost', '-days', '1',
+                 '-keyout', certificate, '-out', certificate],
+                stdout=devnull, stderr=devnull)
+        self.socket = ssl.wrap_socket(self.socket, certfile=certificate,
+                                      server_side=True)
+        self.url = 'https://127.0.0.1:%d/' % self.server_address[1]
+
+    def handle_error(self, request, client_address):
+        # Clients closing their connection without a TLS shutdown
+        pass
+
+    def __enter__(self):
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.shutdown()
+        self.server_close()
+        shutil.rmtree(self.certificate_dir)
@@ -0,0 +1,100 @@
+"""
+    Query reply fixtures for the benchmarks
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Builds a queryResponse with generated values for the selected fields,
+    and a stand-in requests session answering every post with it.
+"""
+from xml.sax.saxutils import escape
+
+#: The InvoiceItem columns selected by Zuora.get_invoice_items
+INVOICE_ITEM_FIELDS = [
+    'AccountingCode', 'ChargeAmount', 'ChargeDate', 'ChargeDescription',
+    'ChargeName', 'ChargeNumber', 'CreatedById', 'CreatedDate', 'InvoiceId',
+    'ProcessingType', 'ProductDescription', 'ProductId', 'ProductName',
+    'Quantity', 'RatePlanChargeId', 'RevRecCode', 'RevRecStartDate',
+    'RevRecTriggerCondition', 'ServiceEndDate', 'ServiceStartDate', 'SKU',
+    'SubscriptionId', 'SubscriptionNumber', 'TaxAmount', 'TaxCode',
+    'TaxExemptAmount', 'UnitPrice', 'UOM', 'UpdatedById', 'UpdatedDate']
+
+SAMPLE_VALUES = {
+    'dateTime': '2014-03-%02dT10:15:00.000-08:00',
+    'date': '2014-03-%02d',
+    'decimal': '%d.25',
+    'double': '%d.5',
+    'int': '%d',
+    'long': '%d',
+    'boolean': 'true',
+}
+
+ENVELOPE = (
+    '<?xml version="1.0" encoding="UTF-8"?>'
+    '<soapenv:Envelope '
+    'xmlns:soapenv="http://schemas.xmlsoap.org/soap/envelope/" '
+    'xmlns:ns1="http://api.zuora.com/" '
+    'xmlns:ns2="http://object.api.zuora.com/" '
+    'xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance">'
+    '<soapenv:Body><ns1:%(method)sResponse><ns1:result>'
+    '<ns1:done>%(done)s</ns1:done>'
+    '<ns1:queryLocator>%(locator)s</ns1:queryLocator>'
+    '%(records)s'
+    '<ns1:size>%(size)d</ns1:size>'
+    '</ns1:result></ns1:%(method)sResponse></soapenv:Body>'
+    '</soapenv:Envelope>')
+
+
+def sample_value(schema_type, row):
+    """
+    Returns the text of a field of the given xsd type for a row
+    """
+    template = SAMPLE_VALUES.get(schema_type)
+    if template is None:
+        return escape('value %d & more' % row)
+    if '%' in template:
+        return template % (row % 28 + 1)
+    return template
+
+
+def query_reply(schema, type_name='InvoiceItem', fields=INVOICE_ITEM_FIELDS,
+                rows=2000, method='query', locator=''):
+    """
+    Returns a query reply with the given number of records. Fields missing
+    from the schema are left out.
+    """
+    schema_type = schema.types[(type_name, 'http://object.api.zuora.com/')]
+    field_types = dict((element.name, element.resolve().name)
+                       for element, ancestry in schema_type.children())
+    fields = [name for name in fields if name in field_types]
+    records = []
+    for row in range(rows):
+        values = ''.join(
+            '<ns2:%s>%s</ns2:%s>' % (name,
+                                      sample_value(field_types[name], row),
+                                      name)
+            for name in fields)
+        records.append('<ns1:records xsi:type="ns2:%s"><ns2:Id>%032x</ns2:Id>'
+                       '%s</ns1:records>' % (type_name, row, values))
+    return ENVELOPE % {'method': method,
+                       'done': 'false' if locator else 'true',
+                       'locator': locator, 'records': ''.join(records),
+                       'size': rows}
+
+
+class StaticResponse(object):
+
+    def __init__(self, content):
+        self.status_code = 200
+        self.headers = {}
+        self.content = content
+
+
+class StaticSession(object):
+    """
+    Stands in for the requests session of the soap transport, answering
+    every post with the same reply
+    """
+    def __init__(self, reply):
+        self.reply = reply
+
+    def post(self, url, data=None, headers=None, **kwargs):
+        return StaticResponse(self.reply)
@@ -0,0 +1,101 @@
+"""
+    Benchmark: suds unmarshalling against the QueryParser
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Runs Zuora.query against a 2000 row InvoiceItem reply (the columns of
+    get_invoice_items) with suds objects (fast_query) and with compact
+    records (native_query). Reports records per second, and the peak memory
+    growth of a forked process that parses the page and keeps the records.
+    suds manages well under 100 records per second, so a run takes minutes.
+
+    $ python benchmarks/query_parser.py [rows] [repeat]
+"""
+import gc
+from os import path
+import os
+import resource
+import sys
+import time
+
+sys.path.insert(0, path.join(path.dirname(path.abspath(__file__)), '..'))
+
+from zuora.client import Zuora
+from query_fixture import StaticSession, query_reply
+
+SETTINGS = {'username': 'username', 'password': 'password',
+            'wsdl_file': 'zuora.a.48.0.wsdl'}
+
+
+def zuora_instance(reply, **settings):
+    z = Zuora(dict(SETTINGS, **settings))
+    z.session_id = 'session'
+    # Warm up the record classes and the suds type resolution
+    z.client.options.transport.session = StaticSession(
+        query_reply(z.client.wsdl.schema, rows=10))
+    z.query("SELECT Id FROM InvoiceItem")
+    z.client.options.transport.session = StaticSession(reply)
+    return z
+
+
+def throughput(z, rows, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.time()
+        z.query("SELECT Id FROM InvoiceItem")
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return rows / best
+
+
+def peak_memory(reply, **settings):
+    """
+    Returns the growth of the peak resident set size (in KB) of a forked
+    process while parsing the page and keeping its records. The peak is
+    inherited on fork, so call it before parsing any large page.
+    """
+    read, write = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read)
+        z = zuora_instance(reply, **settings)
+        gc.collect()
+        before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        response = z.query("SELECT Id FROM InvoiceItem")
+        after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        os.write(write, str(after - before).encode('ascii'))
+        os._exit(0)
+    os.close(write)
+    growth = os.read(read, 64)
+    os.close(read)
+    os.waitpid(pid, 0)
+    return int(growth)
+
+
+PARSERS = (('suds', {'fast_query': True}),
+           ('native', {'native_query': True}))
+
+
+def main(rows='2000', repeat='3'):
+    rows, repeat = int(rows), int(repeat)
+    schema = Zuora(SETTINGS).client.wsdl.schema
+    reply = query_reply(schema, rows=rows)
+    print('%d InvoiceItem records, %.1f MB reply' % (
+        rows, len(reply) / 1024.0 / 1024))
+
+    memory = dict((name, peak_memory(reply, **settings))
+                  for name, settings in PARSERS)
+
+    print('%-10s %14s %14s' % ('parser', 'records/s', 'peak growth'))
+    results = {}
+    for name, settings in PARSERS:
+        z = zuora_instance(reply, **settings)
+        results[name] = (throughput(z, rows, repeat), memory[name])
+        print('%-10s %14.0f %11.1f MB' % (name, results[name][0],
+                                         results[name][1] / 1024.0))
+    print('native: %.1fx the throughput, %.1fx less memory' % (
+        results['native'][0] / results['suds'][0],
+        float(results['suds'][1]) / max(results['native'][1], 1)))
+
+
+if __name__ == '__main__':
+    main(*sys.argv[1:])
@@ -0,0 +1,87 @@
+"""
+    Benchmark: peak memory of parsing a query page whole or streamed
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Writes InvoiceItem pages (the columns of get_invoice_items) of growing
+    size to disk, then reads each one in a forked process with
+    QueryParser.parse and with a QueryStream consuming one record at a time.
+    Reports the peak resident set growth of the process.
+
+    $ python benchmarks/query_stream.py [rows ...]
+"""
+import gc
+from os import path
+import os
+import resource
+import shutil
+import sys
+import tempfile
+
+sys.path.insert(0, path.join(path.dirname(path.abspath(__file__)), '..'))
+
+from zuora.client import Zuora
+from zuora.query_parser import QueryStream
+from query_fixture import query_reply
+
+SETTINGS = {'username': 'username', 'password': 'password',
+            'wsdl_file': 'zuora.a.48.0.wsdl'}
+
+
+def parse(parser, reply_path):
+    with open(reply_path, 'rb') as reply:
+        return parser.parse(reply.read()).records
+
+
+def stream(parser, reply_path):
+    with open(reply_path, 'rb') as reply:
+        for record in QueryStream(parser, reply):
+            pass
+
+
+def peak_memory(fn, *args):
+    """
+    Returns the growth of the peak resident set size (in KB) of a forked
+    process while running fn
+    """
+    read, write = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read)
+        gc.collect()
+        before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        fn(*args)
+        after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        os.write(write, str(after - before).encode('ascii'))
+        os._exit(0)
+    os.close(write)
+    growth = os.read(read, 64)
+    os.close(read)
+    os.waitpid(pid, 0)
+    return int(growth)
+
+
+def main(*rows):
+    rows = [int(count) for count in rows] or [500, 2000, 8000]
+    client = Zuora(SETTINGS).client
+    parser = client.query_parser
+    # Warm up the record classes
+    parser.parse(query_reply(client.wsdl.schema, rows=1))
+
+    location = tempfile.mkdtemp()
+    try:
+        print('%8s %10s %14s %14s' % ('rows', 'reply', 'parse', 'stream'))
+        for count in rows:
+            reply_path = path.join(location, 'reply-%d.xml' % count)
+            with open(reply_path, 'wb') as reply:
+                reply.write(query_reply(client.wsdl.schema, rows=count))
+            size = path.getsize(reply_path)
+            print('%8d %7.1f MB %11.1f MB %11.1f MB' % (
+                count, size / 1024.0 / 1024,
+                peak_memory(parse, parser, reply_path) / 1024.0,
+                peak_memory(stream, parser, reply_path) / 1024.0))
+    finally:
+        shutil.rmtree(location)
+
+
+if __name__ == '__main__':
+    main(*sys.argv[1:])
@@ -0,0 +1,98 @@
+"""
+    Benchmark: bulk calls against a tenant concurrency limit
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Worker threads send Zuora.call()s to a simulated tenant that serves
+    `limit` concurrent requests and answers REQUEST_EXCEEDED_LIMIT beyond.
+    Without a limiter the workers retry a rejected call after a second;
+    with the RateLimiter they are paced by its AIMD window (halved, or
+    shrunk by 10%, when a call is rejected).
+
+    $ python benchmarks/rate_limiter.py [workers] [limit] [seconds]
+"""
+from os import path
+import sys
+import threading
+import time
+
+sys.path.insert(0, path.join(path.dirname(path.abspath(__file__)), '..'))
+
+from zuora.client import Zuora, ZuoraException
+from zuora.query_parser import QueryFault
+from zuora.rate_limiter import RateLimiter
+
+LATENCY = 0.02
+
+
+class Tenant(object):
+    """
+    Serves `limit` concurrent calls of LATENCY seconds
+    """
+    def __init__(self, limit):
+        self.limit = limit
+        self.in_flight = 0
+        self.lock = threading.Lock()
+        self.rejected = 0
+
+    def call(self):
+        with self.lock:
+            rejected = self.in_flight >= self.limit
+            if rejected:
+                self.rejected += 1
+            else:
+                self.in_flight += 1
+        if rejected:
+            # The fault takes a round trip too
+            time.sleep(LATENCY)
+            raise QueryFault('fns:REQUEST_EXCEEDED_LIMIT',
+                             'Concurrent request limit exceeded')
+        try:
+            time.sleep(LATENCY)
+        finally:
+            with self.lock:
+                self.in_flight -= 1
+
+
+def run(workers, limit, seconds, limiter):
+    tenant = Tenant(limit)
+    z = Zuora({'username': 'username', 'password': 'password',
+               'wsdl_file': 'zuora.a.48.0.wsdl', 'rate_limiter': limiter})
+    z.session_id = 'session'
+    done = []
+    deadline = time.time() + seconds
+
+    def work():
+        count = 0
+        while time.time() < deadline:
+            try:
+                z.call(tenant.call)
+                count += 1
+            except ZuoraException:
+                time.sleep(1)
+        done.append(count)
+
+    threads = [threading.Thread(target=work) for _ in range(workers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return sum(done) / float(seconds), tenant.rejected
+
+
+def main(workers='32', limit='8', seconds='5'):
+    workers, limit, seconds = int(workers), int(limit), float(seconds)
+    ideal = limit / LATENCY
+    print('%d workers, %d concurrent calls allowed (%.0f calls/s at most)'
+          % (workers, limit, ideal))
+    print('%-10s %10s %10s' % ('client', 'calls/s', 'rejected'))
+    for name, limiter in (
+            ('retry', None),
+            ('limiter', RateLimiter(max_concurrency=workers)),
+            ('limiter .9', RateLimiter(max_concurrency=workers,
+                                       decrease=0.9))):
+        rate, rejected = run(workers, limit, seconds, limiter)
+        print('%-10s %10.0f %10d' % (name, rate, rejected))
+
+
+if __name__ == '__main__':
+    main(*sys.argv[1:])
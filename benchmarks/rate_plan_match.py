@@ -0,0 +1,73 @@
+"""
+    Benchmark: match_product_rate_plans from queries and from the catalog
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Time per call matching every product of a generated catalog, with the
+    queries answered instantly (so only the client side is measured), with
+    the catalog snapshot scoring each call, and with its kept results.
+
+    $ python benchmarks/rate_plan_match.py [products] [seconds]
+"""
+from datetime import datetime
+from os import path
+import sys
+import time
+
+sys.path.insert(0, path.join(path.dirname(path.abspath(__file__)), '..'))
+
+from suds.sudsobject import Factory
+
+from catalog_fixture import catalog_rows
+from zuora import Zuora
+from zuora.catalog import Catalog, to_datetime
+from zuora.query_cache import query_type
+
+FILTER = {'site': 'mapmyride.com', 'gender': 'female',
+          'age_group': 'adult', 'activity_level': 'high'}
+
+
+def per_call(fn, seconds):
+    count = 0
+    start = time.time()
+    while time.time() - start < seconds:
+        fn()
+        count += 1
+    return (time.time() - start) / count
+
+
+def main(products='20', seconds='2'):
+    rows = catalog_rows(int(products))
+    seconds = float(seconds)
+
+    def query_all(query_string):
+        return rows[query_type(query_string)]
+
+    settings = {'username': 'username', 'password': 'password',
+                'wsdl_file': 'zuora.a.48.0.wsdl'}
+    queried = Zuora(settings)
+    queried.login = lambda: None
+    queried.query_all = query_all
+    queried.query = lambda query_string: Factory.object(
+                        'QueryResult', {'records': query_all(query_string)})
+
+    settings['catalog'] = Catalog()
+    cached = Zuora(settings)
+    cached.query_all = query_all
+    matcher = settings['catalog'].snapshot(cached).matcher()
+    now = to_datetime(datetime.utcnow())
+
+    print('%d products, %d rate plans, %d charges, %d tiers' % tuple(
+        len(rows[name]) for name in ('Product', 'ProductRatePlan',
+                                     'ProductRatePlanCharge',
+                                     'ProductRatePlanChargeTier')))
+    print('%-20s %14s' % ('path', 'per call'))
+    for name, fn in (
+            ('queries', lambda: queried.match_product_rate_plans([], FILTER)),
+            ('catalog, scored', lambda: matcher.score([], FILTER, now)),
+            ('catalog, kept', lambda: cached.match_product_rate_plans(
+                                                                [], FILTER))):
+        print('%-20s %12.1fus' % (name, per_call(fn, seconds) * 1000000))
+
+
+if __name__ == '__main__':
+    main(*sys.argv[1:])
@@ -0,0 +1,78 @@
+"""
+    Benchmark: REST calls with and without the pooled session
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Times AccountManager.get_account_summary against a local HTTPS stand-in,
+    through the shared keep-alive session of the ZuoraConfig and through
+    module-level requests calls (a new TCP and TLS connection per call, as
+    the managers did before). connect_latency (ms) adds a delay to every new
+    connection, standing in for the round trips to Zuora.
+
+    $ python benchmarks/rest_pool.py [calls] [connect_latency]
+"""
+from os import path
+import sys
+import time
+import warnings
+
+sys.path.insert(0, path.join(path.dirname(path.abspath(__file__)), '..'))
+
+import requests
+
+from zuora.rest_client import RestClient
+from https_standin import StandIn
+
+
+class Unpooled(object):
+    """
+    Module-level requests calls
+    """
+    def get(self, url, **kwargs):
+        return requests.get(url, verify=False, **kwargs)
+
+    def post(self, url, **kwargs):
+        return requests.post(url, verify=False, **kwargs)
+
+
+def latency(rest_client, calls):
+    timings = []
+    for _ in range(calls):
+        start = time.time()
+        rest_client.account.get_account_summary('A00000120')
+        timings.append(time.time() - start)
+    timings.sort()
+    return (sum(timings) / len(timings), timings[len(timings) // 2],
+            timings[int(len(timings) * 0.95)])
+
+
+def main(calls='200', connect_latency='0'):
+    calls, connect_latency = int(calls), float(connect_latency)
+    warnings.simplefilter('ignore')
+    with StandIn(connect_latency / 1000.0) as server:
+        settings = {'username': 'username', 'password': 'password',
+                    'base_url': server.url}
+        print('%-10s %10s %10s %10s %12s' % ('client', 'mean', 'median',
+                                             'p95', 'connections'))
+        results = {}
+        for name in ('unpooled', 'pooled'):
+            rest_client = RestClient(settings)
+            if name == 'unpooled':
+                rest_client.zuora_config.http_session = Unpooled()
+            else:
+                session = rest_client.zuora_config.http_session
+                # REQUESTS_CA_BUNDLE would override verify
+                session.trust_env = False
+                session.verify = False
+            connections = server.connections
+            results[name] = latency(rest_client, calls)
+            if name == 'pooled':
+                session.close()
+            print('%-10s %8.2fms %8.2fms %8.2fms %12d' % (
+                name, results[name][0] * 1000, results[name][1] * 1000,
+                results[name][2] * 1000, server.connections - connections))
+        print('pooled: %.1fx lower mean latency' % (
+            results['unpooled'][0] / results['pooled'][0]))
+
+
+if __name__ == '__main__':
+    main(*sys.argv[1:])
@@ -0,0 +1,133 @@
+"""
+    Benchmark: zuora_serialize with type dispatch, and its generator mode
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Serializes generated Account records (basic fields, a nested contact
+    and a list of invoices) with the recursive serializer replaced by the
+    dispatch table, with zuora_serialize_list() and with
+    zuora_serialize_iter() consumed one dict at a time. Each mode runs in
+    its own process, so the peak memory reported (max RSS above the
+    process once the records are built) is its own.
+
+    $ python benchmarks/serialize.py [records] [rounds]
+"""
+from datetime import date, datetime
+from os import path
+import resource
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, path.join(path.dirname(path.abspath(__file__)), '..'))
+
+from suds.sudsobject import Factory
+
+from zuora import zuora_serialize_iter, zuora_serialize_list
+from zuora.client import key_map
+
+MODES = ('recursive list', 'dispatch list', 'dispatch generator')
+
+
+def recursive_serialize(obj):
+    """
+    zuora_serialize() before the dispatch table
+    """
+    basic_serializer = [str, int, float, unicode, date, datetime, long]
+
+    if not obj:
+        return None
+
+    if isinstance(obj, list):
+        obj_list = []
+        for item in obj:
+            obj_list.append(recursive_serialize(item))
+        return obj_list
+    else:
+        obj_dict = {}
+        keys = key_map(obj)
+        for attr in obj:
+            key = keys[attr[0]]
+
+            is_allowed = False
+            for allowed in basic_serializer:
+                if isinstance(attr[1], allowed):
+                    is_allowed = True
+            if is_allowed:
+                obj_dict[key] = attr[1]
+            else:
+                obj_dict[key] = recursive_serialize(attr[1])
+        return obj_dict
+
+
+def recursive_serialize_list(response_list):
+    serialized_list = []
+    if response_list:
+        for item in response_list:
+            serialized_list.append(recursive_serialize(item))
+    return serialized_list
+
+
+def accounts(count):
+    created = datetime(2014, 3, 1, 10, 15)
+    records = []
+    for i in range(count):
+        records.append(Factory.object('Account', {
+            'Id': 'a%d' % i, 'AccountNumber': 'A-%d' % i,
+            'Name': u'Account %d' % i, 'Balance': i * 1.5,
+            'BillCycleDay': i % 28 + 1, 'AutoPay': bool(i % 2),
+            'Currency': 'USD', 'Status': 'Active',
+            'CreatedDate': created, 'UpdatedDate': created,
+            'PaymentTerm': 'Due Upon Receipt', 'Batch': 'Batch1',
+            'BillToContact': Factory.object('Contact', {
+                'Id': 'c%d' % i, 'FirstName': u'First %d' % i,
+                'LastName': u'Last %d' % i, 'Country': 'United States',
+                'WorkEmail': 'user%d@example.com' % i, 'State': None}),
+            'Invoices': [Factory.object('Invoice', {
+                'Id': 'i%d-%d' % (i, n), 'Amount': 9.99 * n,
+                'InvoiceDate': created, 'Status': 'Posted'})
+                for n in range(3)]}))
+    return records
+
+
+def run(mode, records, rounds):
+    """
+    Serializes the records `rounds` times in this process, and returns the
+    seconds of the fastest round and the peak memory in KB
+    """
+    records = accounts(records)
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    best = None
+    for _ in range(rounds):
+        start = time.time()
+        if mode == 'recursive list':
+            recursive_serialize_list(records)
+        elif mode == 'dispatch list':
+            zuora_serialize_list(records)
+        else:
+            for _ in zuora_serialize_iter(records):
+                pass
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - baseline
+    return best, peak
+
+
+def main(records='10000', rounds='5'):
+    print('%s Account records, each with a contact and 3 invoices'
+          % records)
+    print('%-20s %12s %12s' % ('mode', 'per round', 'peak memory'))
+    for mode in MODES:
+        output = subprocess.check_output([
+            sys.executable, path.abspath(__file__), '--mode', mode,
+            records, rounds])
+        best, peak = output.split()
+        print('%-20s %10.1fms %10.1fMB' % (mode, float(best) * 1000,
+                                           int(peak) / 1024.0))
+
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['--mode']:
+        print('%f %d' % run(sys.argv[2], int(sys.argv[3]),
+                            int(sys.argv[4])))
+    else:
+        main(*sys.argv[1:])
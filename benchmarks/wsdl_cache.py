@@ -0,0 +1,52 @@
+"""
+    Benchmark: SOAP client construction with a cold and a warm WSDL cache
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    For every shipped .wsdl file, times building the suds client of a new
+    process (an empty ClientRegistry) with the cache disabled, with an empty
+    cache directory (cold) and with the parsed WSDL already on disk (warm).
+
+    $ python benchmarks/wsdl_cache.py [repeat]
+"""
+import glob
+from os import path
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, path.join(path.dirname(path.abspath(__file__)), '..'))
+
+import zuora
+from zuora.soap_client import ClientRegistry
+
+
+def construct(wsdl_path, **settings):
+    start = time.time()
+    ClientRegistry().checkout(wsdl_path, **settings)
+    return time.time() - start
+
+
+def main(repeat=5):
+    wsdl_dir = path.abspath(path.dirname(zuora.__file__))
+    wsdl_paths = sorted(glob.glob(path.join(wsdl_dir, '*.wsdl')))
+
+    print('%-32s %10s %10s %10s %8s' % ('wsdl', 'no cache', 'cold',
+                                        'warm', 'speedup'))
+    for wsdl_path in wsdl_paths:
+        location = tempfile.mkdtemp()
+        try:
+            uncached = min(construct(wsdl_path, wsdl_cache=False)
+                           for _ in range(repeat))
+            cold = construct(wsdl_path, wsdl_cache_dir=location)
+            warm = min(construct(wsdl_path, wsdl_cache_dir=location)
+                       for _ in range(repeat))
+        finally:
+            shutil.rmtree(location)
+        print('%-32s %9.1fms %9.1fms %9.1fms %7.1fx' % (
+            path.basename(wsdl_path), uncached * 1000, cold * 1000,
+            warm * 1000, uncached / warm))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -1,4 +1,4 @@
 from client import (Zuora, convert_camel, zuora_serialize,
-                    zuora_serialize_list, ZuoraException,
-                    DoesNotExist, MissingRequired)
+                    zuora_serialize_iter, zuora_serialize_list,
+                    ZuoraException, DoesNotExist, MissingRequired)
 from rest_client import RestClient
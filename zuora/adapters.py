@@ -0,0 +1,167 @@
+"""
+    Zuora HTTP Adapters
+    ~~~~~~~~~~~~~~~~~~~
+
+    requests transport adapters shared by the SOAP and REST clients.
+"""
+import ssl
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.connectionpool import (HTTPConnectionPool,
+                                                      HTTPSConnectionPool)
+from requests.packages.urllib3.poolmanager import PoolManager
+
+import logging
+log = logging.getLogger(__name__)
+
+# Get best/highest secure protocol
+try:
+    SSL_VERSION = ssl.PROTOCOL_TLSv1_2
+except AttributeError:
+    SSL_VERSION = ssl.PROTOCOL_SSLv23
+
+
+class PoolStats(object):
+    """
+    Counters of the connection pools of an adapter, for sizing them:
+
+    hits: requests sent on an open pooled connection
+    misses: requests that had to open a connection first
+    discarded: connections closed because the pool was full
+    """
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.discarded = 0
+        self.lock = threading.Lock()
+
+    def count(self, name):
+        with self.lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def __repr__(self):
+        return '<PoolStats hits=%d misses=%d discarded=%d>' % (
+            self.hits, self.misses, self.discarded)
+
+
+class CountingHTTPSConnectionPool(HTTPSConnectionPool):
+    """
+    A connection pool updating the PoolStats of its adapter
+    """
+    stats = None
+
+    def _get_conn(self, timeout=None):
+        conn = HTTPSConnectionPool._get_conn(self, timeout)
+        # Connections dropped by the server come back with their socket
+        # closed, like new ones
+        if conn.sock is not None:
+            self.stats.count('hits')
+        else:
+            self.stats.count('misses')
+        return conn
+
+    def _put_conn(self, conn):
+        # Unlocked check, the counter may be off when threads race for the
+        # last slot
+        if self.pool is not None and self.pool.full():
+            self.stats.count('discarded')
+        HTTPSConnectionPool._put_conn(self, conn)
+
+
+class CountingPoolManager(PoolManager):
+    """
+    A pool manager whose https pools share one PoolStats
+    """
+    def __init__(self, stats, **kwargs):
+        PoolManager.__init__(self, **kwargs)
+        self.stats = stats
+        self.pool_classes_by_scheme = {'http': HTTPConnectionPool,
+                                       'https': CountingHTTPSConnectionPool}
+
+    def _new_pool(self, scheme, host, port, request_context=None):
+        pool = PoolManager._new_pool(self, scheme, host, port,
+                                     request_context)
+        pool.stats = self.stats
+        return pool
+
+
+class TLSHttpAdapter(HTTPAdapter):
+    """
+    A transport adapter for requests that uses best available secure connection protocol
+    """
+    #: Timeouts of the requests sent without a timeout (see zuora.timeouts)
+    timeouts = None
+
+    def __init__(self, *args, **kwargs):
+        self.stats = PoolStats()
+        HTTPAdapter.__init__(self, *args, **kwargs)
+
+    def send(self, request, **kwargs):
+        if kwargs.get('timeout') is None and self.timeouts is not None:
+            kwargs['timeout'] = self.timeouts.current()
+        return HTTPAdapter.send(self, request, **kwargs)
+
+    def init_poolmanager(self, connections, maxsize, block=False):
+        self.poolmanager = CountingPoolManager(self.stats,
+                                               num_pools=connections,
+                                               maxsize=maxsize,
+                                               block=block,
+                                               ssl_version=SSL_VERSION)
+
+    def preconnect(self, url, connections, verify=True):
+        """
+        Opens up to `connections` connections (at most the pool size) to the
+        host of url and leaves them in the pool, so the first requests don't
+        wait for the TCP and TLS handshakes. Connections already open count.
+
+        :param str url: https url of the host
+        :param int connections: connections to have open
+        :param verify: certificate verification, as for requests
+
+        :returns: the number of connections opened
+        """
+        pool = self.get_connection(url)
+        self.cert_verify(pool, url, verify, None)
+        # Take the connections out of the pool, as putting back more than
+        # it holds would discard them. Not counted in the stats.
+        conns = [HTTPSConnectionPool._get_conn(pool)
+                 for _ in range(min(connections, self._pool_maxsize))]
+        closed = [conn for conn in conns if conn.sock is None]
+
+        def connect(conn):
+            try:
+                conn.connect()
+            except Exception as error:
+                log.warning("Zuora: Unable to open a connection to %s. %s"
+                            % (pool.host, error))
+
+        threads = [threading.Thread(target=connect, args=(conn,))
+                   for conn in closed]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        for conn in conns:
+            pool._put_conn(conn)
+        return len([conn for conn in closed if conn.sock is not None])
+
+
+def pooled_session(pool_size=10, keep_alive=True, timeouts=None):
+    """
+    Returns a requests session keeping up to pool_size connections per host
+    open for reuse
+
+    :param int pool_size: connections kept per host
+    :param bool keep_alive: reuse connections, otherwise every request asks
+                            the server to close its connection
+    :param Timeouts timeouts: timeouts of the requests
+    """
+    session = requests.Session()
+    adapter = TLSHttpAdapter(pool_maxsize=pool_size)
+    adapter.timeouts = timeouts
+    session.mount('https://', adapter)
+    if not keep_alive:
+        session.headers['Connection'] = 'close'
+    return session
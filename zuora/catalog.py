@@ -0,0 +1,335 @@
+"""
+    Zuora Catalog
+    ~~~~~~~~~~~~~
+
+    Keeps a snapshot of the product catalog (products, product rate plans,
+    their charges and charge tiers) in memory, so get_products(),
+    get_product_rate_plans(), get_product_rate_plan_charges(),
+    get_product_rate_plan_charge_tiers() and everything built on them
+    (match_product_rate_plans(), get_product_rate_plan_charge_pricing(), the
+    get_camel_converted_* helpers) answer without a request.
+
+    The catalog is loaded on first use. Past refresh_interval seconds, only
+    the rows updated since the previous sync are queried and merged into a
+    new snapshot. UpdatedDate doesn't reveal deleted rows, so the catalog is
+    loaded in full again every reload_interval seconds.
+
+    Usage example:
+    from zuora.catalog import Catalog
+
+    # Share one catalog between every Zuora instance using the tenant
+    zuora_settings['catalog'] = Catalog(refresh_interval=300)
+    z = Zuora(zuora_settings)
+    z.match_product_rate_plans(shortcodes=['sub_bronze'])
+"""
+from datetime import date, datetime
+import threading
+import time
+
+from catalog_tables import CatalogTables
+
+import logging
+log = logging.getLogger(__name__)
+
+PRODUCT_QUERY = """
+    SELECT
+        Description, EffectiveEndDate, EffectiveStartDate,
+        Id, SKU, Name, ShortCode__c
+    FROM Product
+    """
+
+PRODUCT_RATE_PLAN_QUERY = """
+    SELECT
+        ActivityLevel__c, AgeGroup__c,
+        Description, EffectiveEndDate, EffectiveStartDate,
+        Gender__c, Id, Name,
+        Priority__c, ProductId, Site__c, Term__c
+    FROM ProductRatePlan
+    """
+
+PRODUCT_RATE_PLAN_CHARGE_QUERY = """
+    SELECT
+        AccountingCode, BillCycleDay, BillCycleType, BillingPeriod,
+        BillingPeriodAlignment, ChargeModel, ChargeType,
+        CustomImageURL__c, DefaultQuantity, Description,
+        ExclusiveOfferFlag__c,
+        HiddenBenefitText__c, Id, IncludedUnits, MaxQuantity,
+        MinQuantity, Name, NumberOfPeriod, OverageCalculationOption,
+        OverageUnusedUnitsCreditOption,
+        PriceIncreasePercentage, ProductRatePlanId,
+        RevRecCode, RevRecTriggerCondition, ShortCode__c,
+        SmoothingModel, SortOrder__c, SpecificBillingPeriod,
+        TriggerEvent, UOM, UpToPeriods,
+        UseDiscountSpecificAccountingCode
+    FROM ProductRatePlanCharge
+    """
+
+PRODUCT_RATE_PLAN_CHARGE_TIER_QUERY = """
+    SELECT
+        Currency, EndingUnit, IsOveragePrice,
+        Price, PriceFormat, ProductRatePlanChargeId,
+        StartingUnit, Tier
+    FROM ProductRatePlanChargeTier
+    """
+
+#: UpdatedDate format of the refresh queries
+UPDATED_TIMESTAMP = '%Y-%m-%dT%H:%M:%S+00:00'
+
+
+def by_id(records):
+    return dict((record.Id, record) for record in records)
+
+
+def index(records, field):
+    """
+    Returns the records grouped by the value of the field
+    """
+    grouped = {}
+    for record in records:
+        grouped.setdefault(getattr(record, field, None), []).append(record)
+    return grouped
+
+
+def to_datetime(value):
+    """
+    Returns a datetime comparable with the dates of the records (naive,
+    local time, as suds converts them). Dates, which some WSDL versions
+    use for the effective dates, and date strings are taken at midnight.
+    None is returned as is.
+    """
+    if value is None or isinstance(value, datetime):
+        return value
+    if isinstance(value, date):
+        return datetime(value.year, value.month, value.day)
+    from suds.sax.date import Date, DateTime
+    if 'T' not in value:
+        return to_datetime(Date(value).date)
+    return DateTime(value).datetime
+
+
+def effective(rate_plan, start, end=None):
+    """
+    Returns whether the rate plan is effective from start to end. Like the
+    query, a rate plan without dates isn't.
+    """
+    effective_start = to_datetime(getattr(rate_plan, 'EffectiveStartDate',
+                                          None))
+    effective_end = to_datetime(getattr(rate_plan, 'EffectiveEndDate',
+                                        None))
+    start = to_datetime(start)
+    end = to_datetime(end) or start
+    return effective_start is not None and effective_end is not None and \
+        effective_start <= start and effective_end >= end
+
+
+class CatalogSnapshot(object):
+    """
+    The catalog at one point in time, indexed by id and by parent id.
+    A snapshot is never modified (only its matcher and tables are built on
+    first use), a refresh builds a new one, so the records it returns are
+    shared and must not be modified either.
+    """
+    def __init__(self, products, rate_plans, charges, tiers, synced,
+                 loaded=None):
+        """
+        :param dict products: Product records by Id, likewise for the
+                              rate plans, charges and tiers
+        :param float synced: time.time() when the queries were sent
+        :param float loaded: time.time() of the last full load
+        """
+        self.products = products
+        self.rate_plans = rate_plans
+        self.charges = charges
+        self.tiers = tiers
+        self.synced = synced
+        self.loaded = synced if loaded is None else loaded
+        self.products_by_shortcode = index(products.values(), 'ShortCode__c')
+        self.rate_plans_by_product = index(rate_plans.values(), 'ProductId')
+        self.charges_by_rate_plan = index(charges.values(),
+                                          'ProductRatePlanId')
+        self.tiers_by_charge = index(tiers.values(),
+                                     'ProductRatePlanChargeId')
+        self.rate_plan_matcher = None
+        self.catalog_tables = None
+
+    def matcher(self):
+        """
+        Returns the RatePlanMatcher of the snapshot, built on first use
+        """
+        if self.rate_plan_matcher is None:
+            from rate_plan_matcher import RatePlanMatcher
+
+            self.rate_plan_matcher = RatePlanMatcher(self)
+        return self.rate_plan_matcher
+
+    def tables(self):
+        """
+        Returns the CatalogTables of every rate plan of the snapshot, built
+        on first use
+        """
+        if self.catalog_tables is None:
+            self.catalog_tables = CatalogTables(list(self.rate_plans.values()),
+                                                list(self.charges.values()),
+                                                list(self.tiers.values()))
+        return self.catalog_tables
+
+    def updated(self, products, rate_plans, charges, tiers, synced):
+        """
+        Returns a new snapshot with the updated records (lists) replacing
+        those with the same Id
+        """
+        merged = []
+        for current, changes in ((self.products, products),
+                                 (self.rate_plans, rate_plans),
+                                 (self.charges, charges),
+                                 (self.tiers, tiers)):
+            records = dict(current)
+            records.update(by_id(changes))
+            merged.append(records)
+        return CatalogSnapshot(*merged, synced=synced, loaded=self.loaded)
+
+    def get_products(self, product_id=None, shortcodes=None):
+        """
+        Same arguments and records as Zuora.get_products()
+        """
+        if product_id:
+            product = self.products.get(product_id)
+            return [product] if product is not None else []
+        if shortcodes:
+            return [product for code in shortcodes
+                    for product in self.products_by_shortcode.get(code, [])]
+        return list(self.products.values())
+
+    def get_product_rate_plans(self, product_rate_plan_id=None,
+                               product_id_list=None, effective_start=None,
+                               effective_end=None):
+        """
+        Same arguments and records as Zuora.get_product_rate_plans()
+        """
+        if product_rate_plan_id:
+            rate_plan = self.rate_plans.get(product_rate_plan_id)
+            return [rate_plan] if rate_plan is not None else []
+        if product_id_list:
+            rate_plans = [rate_plan for product_id in product_id_list
+                          for rate_plan in
+                          self.rate_plans_by_product.get(product_id, [])]
+        else:
+            rate_plans = list(self.rate_plans.values())
+        if effective_start:
+            start = to_datetime(effective_start)
+            end = to_datetime(effective_end or effective_start)
+            rate_plans = [rate_plan for rate_plan in rate_plans
+                          if effective(rate_plan, start, end)]
+        return rate_plans
+
+    def get_product_rate_plan_charges(self, product_rate_plan_id=None,
+                                      product_rate_plan_id_list=None,
+                                      product_rate_plan_charge_id=None):
+        """
+        Same arguments and records as Zuora.get_product_rate_plan_charges()
+        """
+        if product_rate_plan_id:
+            return list(self.charges_by_rate_plan.get(product_rate_plan_id,
+                                                      []))
+        if product_rate_plan_charge_id:
+            charge = self.charges.get(product_rate_plan_charge_id)
+            return [charge] if charge is not None else []
+        return [charge for rate_plan_id in product_rate_plan_id_list or []
+                for charge in self.charges_by_rate_plan.get(rate_plan_id, [])]
+
+    def get_product_rate_plan_charge_tiers(
+                                    self,
+                                    product_rate_plan_charge_id=None,
+                                    product_rate_plan_charge_id_list=None):
+        """
+        Same arguments and records as
+        Zuora.get_product_rate_plan_charge_tiers()
+        """
+        if product_rate_plan_charge_id:
+            product_rate_plan_charge_id_list = [product_rate_plan_charge_id]
+        return [tier for charge_id in product_rate_plan_charge_id_list or []
+                for tier in self.tiers_by_charge.get(charge_id, [])]
+
+
+class Catalog(object):
+    """
+    Holds the current CatalogSnapshot, shared by the threads (and the Zuora
+    instances) of a process. While one thread refreshes the snapshot, the
+    others keep using the previous one.
+    """
+    def __init__(self, refresh_interval=300, reload_interval=3600,
+                 margin=300):
+        """
+        :param int refresh_interval: seconds after which the updated rows
+                                     are fetched, None never to refresh
+        :param int reload_interval: seconds after which the whole catalog
+                                    is fetched again, None never to reload
+        :param int margin: seconds of overlap between two refreshes, for
+                           the clock difference with Zuora
+        """
+        self.refresh_interval = refresh_interval
+        self.reload_interval = reload_interval
+        self.margin = margin
+        self.current = None
+        self.lock = threading.Lock()
+
+    def snapshot(self, zuora):
+        """
+        Returns the current snapshot, loaded or refreshed through the zuora
+        instance when needed
+        """
+        current = self.current
+        if current is None:
+            with self.lock:
+                if self.current is None:
+                    self.load(zuora)
+            return self.current
+
+        now = time.time()
+        if self.reload_interval is not None and \
+                now - current.loaded >= self.reload_interval:
+            update = self.load
+        elif self.refresh_interval is not None and \
+                now - current.synced >= self.refresh_interval:
+            update = self.refresh
+        else:
+            return current
+
+        # Refreshed by another thread meanwhile
+        if self.lock.acquire(False):
+            try:
+                if self.current is current:
+                    update(zuora)
+            except Exception as error:
+                log.warning("Zuora: Unable to refresh the catalog. %s"
+                            % error)
+            finally:
+                self.lock.release()
+        return self.current
+
+    def load(self, zuora):
+        """
+        Fetches the whole catalog
+        """
+        synced = time.time()
+        self.current = CatalogSnapshot(
+            by_id(zuora.query_all(PRODUCT_QUERY)),
+            by_id(zuora.query_all(PRODUCT_RATE_PLAN_QUERY)),
+            by_id(zuora.query_all(PRODUCT_RATE_PLAN_CHARGE_QUERY)),
+            by_id(zuora.query_all(PRODUCT_RATE_PLAN_CHARGE_TIER_QUERY)),
+            synced)
+
+    def refresh(self, zuora):
+        """
+        Fetches the rows updated since the last sync
+        """
+        synced = time.time()
+        since = datetime.utcfromtimestamp(self.current.synced - self.margin)
+        where = " WHERE UpdatedDate >= '%s'" % since.strftime(
+                                                        UPDATED_TIMESTAMP)
+        self.current = self.current.updated(
+            zuora.query_all(PRODUCT_QUERY + where),
+            zuora.query_all(PRODUCT_RATE_PLAN_QUERY + where),
+            zuora.query_all(PRODUCT_RATE_PLAN_CHARGE_QUERY + where),
+            zuora.query_all(PRODUCT_RATE_PLAN_CHARGE_TIER_QUERY + where),
+            synced)
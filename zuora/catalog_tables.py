@@ -0,0 +1,262 @@
+"""
+    Zuora Catalog Tables
+    ~~~~~~~~~~~~~~~~~~~~
+
+    Columnar form of the rate plan charges and their tiers, for catalog
+    analytics. Every field is one column: prices and units are arrays of
+    doubles (NaN for no value), references to the charge, rate plan and
+    product are arrays of row numbers, and repeated strings (currency,
+    charge model, ...) are arrays of codes into a list of the values.
+    Aggregations then run as a single pass over a few arrays, instead of
+    walking the nested dictionaries of the get_camel_converted_* helpers
+    and converting their strings back to numbers.
+
+    The tiers are stored by charge and starting unit, so the tiers of a
+    charge are one range of rows.
+
+    Usage example:
+    tables = z.get_catalog_tables()
+    tables.rate_plan_totals(currency='USD')
+    tables.product_price_range(currency='USD')
+    row = tables.find_tier(product_rate_plan_charge_id, quantity=25)
+    tables.tier(row)['Price']
+"""
+from array import array
+from bisect import bisect_right
+
+NAN = float('nan')
+
+
+def number(value):
+    return NAN if value is None else float(value)
+
+
+def isnan(value):
+    return value != value
+
+
+def optional(value):
+    return None if isnan(value) else value
+
+
+class Codes(object):
+    """
+    The distinct values of a string column, and their codes
+    """
+    def __init__(self):
+        self.values = []
+        self.codes = {}
+
+    def code(self, value):
+        code = self.codes.get(value)
+        if code is None:
+            code = self.codes[value] = len(self.values)
+            self.values.append(value)
+        return code
+
+
+class CatalogTables(object):
+    """
+    The charges and tiers of a set of rate plans, one array per field.
+
+    Rows are numbered from 0 in each table. index maps the ids of each table
+    to their row.
+    """
+    def __init__(self, rate_plans, charges, tiers):
+        """
+        :param list rate_plans: ProductRatePlan records
+        :param list charges: their ProductRatePlanCharge records
+        :param list tiers: the ProductRatePlanChargeTier records of the
+                           charges
+        """
+        # Rate plans
+        self.rate_plan_ids = [rate_plan.Id for rate_plan in rate_plans]
+        self.rate_plan_index = dict(
+            (rate_plan_id, row)
+            for row, rate_plan_id in enumerate(self.rate_plan_ids))
+        self.product_ids = []
+        self.product_index = {}
+        self.rate_plan_product = array('l')
+        for rate_plan in rate_plans:
+            product_id = getattr(rate_plan, 'ProductId', None)
+            row = self.product_index.get(product_id)
+            if row is None:
+                row = self.product_index[product_id] = len(self.product_ids)
+                self.product_ids.append(product_id)
+            self.rate_plan_product.append(row)
+
+        # Charges of the rate plans
+        charges = [charge for charge in charges
+                   if getattr(charge, 'ProductRatePlanId', None)
+                   in self.rate_plan_index]
+        self.charge_ids = [charge.Id for charge in charges]
+        self.charge_index = dict(
+            (charge_id, row) for row, charge_id in enumerate(self.charge_ids))
+        self.charge_rate_plan = array('l', [
+            self.rate_plan_index[charge.ProductRatePlanId]
+            for charge in charges])
+        self.charge_models = Codes()
+        self.charge_model = array('l', [
+            self.charge_models.code(getattr(charge, 'ChargeModel', None))
+            for charge in charges])
+        self.charge_types = Codes()
+        self.charge_type = array('l', [
+            self.charge_types.code(getattr(charge, 'ChargeType', None))
+            for charge in charges])
+
+        # Tiers of the charges, by charge and starting unit
+        tiers = sorted(
+            [tier for tier in tiers
+             if getattr(tier, 'ProductRatePlanChargeId', None)
+             in self.charge_index],
+            key=lambda tier: (
+                self.charge_index[tier.ProductRatePlanChargeId],
+                number(getattr(tier, 'StartingUnit', None))))
+        self.tier_ids = [getattr(tier, 'Id', None) for tier in tiers]
+        self.tier_index = dict((tier_id, row)
+                               for row, tier_id in enumerate(self.tier_ids)
+                               if tier_id is not None)
+        self.tier_charge = array('l', [
+            self.charge_index[tier.ProductRatePlanChargeId] for tier in tiers])
+        self.price = array('d', [number(getattr(tier, 'Price', None))
+                                 for tier in tiers])
+        self.starting_unit = array('d', [
+            number(getattr(tier, 'StartingUnit', None)) for tier in tiers])
+        self.ending_unit = array('d', [
+            number(getattr(tier, 'EndingUnit', None)) for tier in tiers])
+        self.overage = array('b', [
+            bool(getattr(tier, 'IsOveragePrice', False)) for tier in tiers])
+        self.tier_number = array('l', [
+            int(getattr(tier, 'Tier', None) or 0) for tier in tiers])
+        self.currencies = Codes()
+        self.currency = array('l', [
+            self.currencies.code(getattr(tier, 'Currency', None))
+            for tier in tiers])
+        self.price_formats = Codes()
+        self.price_format = array('l', [
+            self.price_formats.code(getattr(tier, 'PriceFormat', None))
+            for tier in tiers])
+
+        # The tiers of charge i are the rows tier_start[i]:tier_end[i]
+        self.tier_start = array('l', [0] * len(self.charge_ids))
+        self.tier_end = array('l', [0] * len(self.charge_ids))
+        for row, charge in enumerate(self.tier_charge):
+            if self.tier_end[charge] == 0:
+                self.tier_start[charge] = row
+            self.tier_end[charge] = row + 1
+
+    def currency_filter(self, currency):
+        """
+        Returns the code of the currency, None for every currency, or -1
+        when no tier has the currency
+        """
+        if currency is None:
+            return None
+        return self.currencies.codes.get(currency, -1)
+
+    def rate_plan_totals(self, currency=None):
+        """
+        Returns {product_rate_plan_id: price}, the sum of the non-overage
+        tier prices of every rate plan, in the currency (or all of them)
+        """
+        code = self.currency_filter(currency)
+        totals = [0.0] * len(self.rate_plan_ids)
+        charge_rate_plan = self.charge_rate_plan
+        for charge, price, overage, tier_currency in zip(
+                self.tier_charge, self.price, self.overage, self.currency):
+            if overage or isnan(price) or \
+                    (code is not None and tier_currency != code):
+                continue
+            totals[charge_rate_plan[charge]] += price
+        return dict(zip(self.rate_plan_ids, totals))
+
+    def product_price_range(self, currency=None):
+        """
+        Returns {product_id: (lowest, highest)}, of the non-overage tier
+        prices of the rate plans of every product, in the currency (or all
+        of them). Products without such prices are left out.
+        """
+        code = self.currency_filter(currency)
+        lowest = [NAN] * len(self.product_ids)
+        highest = [NAN] * len(self.product_ids)
+        charge_rate_plan = self.charge_rate_plan
+        rate_plan_product = self.rate_plan_product
+        for charge, price, overage, tier_currency in zip(
+                self.tier_charge, self.price, self.overage, self.currency):
+            if overage or isnan(price) or \
+                    (code is not None and tier_currency != code):
+                continue
+            product = rate_plan_product[charge_rate_plan[charge]]
+            # NaN compares False, so the first price replaces it
+            if not lowest[product] <= price:
+                lowest[product] = price
+            if not highest[product] >= price:
+                highest[product] = price
+        return dict((product_id, (lowest[row], highest[row]))
+                    for row, product_id in enumerate(self.product_ids)
+                    if not isnan(lowest[row]))
+
+    def find_tier(self, product_rate_plan_charge_id, quantity, currency=None):
+        """
+        Returns the row of the non-overage tier of the charge covering the
+        quantity (the last one starting at or below it, if it doesn't end
+        below it), or None
+        """
+        charge = self.charge_index.get(product_rate_plan_charge_id)
+        if charge is None:
+            return None
+        start, end = self.tier_start[charge], self.tier_end[charge]
+        code = self.currency_filter(currency)
+        row = bisect_right(self.starting_unit, quantity, start, end) - 1
+        while row >= start:
+            if not self.overage[row] and \
+                    (code is None or self.currency[row] == code):
+                ending_unit = self.ending_unit[row]
+                if isnan(ending_unit) or quantity <= ending_unit:
+                    return row
+                return None
+            row -= 1
+        return None
+
+    def find_tiers(self, product_rate_plan_charge_id, quantities,
+                   currency=None):
+        """
+        Returns the rows of the tiers covering each of the quantities
+        (see find_tier())
+        """
+        return [self.find_tier(product_rate_plan_charge_id, quantity,
+                               currency) for quantity in quantities]
+
+    def tier(self, row):
+        """
+        Returns the fields of a tier row, by their Zuora names (None for no
+        value)
+        """
+        charge = self.tier_charge[row]
+        return {
+            'Id': self.tier_ids[row],
+            'ProductRatePlanChargeId': self.charge_ids[charge],
+            'ProductRatePlanId':
+                self.rate_plan_ids[self.charge_rate_plan[charge]],
+            'Currency': self.currencies.values[self.currency[row]],
+            'Price': optional(self.price[row]),
+            'PriceFormat': self.price_formats.values[self.price_format[row]],
+            'StartingUnit': optional(self.starting_unit[row]),
+            'EndingUnit': optional(self.ending_unit[row]),
+            'IsOveragePrice': bool(self.overage[row]),
+            'Tier': self.tier_number[row],
+        }
+
+    def charge(self, product_rate_plan_charge_id):
+        """
+        Returns the fields of a charge, and the rows of its tiers
+        """
+        row = self.charge_index[product_rate_plan_charge_id]
+        return {
+            'Id': product_rate_plan_charge_id,
+            'ProductRatePlanId':
+                self.rate_plan_ids[self.charge_rate_plan[row]],
+            'ChargeModel': self.charge_models.values[self.charge_model[row]],
+            'ChargeType': self.charge_types.values[self.charge_type[row]],
+            'tiers': range(self.tier_start[row], self.tier_end[row]),
+        }
@@ -15,22 +15,18 @@
 
     z = zuora.Zuora(SETTINGS)
     account = z.get_account(23432)
+
+    Importing this module doesn't load suds or requests, so the classes built
+    on them live in the modules imported on first use: TLSHttpAdapter and
+    SSL_VERSION in zuora.adapters, RequestsTransport in zuora.soap_client.
+    They can't be imported from this module since version 1.1 (see the
+    README).
 """
 from datetime import datetime, date
 from os import path
 import re
-import ssl
-
-from suds import WebFault
-from suds.client import Client
-from suds.sax.element import Element
-from suds.transport import Reply
-from suds.transport.http import HttpAuthenticated
-from suds.xsd.doctor import Import, ImportDoctor
-
-import requests
-from requests.adapters import HTTPAdapter
-from requests.packages.urllib3.poolmanager import PoolManager
+import threading
+import time
 
 import logging
 log = logging.getLogger(__name__)
@@ -42,13 +38,17 @@ log_suds.propagate = False
 SOAP_TIMESTAMP = '%Y-%m-%dT%H:%M:%S-06:00'
 
 
+from catalog import (PRODUCT_QUERY, PRODUCT_RATE_PLAN_QUERY,
+                     PRODUCT_RATE_PLAN_CHARGE_QUERY,
+                     PRODUCT_RATE_PLAN_CHARGE_TIER_QUERY, to_datetime)
+from catalog_tables import CatalogTables
+from hedging import LatencyTracker, hedged_call
+from query_cache import (AMEND_TYPES, SUBSCRIBE_TYPES, object_types,
+                         query_key, query_type, written_types)
+from rate_limiter import RateLimitExceeded
 from rest_client import RestClient
-
-# Get best/highest secure protocol
-try:
-    SSL_VERSION = ssl.PROTOCOL_TLSv1_2
-except AttributeError:
-    SSL_VERSION = ssl.PROTOCOL_SSLv23
+from timeouts import (DEFAULT_TIMEOUT, Timeouts, bind, check_deadline,
+                      operation, with_deadline)
 
 
 class ZuoraException(Exception):
@@ -68,46 +68,115 @@ class MissingRequired(ZuoraException):
     pass
 
 
-class TLSHttpAdapter(HTTPAdapter):
+def invalid_session(error):
+    """
+    Returns whether the error is Zuora's INVALID_SESSION fault (a suds
+    WebFault or a QueryFault)
+    """
+    fault = getattr(error, 'fault', error)
+    faultcode = getattr(fault, 'faultcode', None) or ''
+    return faultcode.split(':')[-1] == 'INVALID_SESSION'
+
+
+def exceeded_limit(error):
     """
-    A transport adapter for requests that uses best available secure connection protocol
+    Returns whether Zuora rejected the call for exceeding a rate or
+    concurrency limit (HTTP 429, or the REQUEST_EXCEEDED_LIMIT fault)
     """
-    def init_poolmanager(self, connections, maxsize, block=False):
-        self.poolmanager = PoolManager(num_pools=connections,
-                                       maxsize=maxsize,
-                                       block=block,
-                                       ssl_version=SSL_VERSION)
+    if isinstance(error, RateLimitExceeded):
+        return True
+    fault = getattr(error, 'fault', error)
+    faultcode = getattr(fault, 'faultcode', None) or ''
+    return faultcode.split(':')[-1] == 'REQUEST_EXCEEDED_LIMIT'
+
 
+#: ThreadPools of query_chunked() by size, shared by the Zuora instances
+query_pools = {}
+query_pools_lock = threading.Lock()
 
-class RequestsTransport(HttpAuthenticated):
+
+def shared_query_pool(size):
     """
-    A transport adapter for suds that uses the requests library.
+    Returns the thread pool of `size` threads, built on first use. The
+    instances share the pools, so creating a Zuora per request or tenant
+    doesn't start new threads.
     """
-    def __init__(self, **kwargs):
-        # super won't work because not using new style class
-        HttpAuthenticated.__init__(self, **kwargs)
-        self.session = requests.Session()
-        self.session.mount('https://', TLSHttpAdapter())
+    pool = query_pools.get(size)
+    if pool is None:
+        with query_pools_lock:
+            pool = query_pools.get(size)
+            if pool is None:
+                from multiprocessing.pool import ThreadPool
 
-    def send(self, request):
-        self.addcredentials(request)
-        resp = self.session.post(request.url, data=request.message, headers=request.headers)
-        result = Reply(resp.status_code, resp.headers, resp.content)
-        return result
+                pool = query_pools[size] = ThreadPool(size)
+    return pool
+
+
+class lazy_property(object):
+    """
+    Computes the attribute on first access and stores it on the instance,
+    where it can also be replaced by assignment. Threads accessing it first
+    at the same time wait for a single computation.
+    """
+    def __init__(self, fn):
+        self.fn = fn
+        self.__doc__ = fn.__doc__
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self
+        name = self.fn.__name__
+        # One lock per instance, reentrant as properties use one another
+        lock = instance.__dict__.get('lazy_property_lock')
+        if lock is None:
+            lock = instance.__dict__.setdefault('lazy_property_lock',
+                                                threading.RLock())
+        with lock:
+            if name not in instance.__dict__:
+                instance.__dict__[name] = self.fn(instance)
+            return instance.__dict__[name]
+
+
+class Prefetch(threading.Thread):
+    """
+    Calls fn(*args) on a background thread. result() waits for the call and
+    returns its value or raises its exception.
+    """
+    def __init__(self, fn, *args):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        # Keeps the deadline of the caller
+        self.fn = bind(fn)
+        self.args = args
+        self.value = None
+        self.error = None
+        self.start()
+
+    def run(self):
+        try:
+            self.value = self.fn(*self.args)
+        except Exception as error:
+            self.error = error
+
+    def result(self):
+        self.join()
+        if self.error is not None:
+            raise self.error
+        return self.value
 
 
 # main class
 class Zuora:
 
-    #: Soap Service Client
-    client = None
-
     #: Currency
     currency = 'USD'
 
-    #: SessionID (TODO: put this into memcache)
+    #: SessionID (shared between processes by the session_store setting)
     session_id = None
 
+    #: When the session was created (time.time())
+    session_created = None
+
     def __init__(self, zuora_settings):
         """
         Usage example:
@@ -125,33 +194,164 @@ class Zuora:
         test_users : str : Used if you only desire to create test user
                            accounts. Adds the custom field Test_Account__c
                            to all created users.
+        wsdl_cache : bool : Cache the parsed wsdl on disk (default True)
+        wsdl_cache_dir : str : Directory for the parsed wsdl cache
+                               (defaults to ~/.cache/zuora-wsdl), must be
+                               owned by the user and not writable by others
+        fast_query : bool : Send query and queryMore from a prebuilt
+                            envelope instead of marshalling them with suds
+                            (default False)
+        native_query : bool : Parse query and queryMore replies into compact
+                              records instead of suds objects, implies
+                              fast_query (default False)
+        query_chunk_size : int : Most conditions OR'ed in one query by
+                                 query_chunked() (default 200)
+        query_max_filter_length : int : Longest WHERE clause sent by
+                                        query_chunked() (default 8000)
+        query_pool_size : int : Concurrent queries run by query_chunked(),
+                                on a pool shared by the instances with the
+                                same size (default 4)
+        session_store : SessionStore : Shares the session between processes
+                                       (see zuora.session_store)
+        session_refresh : bool : Log in from a background thread and renew
+                                 the sessions before they expire
+                                 (default False)
+        session_max_age : int : Seconds a Zuora session lasts (default 900)
+        rate_limiter : RateLimiter : Paces the SOAP and REST calls, share it
+                                     between the instances using the tenant
+                                     (see zuora.rate_limiter)
+        timeout : tuple : (connect, read) seconds of the SOAP and REST
+                          requests, None to wait forever (default (10, 60))
+        operation_timeouts : dict : (connect, read) seconds per operation
+                                    ('query', 'subscribe', 'invoice_pdf', or
+                                    the name of a REST manager method), see
+                                    zuora.timeouts. Only these apply when
+                                    timeout is None, not the built-in ones.
+        pool_size : int : SOAP connections kept open to Zuora (default 10)
+        pool_block : bool : Wait for a pooled SOAP connection when all are in
+                            use, instead of opening an extra one
+                            (default False)
+        pool_preconnect : int : SOAP connections opened when the client is
+                                built, before the first call (default 0)
+        hedge_queries : bool : Send a query again when it is slower than
+                               usual, using the first answer
+                               (default False)
+        hedge_percentile : float : Percentile of the recent query latencies
+                                   after which a query is sent again
+                                   (default 95)
+        query_latency : LatencyTracker : Recent query latencies the hedging
+                                         is based on, share it between the
+                                         instances using the tenant, since
+                                         hedging starts after 20 queries
+                                         (see zuora.hedging)
+        query_cache : QueryCache : Caches the replies of query(), dropping
+                                   the object types written through this
+                                   instance (see zuora.query_cache)
+        catalog : Catalog : Answers the product catalog queries from an
+                            in-memory snapshot, refreshed every few minutes
+                            (see zuora.catalog)
+
+        The wsdl_cache, wsdl_cache_dir, pool_size and pool_block settings
+        only apply to the first instance using the wsdl file in the process,
+        which loads it: the later ones share its client, and their different
+        values are logged and ignored.
         """
         # Assign settings
+        self.zuora_settings = zuora_settings
         self.username = zuora_settings["username"]
         self.password = zuora_settings["password"]
         self.wsdl_file = zuora_settings["wsdl_file"]
         self.base_dir = path.dirname(__file__)
         self.authorize_gateway = zuora_settings.get("gateway_name", None)
         self.create_test_users = zuora_settings.get("test_users", None)
+        self.native_query = zuora_settings.get("native_query", False)
+        self.fast_query = zuora_settings.get("fast_query", False) or \
+                                                        self.native_query
+        self.query_chunk_size = zuora_settings.get("query_chunk_size", 200)
+        self.query_max_filter_length = zuora_settings.get(
+                                            "query_max_filter_length", 8000)
+        self.query_pool_size = zuora_settings.get("query_pool_size", 4)
+        self.session_store = zuora_settings.get("session_store")
+        self.login_lock = threading.RLock()
+        self.session_max_age = zuora_settings.get("session_max_age", 900)
+        self.rate_limiter = zuora_settings.get("rate_limiter")
+        self.hedge_queries = zuora_settings.get("hedge_queries", False)
+        self.hedge_percentile = zuora_settings.get("hedge_percentile", 95)
+        self.query_latency = zuora_settings.get("query_latency") or \
+                                                            LatencyTracker()
+        self.query_cache = zuora_settings.get("query_cache")
+        self.catalog = zuora_settings.get("catalog")
+        self.timeouts = Timeouts(
+                            zuora_settings.get("timeout", DEFAULT_TIMEOUT),
+                            zuora_settings.get("operation_timeouts"))
+        self.session_refresher = None
+        if zuora_settings.get("session_refresh"):
+            from session_refresher import SessionRefresher
+
+            self.session_refresher = SessionRefresher(self,
+                                                      self.session_max_age)
+            self.session_refresher.start()
+
+    @lazy_property
+    def client(self):
+        """
+        Soap Service Client, built on first use. The parsed wsdl is shared
+        with every other instance using the same wsdl file.
+        """
+        from soap_client import client_registry
+
+        wsdl_path = path.abspath(self.base_dir + "/" + self.wsdl_file)
+        client = client_registry.checkout(
+                    wsdl_path,
+                    wsdl_cache=self.zuora_settings.get("wsdl_cache", True),
+                    wsdl_cache_dir=self.zuora_settings.get("wsdl_cache_dir"),
+                    pool_size=self.zuora_settings.get("pool_size", 10),
+                    pool_block=self.zuora_settings.get("pool_block", False))
+        client.options.transport.timeouts = self.timeouts
+        preconnect = self.zuora_settings.get("pool_preconnect")
+        if preconnect:
+            client.preconnect(preconnect)
+        return client
+
+    def pool_stats(self):
+        """
+        Returns the PoolStats (hits, misses, discarded) of the SOAP
+        connections, shared by every instance using the same wsdl file
+        """
+        return self.client.options.transport.pool_stats
 
-        # Build Client
-        imp = Import('http://object.api.zuora.com/')
-        imp.filter.add('http://api.zuora.com/')
-        imp.filter.add('http://fault.api.zuora.com/')
-        schema_doctor = ImportDoctor(imp)
+    @lazy_property
+    def query_pool(self):
+        """
+        Thread pool running the chunks of query_chunked(), shared by every
+        instance with the same query_pool_size
+        """
+        return shared_query_pool(self.query_pool_size)
 
-        wsdl_file = 'file://%s' % path.abspath(
-                                    self.base_dir + "/" + self.wsdl_file)
+    @lazy_property
+    def session_key(self):
+        """
+        Key of the session in the session_store
+        """
+        from session_store import session_key
 
-        self.client = Client(url=wsdl_file, doctor=schema_doctor,
-                             cache=None,
-                             transport=RequestsTransport())
+        return session_key(self.username, self.wsdl_file)
 
-        # Force No Cache
-        self.client.set_options(cache=None)
+    @lazy_property
+    def query_tenant(self):
+        """
+        Tenant part of the query_cache keys: the user, the wsdl file, and the
+        form of the replies
+        """
+        return '%s\0%s\0%s' % (self.username, self.wsdl_file,
+                                 'native' if self.native_query else 'suds')
 
-        # Create the rest client
-        self.rest_client = RestClient(zuora_settings)
+    @lazy_property
+    def rest_client(self):
+        """
+        REST API Client, built on first use
+        """
+        return RestClient(self.zuora_settings)
 
     # Client Create
     def call(self, fn, *args, **kwargs):
@@ -162,14 +362,67 @@ class Zuora:
         :returns: the client response
         """
         try:
+            check_deadline()
             self.login()
-            response = fn(*args, **kwargs)
+            session_id = self.session_id
+            try:
+                response = self.limited_call(fn, *args, **kwargs)
+            except Exception as error:
+                if not invalid_session(error):
+                    raise
+                # The session expired, retry once with a new one
+                log.info("Zuora: Invalid session, logging in again.")
+                self.relogin(session_id)
+                response = self.limited_call(fn, *args, **kwargs)
         except Exception as error:
             log.error("Zuora: Unexpected Error. %s" % error)
             raise ZuoraException("Zuora: Unexpected Error. %s" % error)
 
         return response
 
+    def read_call(self, fn, *args, **kwargs):
+        """
+        Calls fn like call(), hedged (see zuora.hedging) when hedge_queries
+        is set. Only for calls without side effects.
+        """
+        if not self.hedge_queries:
+            return self.call(fn, *args, **kwargs)
+        return hedged_call(self.query_latency, self.hedge_percentile,
+                           self.call, fn, *args, **kwargs)
+
+    def write_call(self, obj_types, fn, *args, **kwargs):
+        """
+        Calls fn like call(), then drops the replies of the object types from
+        the query_cache (even when the call failed, it may have written some)
+        """
+        try:
+            return self.call(fn, *args, **kwargs)
+        finally:
+            if self.query_cache is not None:
+                self.query_cache.invalidate(obj_types)
+
+    def limited_call(self, fn, *args, **kwargs):
+        """
+        Calls fn when the rate_limiter allows, repeating it (up to
+        max_retries times) when Zuora rejects it for exceeding a limit
+        """
+        limiter = self.rate_limiter
+        if limiter is None:
+            return fn(*args, **kwargs)
+        retries = 0
+        while True:
+            with limiter.slot() as slot:
+                try:
+                    return fn(*args, **kwargs)
+                except Exception as error:
+                    if not exceeded_limit(error):
+                        raise
+                    slot.throttle(getattr(error, 'retry_after', None))
+                    if retries >= limiter.max_retries:
+                        raise
+            retries += 1
+            log.info("Zuora: Request limit exceeded, retrying.")
+
     def amend(self, z_object):
         """
         Use create() to create one or more objects of a specific type.
@@ -184,7 +437,7 @@ class Zuora:
         fn = self.client.service.amend
 
         log.info("***Zuora Create Request: %s" % z_object)
-        response = self.call(fn, z_object)
+        response = self.write_call(AMEND_TYPES, fn, z_object)
         log.debug(self.client.last_sent())
         log.debug(self.client.last_received())
         log.info("***Zuora Create Response: %s" % response)
@@ -206,13 +459,8 @@ class Zuora:
         # Call Create
         fn = self.client.service.create
 
-        call_options = self.client.factory.create('CallOptions')
-        call_options.useSingleTransaction = True
-
-        self.client.set_options(soapheaders=[call_options])
-
         log.info("***Zuora Create Request: %s" % z_object)
-        response = self.call(fn, z_object)
+        response = self.write_call(object_types(z_object), fn, z_object)
         log.debug(self.client.last_sent())
         log.debug(self.client.last_received())
         log.info("***Zuora Create Response: %s" % response)
@@ -233,7 +481,8 @@ class Zuora:
 
         # Call Update
         fn = self.client.service.delete
-        response = self.call(fn, obj_type, id_list)
+        response = self.write_call(written_types(obj_type), fn, obj_type,
+                                   id_list)
 
         # return the response
         return response
@@ -243,15 +492,41 @@ class Zuora:
         """
         Creates the SOAP SessionHeader with the correct session_id from Zuora
 
-        TODO: investigate methodology to persist session_id across sessions
-        - look at custom capabilities -- sqlalchemy caching - WEB-935 perhaps
+        With a session_store, the session stored by another process is
+        reused. Otherwise one process logs in while holding the store lock,
+        and the others wait for its session. Likewise the threads sharing an
+        instance wait for the first one to log in.
         """
         if self.session_id:
             return
 
-        login_response = self.client.service.login(username=self.username,
-                                                   password=self.password)
-        self.session_id = login_response.Session
+        with self.login_lock:
+            # Logged in by another thread while waiting
+            if self.session_id:
+                return
+
+            if self.session_store is None:
+                session_id = self.new_session()
+                session_created = time.time()
+            else:
+                key = self.session_key
+                stored = self.session_store.get(key)
+                if stored is None:
+                    with self.session_store.lock(key):
+                        # Logged in by another process while waiting
+                        stored = self.session_store.get(key)
+                        if stored is None:
+                            stored = (self.new_session(), time.time())
+                            self.session_store.set(key, stored[0])
+                session_id, session_created = stored
+            self.set_session(session_id, session_created)
+
+    def set_session(self, session_id, session_created):
+        """
+        Sets the SOAP SessionHeader of the session. Called under login_lock,
+        so calls switch from one session to the other at once.
+        """
+        from suds.sax.element import Element
 
         # Define Session Namespace
         session_namespace = ('ns1', 'http://api.zuora.com/')
@@ -259,7 +534,7 @@ class Zuora:
         # Create a session element to hold the value of result.Session
         # from our login call
         session = Element('session', ns=session_namespace)\
-                    .setText(self.session_id)
+                    .setText(session_id)
 
         # Create a session_header element to enclose the session element
         SessionHeader = Element('SessionHeader', ns=session_namespace)
@@ -271,6 +546,65 @@ class Zuora:
         # Append the session element inside the session_header element
         SessionHeader.append(session)
         self.client.set_options(soapheaders=[SessionHeader, CallOptions])
+        # Set last, threads seeing it must find the headers in place
+        self.session_created = session_created
+        self.session_id = session_id
+
+    def relogin(self, expired_session_id):
+        """
+        Replaces an expired session. Of the threads finding the session
+        expired, the first logs in and the others get its session.
+
+        :param str expired_session_id: the session rejected by Zuora
+        """
+        with self.login_lock:
+            if self.session_id != expired_session_id:
+                return
+            if self.session_store is not None:
+                self.session_store.delete(self.session_key,
+                                          expired_session_id)
+            self.session_id = None
+            self.login()
+
+    def refresh_session(self):
+        """
+        Replaces the session before it expires (see the session_refresh
+        setting). The new session is obtained without holding login_lock,
+        so calls made meanwhile keep using the current session until the
+        new one is swapped in.
+        """
+        current = self.session_id
+        if not current:
+            return self.login()
+
+        if self.session_store is None:
+            session_id, session_created = self.new_session(), time.time()
+        else:
+            key = self.session_key
+            stored = self.session_store.get(key)
+            if stored is None or stored[0] == current:
+                with self.session_store.lock(key):
+                    # Refreshed by another process while waiting
+                    stored = self.session_store.get(key)
+                    if stored is None or stored[0] == current:
+                        stored = (self.new_session(), time.time())
+                        self.session_store.set(key, stored[0])
+            session_id, session_created = stored
+
+        with self.login_lock:
+            # Unless the session was replaced meanwhile (see relogin())
+            if self.session_id == current:
+                self.set_session(session_id, session_created)
+
+    def new_session(self):
+        """
+        Logs in to Zuora
+
+        :returns: the new session id
+        """
+        login_response = self.client.service.login(username=self.username,
+                                                   password=self.password)
+        return login_response.Session
 
     def query(self, query_string):
         """
@@ -287,9 +621,27 @@ class Zuora:
         # format query string (remove linebreaks, tabs, etc.)
         query_string = ' '.join(query_string.split())
 
+        cache = self.query_cache
+        obj_type = query_type(query_string)
+        if cache is not None and obj_type is not None:
+            key = query_key(self.query_tenant, query_string)
+            response = cache.get(key)
+            if response is not None:
+                return response
+            started = time.time()
+
         # Call Query
-        fn = self.client.service.query
-        response = self.call(fn, queryString=query_string)
+        with operation('query'):
+            if self.fast_query:
+                response = self.read_call(self.template_query, 'query',
+                                          query_string)
+            else:
+                fn = self.client.service.query
+                response = self.read_call(fn, queryString=query_string)
+
+        # Later pages need the query locator of this session
+        if cache is not None and obj_type is not None and response.done:
+            cache.set(key, obj_type, response, started)
 
         # return the response
         return response
@@ -307,12 +659,128 @@ class Zuora:
         """
 
         # Call Query
-        fn = self.client.service.queryMore
-        response = self.call(fn, queryLocator=query_locator)
+        with operation('query'):
+            if self.fast_query:
+                response = self.read_call(self.template_query, 'queryMore',
+                                          query_locator)
+            else:
+                fn = self.client.service.queryMore
+                response = self.read_call(fn, queryLocator=query_locator)
 
         # return the response
         return response
 
+    def query_iter(self, query_string, prefetch=False):
+        """
+        Yields the records of every page of the query, following the
+        queryLocator with query_more() until Zuora reports done.
+
+        :param string query_string: ZQL query string
+        :param bool prefetch: fetch the next page on a background thread
+                              while the records of the current page are
+                              consumed
+
+        :returns: generator of records
+        """
+        response = self.query(query_string)
+        while True:
+            next_page = None
+            if not response.done and prefetch:
+                next_page = Prefetch(self.query_more, response.queryLocator)
+
+            for record in getattr(response, "records", []):
+                yield record
+
+            if response.done:
+                return
+            if next_page is not None:
+                response = next_page.result()
+            else:
+                response = self.query_more(response.queryLocator)
+
+    def query_all(self, query_string, prefetch=False):
+        """
+        Returns the records of every page of the query (see query_iter())
+
+        :param string query_string: ZQL query string
+        :param bool prefetch: fetch the next page while parsing the current
+
+        :returns: list of records
+        """
+        return list(self.query_iter(query_string, prefetch=prefetch))
+
+    def query_chunked(self, query_string, filter_list):
+        """
+        Runs the query with the conditions of filter_list OR'ed together in
+        its WHERE clause. Long lists are split into chunks Zuora accepts
+        (see the query_chunk_size and query_max_filter_length settings),
+        which run concurrently on the query pool.
+
+        :param string query_string: ZQL query string without a WHERE clause
+        :param list filter_list: conditions, such as "Id = '...'"
+
+        :returns: list of the records of every chunk, chunk by chunk
+        """
+        queries = [query_string + " WHERE %s" % " OR ".join(chunk)
+                   for chunk in chunk_filters(filter_list,
+                                              self.query_chunk_size,
+                                              self.query_max_filter_length)]
+        if len(queries) <= 1:
+            return self.query_all(queries[0]) if queries else []
+
+        # Log in once, rather than once per thread
+        self.login()
+        results = self.query_pool.map(bind(self.query_all), queries)
+        return [record for records in results for record in records]
+
+    def query_stream(self, query_string):
+        """
+        Like query(), but the reply is parsed as it is read: returns a
+        QueryStream yielding the records of the first page one at a time,
+        so memory use stays bounded however large the page is. done and
+        queryLocator are set on the stream once the records are reached.
+
+        :param string query_string: ZQL query string
+
+        :returns: the QueryStream
+        """
+        query_string = ' '.join(query_string.split())
+        with operation('query'):
+            return self.call(self.template_query, 'query', query_string,
+                             stream=True)
+
+    def query_more_stream(self, query_locator):
+        """
+        Like query_more(), but returns a QueryStream (see query_stream())
+
+        :param string query_locator: queryLocator of the previous page
+
+        :returns: the QueryStream
+        """
+        with operation('query'):
+            return self.call(self.template_query, 'queryMore',
+                             query_locator, stream=True)
+
+    def template_query(self, method_name, value, stream=False):
+        """
+        Sends query or queryMore from a prebuilt envelope holding the
+        current session id (see the fast_query and native_query settings)
+
+        :param str method_name: 'query' or 'queryMore'
+        :param str value: the query string or query locator
+        :param bool stream: return a QueryStream
+
+        :returns: the API response
+        """
+        if stream:
+            return self.client.template_stream(method_name, self.session_id,
+                                               value)
+        if self.native_query:
+            reply = self.client.template_call(method_name, self.session_id,
+                                              value, retxml=True)
+            return self.client.query_parser.parse(reply)
+        return self.client.template_call(method_name, self.session_id, value)
+
     def update(self, z_object):
         """
         Updates the information in one or more objects of the same type. You
@@ -326,7 +794,7 @@ class Zuora:
 
         # Call Update
         fn = self.client.service.update
-        response = self.call(fn, z_object)
+        response = self.write_call(object_types(z_object), fn, z_object)
 
         # return the response
         return response
@@ -469,21 +937,29 @@ class Zuora:
 
         :returns: response
         """
-        if not effective_date:
-            response = self.rest_client.subscription.cancel_subscription(
+        try:
+            if not effective_date:
+                response = self.rest_client.subscription.cancel_subscription(
                                                             subscription_key)
-        else:
-            response = self.rest_client.subscription.cancel_subscription(
+            else:
+                response = self.rest_client.subscription.cancel_subscription(
                     subscription_key,
                     jsonParams={'cancellationEffectiveDate': effective_date})
+        finally:
+            if self.query_cache is not None:
+                self.query_cache.invalidate(AMEND_TYPES)
         return response
 
+    @with_deadline
     def create_active_account(self, zAccount=None, zContact=None,
                               payment_method_id=None, user=None,
                               billing_address=None, shipping_address=None,
                               site_name=None, prepaid=False):
         """
         Create an Active Account for use in Subscribe()
+
+        :param float deadline: seconds for all the calls made (keyword only,
+                               see zuora.timeouts)
         """
         # Create Account if it doesn't exist
         if not zAccount:
@@ -622,7 +1098,8 @@ class Zuora:
             WHERE Id = '%s'
             """ % invoice_id
 
-        response = self.query(qs)
+        with operation('invoice_pdf'):
+            response = self.query(qs)
         if getattr(response, "records") and len(response.records) > 0:
             zInvoice = response.records[0]
             return zInvoice.Body
@@ -656,8 +1133,7 @@ class Zuora:
                 WHERE %s
                 """ % " AND ".join(qs_filter)
 
-            response = self.query(qs)
-            zInvoices = response.records
+            zInvoices = self.query_all(qs)
 
             # Return the Match
             return zInvoices
@@ -841,8 +1317,7 @@ class Zuora:
                 WHERE %s
                 """ % " AND ".join(qs_filter)
 
-            response = self.query(qs)
-            zPayments = response.records
+            zPayments = self.query_all(qs)
 
             # Return the Match
             return zPayments
@@ -954,14 +1429,17 @@ class Zuora:
         :param str product_id: ProductID
         :param list shortcodes: List of shortcode strings
         """
+        if self.catalog is not None:
+            zProducts = self.catalog.snapshot(self).get_products(
+                                product_id=product_id, shortcodes=shortcodes)
+            if not zProducts:
+                raise DoesNotExist("Unable to find Product for %s"
+                                   % (product_id or shortcodes))
+            return zProducts
+
         qs_filter = None
 
-        qs = """
-            SELECT
-                Description, EffectiveEndDate, EffectiveStartDate,
-                Id, SKU, Name, ShortCode__c
-            FROM Product
-            """
+        qs = PRODUCT_QUERY
 
         # If we're looking for one specific product
         if product_id:
@@ -970,7 +1448,11 @@ class Zuora:
         elif shortcodes:
             qs_filter_list = ["ShortCode__c = '%s'" % code
                                 for code in shortcodes]
-            qs_filter = " OR ".join(qs_filter_list)
+            zProducts = self.query_chunked(qs, qs_filter_list)
+            if not zProducts:
+                raise DoesNotExist("Unable to find Product for %s"
+                                   % shortcodes)
+            return zProducts
 
         if qs_filter:
             qs += " WHERE %s" % qs_filter
@@ -1026,8 +1508,13 @@ class Zuora:
             if rate_plan_id_list:
                 id_filter_list = [where_id_string % rp_id
                           for rp_id in rate_plan_id_list]
-                # Combine the rate plan ids for the WHERE clause
-                qs_filter = " OR ".join(id_filter_list)
+                # Combine the rate plan ids for the WHERE clauses
+                zRatePlanCharges = self.query_chunked(qs, id_filter_list)
+                if not zRatePlanCharges:
+                    raise DoesNotExist(
+                            "Unable to find Rate Plan Charges for %s"
+                            % rate_plan_id_list)
+                return zRatePlanCharges
 
         qs += " WHERE %s" % qs_filter
         response = self.query(qs)
@@ -1049,14 +1536,19 @@ class Zuora:
         :param datetime effective_start: Effective start date
         :param datetime effective_end: Effective end date
         """
-        qs = """
-            SELECT
-                ActivityLevel__c, AgeGroup__c,
-                Description, EffectiveEndDate, EffectiveStartDate,
-                Gender__c, Id, Name,
-                Priority__c, ProductId, Site__c, Term__c
-            FROM ProductRatePlan
-            """
+        if self.catalog is not None:
+            zProductRatePlans = self.catalog.snapshot(self)\
+                .get_product_rate_plans(
+                                product_rate_plan_id=product_rate_plan_id,
+                                product_id_list=product_id_list,
+                                effective_start=effective_start,
+                                effective_end=effective_end)
+            if not zProductRatePlans:
+                raise DoesNotExist("Unable to find Product Rate Plan for %s"
+                                % (product_rate_plan_id or product_id_list))
+            return zProductRatePlans
+
+        qs = PRODUCT_RATE_PLAN_QUERY
 
         # If only one product is requested
         if product_rate_plan_id:
@@ -1103,23 +1595,22 @@ class Zuora:
         :param str product_rate_plan_id: ProductRatePlanID
         :param list product_rate_plan_id_list: list of ProductRatePlanID's
         """
+        if self.catalog is not None:
+            zProductRatePlanCharges = self.catalog.snapshot(self)\
+                .get_product_rate_plan_charges(
+                        product_rate_plan_id=product_rate_plan_id,
+                        product_rate_plan_id_list=product_rate_plan_id_list,
+                        product_rate_plan_charge_id=
+                                            product_rate_plan_charge_id)
+            if not zProductRatePlanCharges:
+                raise DoesNotExist(
+                        "Unable to find Product Rate Plan Charges for %s"
+                        % (product_rate_plan_id or product_rate_plan_charge_id
+                           or product_rate_plan_id_list))
+            return zProductRatePlanCharges
+
         # Get Product Rate Plan Charges
-        qs = """
-            SELECT
-                AccountingCode, BillCycleDay, BillCycleType, BillingPeriod,
-                BillingPeriodAlignment, ChargeModel, ChargeType,
-                CustomImageURL__c, DefaultQuantity, Description,
-                ExclusiveOfferFlag__c,
-                HiddenBenefitText__c, Id,  IncludedUnits, MaxQuantity,
-                MinQuantity, Name, NumberOfPeriod, OverageCalculationOption,
-                OverageUnusedUnitsCreditOption,
-                PriceIncreasePercentage, ProductRatePlanId,
-                RevRecCode, RevRecTriggerCondition, ShortCode__c,
-                SmoothingModel, SortOrder__c, SpecificBillingPeriod,
-                TriggerEvent, UOM, UpToPeriods,
-                UseDiscountSpecificAccountingCode
-            FROM ProductRatePlanCharge
-            """
+        qs = PRODUCT_RATE_PLAN_CHARGE_QUERY
         where_id_string = "ProductRatePlanId = '%s'"
         # If only querying with one product rate plan id
         if product_rate_plan_id:
@@ -1133,8 +1624,14 @@ class Zuora:
             if product_rate_plan_id_list:
                 id_filter_list = [where_id_string % prp_id
                           for prp_id in product_rate_plan_id_list]
-                # Combine the product rate plan ids for the WHERE clause
-                qs_filter = " OR ".join(id_filter_list)
+                # Combine the product rate plan ids for the WHERE clauses
+                zProductRatePlanCharges = self.query_chunked(qs,
+                                                             id_filter_list)
+                if not zProductRatePlanCharges:
+                    raise DoesNotExist(
+                        "Unable to find Product Rate Plan Charges for %s"
+                        % product_rate_plan_id_list)
+                return zProductRatePlanCharges
 
         qs += " WHERE %s" % qs_filter
 
@@ -1157,13 +1654,21 @@ class Zuora:
         :param list product_rate_plan_charge_id_list: list of
                 ProductRatePlanChargeId's
         """
-        qs = """
-            SELECT
-                Currency, EndingUnit, IsOveragePrice,
-                Price, PriceFormat, ProductRatePlanChargeId,
-                StartingUnit, Tier
-            FROM ProductRatePlanChargeTier
-            """
+        if self.catalog is not None:
+            zProductRatePlanChargeTiers = self.catalog.snapshot(self)\
+                .get_product_rate_plan_charge_tiers(
+                        product_rate_plan_charge_id=
+                                            product_rate_plan_charge_id,
+                        product_rate_plan_charge_id_list=
+                                            product_rate_plan_charge_id_list)
+            if not zProductRatePlanChargeTiers:
+                raise DoesNotExist(
+                    "Unable to find Product Rate Plan Charges Tiers for %s"
+                    % (product_rate_plan_charge_id or
+                       product_rate_plan_charge_id_list))
+            return zProductRatePlanChargeTiers
+
+        qs = PRODUCT_RATE_PLAN_CHARGE_TIER_QUERY
         where_id_string = "ProductRatePlanChargeId = '%s'"
         # If only one product is requested
         if product_rate_plan_charge_id:
@@ -1175,8 +1680,14 @@ class Zuora:
                 id_filter_list = [where_id_string % prpc_id
                           for prpc_id in product_rate_plan_charge_id_list]
                 # Combine the product rate plan charge ids
-                # for the WHERE clause
-                qs_filter = " OR ".join(id_filter_list)
+                # for the WHERE clauses
+                zProductRatePlanChargeTiers = self.query_chunked(
+                                                    qs, id_filter_list)
+                if not zProductRatePlanChargeTiers:
+                    raise DoesNotExist(
+                    "Unable to find Product Rate Plan Charges Tiers for %s"
+                    % product_rate_plan_charge_id_list)
+                return zProductRatePlanChargeTiers
 
         qs += " WHERE %s" % qs_filter
 
@@ -1199,10 +1710,10 @@ class Zuora:
 
         product_dict = {}
         for p in response:
+            keys = key_map(p)
             product_dict[p.Id] = {}
             for attr in p:
-                key = convert_camel(attr[0].replace("__c", ""))
-                product_dict[p.Id][key] = attr[1]
+                product_dict[p.Id][keys[attr[0]]] = attr[1]
         return product_dict
 
     def get_camel_converted_product_rate_plans(self,
@@ -1228,8 +1739,9 @@ class Zuora:
                 product_rate_plan_dict[rp.ProductId] = \
                         product_rate_plan_dict.get(rp.ProductId, {})
                 product_rate_plan_dict[rp.ProductId][rp.Id] = {}
+            keys = key_map(rp)
             for attr in rp:
-                key = convert_camel(attr[0].replace("__c", ""))
+                key = keys[attr[0]]
                 # If there is only one product/rate plan
                 if product_rate_plan_id:
                     product_rate_plan_dict[key] = str(attr[1])
@@ -1258,8 +1770,9 @@ class Zuora:
                 product_rate_plan_charge_dict.get(rpc.ProductRatePlanId, {})
 
             product_rate_plan_charge_dict[rpc.ProductRatePlanId][rpc.Id] = {}
+            keys = key_map(rpc)
             for attr in rpc:
-                key = convert_camel(attr[0].replace("__c", ""))
+                key = keys[attr[0]]
                 product_rate_plan_charge_dict[
                             rpc.ProductRatePlanId][rpc.Id][key] = str(attr[1])
         return product_rate_plan_charge_dict
@@ -1285,12 +1798,14 @@ class Zuora:
 
             product_rate_plan_charge_tier_dict[
                                 rpct.ProductRatePlanChargeId][rpct.Id] = {}
+            keys = key_map(rpct)
             for attr in rpct:
-                key = convert_camel(attr[0].replace("__c", ""))
+                key = keys[attr[0]]
                 product_rate_plan_charge_tier_dict[
                     rpct.ProductRatePlanChargeId][rpct.Id][key] = str(attr[1])
         return product_rate_plan_charge_tier_dict
 
+    @with_deadline
     def match_product_rate_plans(self, shortcodes=[], filter_={}):
         """
         Get matching rate plans based on the product list filter.  This method
@@ -1299,8 +1814,12 @@ class Zuora:
         rate plan charges where each rate plan is the highest scoring rate plan
         per unique product and term.
 
-        TODO: Investigate pre-caching to preload entire rate plan system then
-        use this method to match and score out of the cached master.
+        With the catalog setting, the rate plan system is matched and scored
+        out of an in-memory snapshot, without a request, and the result of
+        each shortcodes and filter is kept (see zuora.rate_plan_matcher):
+        every call gets its own product and rate plan dictionaries, but the
+        rate plan charges and tiers under them are shared and must not be
+        modified.
 
         TODO: Investigate mem-cache into suez (JK: add memcache capability)
 
@@ -1310,15 +1829,23 @@ class Zuora:
         :param list shortcodes: list of short codes to filter the products
         :param dict filter: dictionary of filters to try to match the best
             rate plan against
+        :param float deadline: seconds for all the queries (keyword only,
+            see zuora.timeouts)
 
         :return: dictionary of rate plans and their rate plan charges
         :rtype: dict
         """
 
+        from rate_plan_matcher import pattern, priority
+
         # Defaults
         matching_rate_plans = []
         qs_datetime_now = datetime.utcnow().strftime(SOAP_TIMESTAMP)
 
+        if self.catalog is not None:
+            return self.catalog.snapshot(self).matcher().match(
+                            shortcodes, filter_, to_datetime(qs_datetime_now))
+
         # Get Product and optionally filter by ShortCode
         product_dict = self.get_camel_converted_products(shortcodes=shortcodes)
 
@@ -1356,13 +1883,11 @@ class Zuora:
                 # Scoring for Match: Simple increment if regexp matches
                 # ie., if filter = {'site': 'mapmyrun.com'} it will score +1
                 # if the custom field RatePlan.Site = 'run' or '(run|ride)'
-                priority = rp_dict.get("priority", 0)
-                rp_dict["score"] = priority
+                rp_dict["score"] = priority(rp_dict)
                 if filter_:
                     for field, match in filter_.items():
                         if rp_dict.get(field):
-                            p = re.compile(rp_dict[field], re.IGNORECASE)
-                            if re.match(p, match):
+                            if pattern(rp_dict[field]).match(match):
                                 rp_dict["score"] += 1
 
                 # iterate through rate plan charges
@@ -1450,6 +1975,72 @@ class Zuora:
         # Run Aggregates
         return pricing_dict
 
+    def get_product_rate_plans_pricing(self, product_rate_plan_id_list):
+        """
+        Sums up the Product Rate Plan Charge Tiers of many Product Rate
+        Plans, with one (chunked) query for their charges and one for their
+        tiers. Overage prices are left out.
+
+        :param list product_rate_plan_id_list: list of ProductRatePlanID's
+
+        :returns: {product_rate_plan_id: {charge_model: {charge_type:
+                  {currency: price}}}}, charge models and types lowercased,
+                  {} for the rate plans without charges
+        """
+        zCharges = zTiers = []
+        try:
+            if product_rate_plan_id_list:
+                zCharges = self.get_product_rate_plan_charges(
+                        product_rate_plan_id_list=product_rate_plan_id_list)
+            if zCharges:
+                zTiers = self.get_product_rate_plan_charge_tiers(
+                        product_rate_plan_charge_id_list=[
+                            zCharge.Id for zCharge in zCharges])
+        except DoesNotExist:
+            pass
+        return price_matrix(product_rate_plan_id_list, zCharges, zTiers)
+
+    def get_catalog_tables(self, product_id_list=None, effective_start=None,
+                           effective_end=None):
+        """
+        Gets the charges and tiers of the Product Rate Plans as
+        CatalogTables, one array per field, for aggregations over many rate
+        plans (totals, price ranges, tier lookups by quantity).
+
+        :param list product_id_list: A list of ProductID's, every product
+                                     when omitted
+        :param datetime effective_start: Effective start date
+        :param datetime effective_end: Effective end date
+
+        :returns: CatalogTables, shared by the calls when the whole catalog
+                  is read from the catalog setting
+        """
+        if product_id_list or effective_start:
+            zProductRatePlans = self.get_product_rate_plans(
+                                            product_id_list=product_id_list,
+                                            effective_start=effective_start,
+                                            effective_end=effective_end)
+        elif self.catalog is not None:
+            return self.catalog.snapshot(self).tables()
+        else:
+            return CatalogTables(
+                self.query_all(PRODUCT_RATE_PLAN_QUERY),
+                self.query_all(PRODUCT_RATE_PLAN_CHARGE_QUERY),
+                self.query_all(PRODUCT_RATE_PLAN_CHARGE_TIER_QUERY))
+
+        zCharges = zTiers = []
+        try:
+            zCharges = self.get_product_rate_plan_charges(
+                    product_rate_plan_id_list=[
+                        zProductRatePlan.Id
+                        for zProductRatePlan in zProductRatePlans])
+            zTiers = self.get_product_rate_plan_charge_tiers(
+                    product_rate_plan_charge_id_list=[
+                        zCharge.Id for zCharge in zCharges])
+        except DoesNotExist:
+            pass
+        return CatalogTables(zProductRatePlans, zCharges, zTiers)
+
     def get_rate_plans(self, product_rate_plan_id=None, subscription_id=None):
         """
         Gets the RatePlan matching criteria.
@@ -1480,8 +2071,7 @@ class Zuora:
         if qs_filter:
             qs += "WHERE %s" % " AND ".join(qs_filter)
 
-        response = self.query(qs)
-        zRecords = response.records
+        zRecords = self.query_all(qs)
 
         # Return the Match
         return zRecords
@@ -1550,8 +2140,7 @@ class Zuora:
         if qs_filter:
             qs += "WHERE %s" % " AND ".join(qs_filter)
 
-        response = self.query(qs)
-        zRecords = response.records
+        zRecords = self.query_all(qs)
 
         # Return the Match
         return zRecords
@@ -1806,6 +2395,7 @@ class Zuora:
 
         return response
 
+    @with_deadline
     def subscribe(self, product_rate_plan_id, monthly_term, zAccount=None,
                   zContact=None, zShippingContact=None,
                   process_payments_flag=True,
@@ -1836,6 +2426,8 @@ class Zuora:
         :param str account_name: This is the name of the account.
         :param str subscription_name: The name of the subscription. This is a\
             unique identifier. If not specified, Zuora will auto-create a name.
+        :param float deadline: seconds for all the calls made (keyword only,\
+            see zuora.timeouts)
         """
         # zAccount = self.client.factory.create('ns2:Account')
         #Used to be called even if account existed, pulling it out for now
@@ -1936,7 +2528,9 @@ class Zuora:
 
         fn = self.client.service.subscribe
         log.info("***Subscribe Request: %s" % zSubscribeRequest)
-        response = self.call(fn, zSubscribeRequest)
+        with operation('subscribe'):
+            response = self.write_call(SUBSCRIBE_TYPES, fn,
+                                       zSubscribeRequest)
         log.info("***Subscribe Response: %s" % response)
 
         # return the response
@@ -1965,9 +2559,135 @@ first_cap_re = re.compile('(.)([A-Z][a-z]+)')
 all_cap_re = re.compile('([a-z0-9])([A-Z])')
 
 
+#: Names converted by convert_camel() kept, before they are dropped
+CAMEL_NAMES_MAX = 4096
+
+camel_names = {}
+
+
 def convert_camel(name):
-    s1 = first_cap_re.sub(r'\1_\2', name)
-    return all_cap_re.sub(r'\1_\2', s1).lower()
+    converted = camel_names.get(name)
+    if converted is None:
+        s1 = first_cap_re.sub(r'\1_\2', name)
+        converted = all_cap_re.sub(r'\1_\2', s1).lower()
+        if len(camel_names) >= CAMEL_NAMES_MAX:
+            camel_names.clear()
+        camel_names[name] = converted
+    return converted
+
+
+class KeyMap(dict):
+    """
+    The serialized keys of the fields of one object type, by field name,
+    converted on first use
+    """
+    def __missing__(self, name):
+        key = self[name] = convert_camel(name.replace("__c", ""))
+        return key
+
+
+#: KeyMap of each object type
+key_maps = {}
+
+
+def key_map(obj):
+    """
+    Returns the KeyMap of the type of a suds object (or record)
+    """
+    type_name = obj.__class__.__name__
+    keys = key_maps.get(type_name)
+    if keys is None:
+        keys = key_maps[type_name] = KeyMap()
+    return keys
+
+
+def chunk_filters(filter_list, max_conditions, max_length):
+    """
+    Splits the conditions of an OR filter into chunks of at most
+    max_conditions conditions and max_length characters once joined.
+    Duplicate conditions are dropped.
+
+    :returns: list of lists of conditions
+    """
+    chunks = []
+    chunk = []
+    length = 0
+    seen = set()
+    for condition in filter_list:
+        if condition in seen:
+            continue
+        seen.add(condition)
+        added = len(condition) + (len(" OR ") if chunk else 0)
+        if chunk and (len(chunk) >= max_conditions or
+                      length + added > max_length):
+            chunks.append(chunk)
+            chunk = []
+            added = len(condition)
+            length = 0
+        chunk.append(condition)
+        length += added
+    if chunk:
+        chunks.append(chunk)
+    return chunks
+
+
+def price_matrix(product_rate_plan_id_list, charges, tiers):
+    """
+    Sums the prices of the tiers in one pass, by rate plan, charge model,
+    charge type and currency (see get_product_rate_plans_pricing())
+
+    :param list product_rate_plan_id_list: ProductRatePlanID's
+    :param list charges: their ProductRatePlanCharge records
+    :param list tiers: the ProductRatePlanChargeTier records of the charges
+    """
+    pricing = dict((prp_id, {}) for prp_id in product_rate_plan_id_list)
+
+    # The {currency: price} of each charge, skipping the charges without a
+    # model or type
+    totals = {}
+    for charge in charges:
+        charge_model = getattr(charge, "ChargeModel", None)
+        charge_type = getattr(charge, "ChargeType", None)
+        if not charge_model or not charge_type:
+            continue
+        charge_model, charge_type = charge_model.lower(), charge_type.lower()
+        totals[charge.Id] = pricing.setdefault(charge.ProductRatePlanId, {})\
+                .setdefault(charge_model, {}).setdefault(charge_type, {})
+
+    for tier in tiers:
+        prices = totals.get(tier.ProductRatePlanChargeId)
+        price = getattr(tier, "Price", None)
+        if prices is None or price is None or \
+                getattr(tier, "IsOveragePrice", False):
+            continue
+        currency = getattr(tier, "Currency", None)
+        prices[currency] = prices.get(currency, 0) + price
+    return pricing
+
+
+#: Values serialized as they are
+BASIC_TYPES = (str, int, float, unicode, date, datetime, long)
+
+# How zuora_serialize() handles the values of each class
+BASIC, LIST, OBJECT = 1, 2, 3
+
+serializer_kinds = {}
+
+
+def serializer_kind(cls):
+    """
+    Returns BASIC, LIST or OBJECT for the values of the class
+    """
+    kind = serializer_kinds.get(cls)
+    if kind is None:
+        if issubclass(cls, BASIC_TYPES):
+            kind = BASIC
+        elif issubclass(cls, list):
+            kind = LIST
+        else:
+            kind = OBJECT
+        serializer_kinds[cls] = kind
+    return kind
 
 
 def zuora_serialize(obj):
@@ -1975,42 +2695,59 @@ def zuora_serialize(obj):
     Converts a SUDS Object to a Dictionary
     - Very primative serializer but is able to handle
       the basic Zuora SOAP Objects.
-    """
-    basic_serializer = [str, int, float, unicode, date, datetime, long]
 
+    The nested objects and lists are walked with a stack instead of
+    recursive calls, and the attributes are dispatched on their class
+    (see serializer_kind()).
+    """
     if not obj:
         return None
 
-    if isinstance(obj, list):
-        obj_list = []
-        for item in obj:
-            obj_list.append(zuora_serialize(item))
-        return obj_list
-    else:
-        obj_dict = {}
-        for attr in obj:
-            key = convert_camel(attr[0].replace("__c", ""))
-
-            is_allowed = False
-            for allowed in basic_serializer:
-                if isinstance(attr[1], allowed):
-                    is_allowed = True
-            if is_allowed:
-                obj_dict[key] = attr[1]
-            else:
-                obj_dict[key] = zuora_serialize(attr[1])
-        return obj_dict
+    kinds = serializer_kinds
+    # (container, key, value): container[key] is the serialized value
+    root = [None]
+    stack = [(root, 0, obj)]
+    pop = stack.pop
+    push = stack.append
+    while stack:
+        container, key, value = pop()
+        cls = value.__class__
+        kind = kinds.get(cls) or serializer_kind(cls)
+        if kind is BASIC:
+            container[key] = value
+        elif not value:
+            container[key] = None
+        elif kind is LIST:
+            items = container[key] = [None] * len(value)
+            for index, item in enumerate(value):
+                push((items, index, item))
+        else:
+            obj_dict = container[key] = {}
+            keys = key_map(value)
+            for name, item in value:
+                cls = item.__class__
+                if (kinds.get(cls) or serializer_kind(cls)) is BASIC:
+                    obj_dict[keys[name]] = item
+                else:
+                    push((obj_dict, keys[name], item))
+    return root[0]
 
 
-def zuora_serialize_list(response_list):
+def zuora_serialize_iter(response_list):
     """
-    Serialize a list of Zuora objects
+    Serializes a list (or any iterable) of Zuora objects one at a time,
+    so a large result set never has to be held serialized as a whole
     """
-    serialized_list = []
     if response_list:
         for item in response_list:
-            serialized_list.append(zuora_serialize(item))
-    return serialized_list
+            yield zuora_serialize(item)
+
+
+def zuora_serialize_list(response_list):
+    """
+    Serialize a list of Zuora objects
+    """
+    return list(zuora_serialize_iter(response_list))
 
 
 def name_underscore_fix(name_field):
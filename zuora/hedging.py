@@ -0,0 +1,133 @@
+"""
+    Zuora Hedged Calls
+    ~~~~~~~~~~~~~~~~~~
+
+    Cuts the tail latency of read-only calls: when a call has not answered
+    within a percentile of the recent latencies, the same call is sent again
+    and whichever answers first is used.
+
+    Usage example:
+    zuora_settings['hedge_queries'] = True
+    zuora_settings['hedge_percentile'] = 95
+    # Share the latencies between the instances using the tenant
+    zuora_settings['query_latency'] = LatencyTracker()
+    z = Zuora(zuora_settings)
+    z.get_account(user_id)
+"""
+from collections import deque
+import threading
+import time
+
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
+from timeouts import bind
+
+
+class LatencyTracker(object):
+    """
+    Latencies of the recent calls, and counters of the hedged calls:
+
+    hedged: calls sent a second time
+    hedge_wins: of those, calls answered first by the second request
+    """
+    def __init__(self, window=200, min_samples=20):
+        """
+        :param int window: latencies kept
+        :param int min_samples: latencies needed before hedging
+        """
+        self.samples = deque(maxlen=window)
+        self.min_samples = min_samples
+        self.hedged = 0
+        self.hedge_wins = 0
+        self.lock = threading.Lock()
+
+    def record(self, seconds):
+        with self.lock:
+            self.samples.append(seconds)
+
+    def count(self, name):
+        with self.lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def percentile(self, percent):
+        """
+        Returns the latency within which `percent` % of the recent calls
+        answered, or None until min_samples calls are known
+        """
+        with self.lock:
+            samples = sorted(self.samples)
+        if len(samples) < self.min_samples:
+            return None
+        return samples[min(len(samples) - 1,
+                           int(len(samples) * percent / 100.0))]
+
+
+def hedged_call(tracker, percent, fn, *args, **kwargs):
+    """
+    Calls fn(*args, **kwargs), calling it a second time if it has not
+    answered within the `percent` percentile of the latencies of tracker,
+    and returns the first answer. An error is only raised once every request
+    sent has failed.
+
+    Only for calls without side effects: the slower request is not
+    cancelled, it runs to its end and its answer is dropped.
+    """
+    delay = tracker.percentile(percent)
+    if delay is None:
+        # Still learning the latencies
+        start = time.time()
+        value = fn(*args, **kwargs)
+        tracker.record(time.time() - start)
+        return value
+
+    # Keep the deadline and operation of the caller
+    fn = bind(fn)
+    answers = queue.Queue()
+    lock = threading.Lock()
+    state = {'sent': 0, 'answered': False}
+
+    def attempt(hedge):
+        start = time.time()
+        try:
+            value = fn(*args, **kwargs)
+        except Exception as error:
+            answers.put((hedge, False, error))
+        else:
+            tracker.record(time.time() - start)
+            answers.put((hedge, True, value))
+
+    def send(hedge):
+        with lock:
+            if state['answered']:
+                return
+            state['sent'] += 1
+        if hedge:
+            tracker.count('hedged')
+        thread = threading.Thread(target=attempt, args=(hedge,))
+        thread.daemon = True
+        thread.start()
+
+    # A timed wait for the answer polls on python 2, the timer sends the
+    # hedge instead
+    timer = threading.Timer(delay, send, (True,))
+    timer.daemon = True
+    send(False)
+    timer.start()
+    hedge, succeeded, value = answers.get()
+    timer.cancel()
+    with lock:
+        state['answered'] = True
+        sent = state['sent']
+
+    failed = 0
+    while not succeeded:
+        failed += 1
+        if failed == sent:
+            raise value
+        hedge, succeeded, value = answers.get()
+    if hedge:
+        tracker.count('hedge_wins')
+    return value
@@ -0,0 +1,363 @@
+"""
+    Zuora Query Cache
+    ~~~~~~~~~~~~~~~~~
+
+    Keeps the replies of query() for a while, so a query repeated within
+    seconds (get_account(), get_products(), ...) is answered without a
+    request. Replies are kept per object type (the FROM of the query) for
+    the ttl of the type, and the types written by create(), update(),
+    delete(), amend() and subscribe() are dropped from the cache.
+
+    Usage example:
+    from zuora.query_cache import MemoryQueryCache
+
+    zuora_settings['query_cache'] = MemoryQueryCache(
+                                        ttl=30, ttls={'Product': 3600})
+    z = Zuora(zuora_settings)
+
+    SqliteQueryCache shares the replies between the processes of the user
+    on a host, in a database private to the user (see user_dirs). Replies
+    are stored as json, never pickled, so a tampered entry can't run code.
+    Only replies holding every record (done) are cached, and every hit
+    returns a copy, so the records can be modified by the caller.
+"""
+from collections import OrderedDict
+from contextlib import closing, contextmanager
+from datetime import date, datetime
+import hashlib
+import json
+from os import path
+import re
+import sqlite3
+import threading
+import time
+
+from user_dirs import private_file, user_cache_dir
+
+import logging
+log = logging.getLogger(__name__)
+
+#: Object types changed by an amend(), or by writing an Amendment
+AMEND_TYPES = ('Amendment', 'Subscription', 'RatePlan', 'RatePlanCharge',
+               'RatePlanChargeTier', 'Invoice', 'InvoiceItem')
+
+#: Object types changed by a subscribe()
+SUBSCRIBE_TYPES = AMEND_TYPES + ('Account', 'Contact', 'PaymentMethod',
+                                 'Payment', 'InvoicePayment')
+
+#: Object types changed by a create(), update() or delete() of each type,
+#: besides the type itself
+WRITTEN_TYPES = {
+    'Amendment': AMEND_TYPES,
+    'Subscription': AMEND_TYPES,
+    'RatePlan': AMEND_TYPES,
+    'RatePlanCharge': AMEND_TYPES,
+    'RatePlanChargeTier': AMEND_TYPES,
+    'Payment': ('Invoice', 'InvoicePayment', 'Account'),
+    'InvoicePayment': ('Payment', 'Invoice', 'Account'),
+    'Refund': ('Payment', 'Invoice', 'Account'),
+    'InvoiceAdjustment': ('Invoice', 'Account'),
+    'InvoiceItemAdjustment': ('Invoice', 'InvoiceItem', 'Account'),
+    'CreditBalanceAdjustment': ('Invoice', 'Account'),
+}
+
+query_type_re = re.compile(r'\bFROM\s+(\w+)', re.IGNORECASE)
+
+
+def query_type(query_string):
+    """
+    Returns the object type queried, or None
+    """
+    match = query_type_re.search(query_string)
+    return match.group(1) if match else None
+
+
+def query_key(tenant, query_string):
+    """
+    Returns the cache key of a query of the tenant. The query is normalised
+    (whitespace collapsed) so the indentation of the query doesn't matter.
+    """
+    return hashlib.sha1(('%s\0%s' % (tenant, ' '.join(query_string.split())))
+                        .encode('utf-8')).hexdigest()
+
+
+def written_types(obj_type):
+    """
+    Returns the object types changed by writing an object of obj_type
+    """
+    return set((obj_type,) + WRITTEN_TYPES.get(obj_type, ()))
+
+
+def object_types(z_object):
+    """
+    Returns the object types changed by the suds objects sent to create()
+    or update()
+    """
+    if not isinstance(z_object, (list, tuple)):
+        z_object = [z_object]
+    types = set()
+    for obj in z_object:
+        types.update(written_types(obj.__class__.__name__))
+    return types
+
+
+def freeze(value):
+    """
+    Returns the value in a json serializable form: suds objects, query
+    records, dates and datetimes become single key dictionaries
+    ({'object': [name, items]}, {'record': [schema_type, names, items]},
+    {'date': [y, m, d]}, {'datetime': [y, m, d, H, M, S, us]})
+    """
+    from suds.sudsobject import Object
+    from query_parser import Record
+
+    def frozen(value):
+        if isinstance(value, Object):
+            return {'object': [value.__class__.__name__,
+                               [[name, frozen(item)]
+                                for name, item in value]]}
+        if isinstance(value, Record):
+            return {'record': [value.schema_type, value.__slots__,
+                               [[name, frozen(item)]
+                                for name, item in value]]}
+        if isinstance(value, list):
+            return [frozen(item) for item in value]
+        # Before date, which it subclasses
+        if isinstance(value, datetime):
+            return {'datetime': [value.year, value.month, value.day,
+                                 value.hour, value.minute, value.second,
+                                 value.microsecond]}
+        if isinstance(value, date):
+            return {'date': [value.year, value.month, value.day]}
+        return value
+    return frozen(value)
+
+
+def thaw(value):
+    """
+    Rebuilds the suds objects, records and dates of a frozen value
+    """
+    from suds.sudsobject import Factory
+    from query_parser import restore_record
+
+    def thawed(value):
+        if isinstance(value, list):
+            return [thawed(item) for item in value]
+        if not isinstance(value, dict):
+            return value
+        if 'object' in value:
+            name, items = value['object']
+            obj = Factory.object(str(name))
+            for item_name, item in items:
+                setattr(obj, item_name, thawed(item))
+            return obj
+        if 'record' in value:
+            schema_type, names, items = value['record']
+            return restore_record(tuple(schema_type),
+                                  tuple(str(name) for name in names),
+                                  [(str(item_name), thawed(item))
+                                   for item_name, item in items])
+        if 'datetime' in value:
+            return datetime(*value['datetime'])
+        return date(*value['date'])
+    return thawed(value)
+
+
+class QueryCache(object):
+    """
+    Interface of the query caches.
+
+    set() must not store a reply when its type was invalidated after the
+    query was sent, as the reply may predate the write.
+    """
+    def __init__(self, ttl=60, ttls=None, max_entries=1000):
+        """
+        :param int ttl: seconds a reply is kept
+        :param dict ttls: seconds per object type, 0 not to cache the type
+        :param int max_entries: replies kept, the least recently used are
+                                dropped first
+        """
+        self.ttl = ttl
+        self.ttls = ttls or {}
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.stats_lock = threading.Lock()
+
+    def lifetime(self, obj_type):
+        return self.ttls.get(obj_type, self.ttl)
+
+    def count(self, name):
+        with self.stats_lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def dumps(self, response):
+        return json.dumps(freeze(response), separators=(',', ':'))
+
+    def loads(self, data):
+        """
+        Returns the reply stored as data, or None if it can't be read
+        """
+        try:
+            return thaw(json.loads(data))
+        except (ValueError, TypeError, KeyError) as error:
+            log.warning("Zuora: Ignoring unreadable cached reply. %s"
+                        % error)
+            return None
+
+    def get(self, key):
+        """
+        Returns a copy of the cached reply for the key, or None
+        """
+        raise NotImplementedError
+
+    def set(self, key, obj_type, response, started):
+        """
+        Caches the reply of a query of obj_type sent at `started`
+        (time.time())
+        """
+        raise NotImplementedError
+
+    def invalidate(self, obj_types):
+        """
+        Drops the cached replies of the object types
+        """
+        raise NotImplementedError
+
+
+class MemoryQueryCache(QueryCache):
+    """
+    Caches the replies for the Zuora instances of one process
+    """
+    def __init__(self, ttl=60, ttls=None, max_entries=1000):
+        QueryCache.__init__(self, ttl, ttls, max_entries)
+        # key -> (obj_type, expires, json reply), least recently used
+        # first
+        self.entries = OrderedDict()
+        self.invalidated = {}
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is not None and entry[1] > time.time():
+                self.entries[key] = entry
+            else:
+                entry = None
+        response = None if entry is None else self.loads(entry[2])
+        self.count('misses' if response is None else 'hits')
+        return response
+
+    def set(self, key, obj_type, response, started):
+        ttl = self.lifetime(obj_type)
+        if not ttl:
+            return
+        data = self.dumps(response)
+        with self.lock:
+            if self.invalidated.get(obj_type, 0) >= started:
+                return
+            self.entries.pop(key, None)
+            self.entries[key] = (obj_type, time.time() + ttl, data)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def invalidate(self, obj_types):
+        now = time.time()
+        with self.lock:
+            for obj_type in obj_types:
+                self.invalidated[obj_type] = now
+            for key, entry in list(self.entries.items()):
+                if entry[0] in obj_types:
+                    del self.entries[key]
+
+
+class SqliteQueryCache(QueryCache):
+    """
+    Caches the replies in a sqlite database, shared by the processes of the
+    host
+    """
+    def __init__(self, database=None, ttl=60, ttls=None, max_entries=1000):
+        """
+        :param str database: database path, defaults to
+                             ~/.cache/zuora/zuora-query.db
+
+        :raises UnsafeDirectory: the database or its directory isn't private
+                                 to the user
+        """
+        QueryCache.__init__(self, ttl, ttls, max_entries)
+        self.database = private_file(
+            database or path.join(user_cache_dir('zuora'), 'zuora-query.db'))
+        with self.transaction() as connection:
+            connection.execute("""
+                CREATE TABLE IF NOT EXISTS zuora_query (
+                    key TEXT PRIMARY KEY,
+                    obj_type TEXT NOT NULL,
+                    expires REAL NOT NULL,
+                    used REAL NOT NULL,
+                    response TEXT NOT NULL
+                )""")
+            connection.execute("""
+                CREATE INDEX IF NOT EXISTS zuora_query_type
+                ON zuora_query (obj_type)""")
+            connection.execute("""
+                CREATE TABLE IF NOT EXISTS zuora_query_invalidated (
+                    obj_type TEXT PRIMARY KEY,
+                    invalidated REAL NOT NULL
+                )""")
+
+    @contextmanager
+    def transaction(self):
+        # sqlite connections can't be shared between threads
+        with closing(sqlite3.connect(self.database, timeout=30)) as connection:
+            with connection:
+                yield connection
+
+    def get(self, key):
+        now = time.time()
+        with self.transaction() as connection:
+            entry = connection.execute(
+                "SELECT response FROM zuora_query "
+                "WHERE key = ? AND expires > ?", (key, now)).fetchone()
+            if entry is not None:
+                connection.execute(
+                    "UPDATE zuora_query SET used = ? WHERE key = ?",
+                    (now, key))
+        response = None if entry is None else self.loads(entry[0])
+        self.count('misses' if response is None else 'hits')
+        return response
+
+    def set(self, key, obj_type, response, started):
+        ttl = self.lifetime(obj_type)
+        if not ttl:
+            return
+        data = self.dumps(response)
+        now = time.time()
+        with self.transaction() as connection:
+            invalidated = connection.execute(
+                "SELECT invalidated FROM zuora_query_invalidated "
+                "WHERE obj_type = ?", (obj_type,)).fetchone()
+            if invalidated is not None and invalidated[0] >= started:
+                return
+            connection.execute(
+                "INSERT OR REPLACE INTO zuora_query "
+                "(key, obj_type, expires, used, response) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (key, obj_type, now + ttl, now, data))
+            connection.execute(
+                "DELETE FROM zuora_query WHERE expires <= ?", (now,))
+            connection.execute(
+                "DELETE FROM zuora_query WHERE key IN ("
+                "SELECT key FROM zuora_query ORDER BY used DESC "
+                "LIMIT -1 OFFSET ?)", (self.max_entries,))
+
+    def invalidate(self, obj_types):
+        now = time.time()
+        with self.transaction() as connection:
+            for obj_type in obj_types:
+                connection.execute(
+                    "INSERT OR REPLACE INTO zuora_query_invalidated "
+                    "(obj_type, invalidated) VALUES (?, ?)",
+                    (obj_type, now))
+                connection.execute(
+                    "DELETE FROM zuora_query WHERE obj_type = ?",
+                    (obj_type,))
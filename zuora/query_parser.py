@@ -0,0 +1,312 @@
+"""
+    Zuora Query Parser
+    ~~~~~~~~~~~~~~~~~~
+
+    Parses query and queryMore replies into compact records instead of suds
+    objects. A record class with __slots__ is generated from the wsdl schema
+    for every ZObject type, and values are converted the way suds converts
+    them (datetime, bool, float, int).
+
+    Usage example:
+    from query_parser import QueryParser
+
+    parser = QueryParser(client.wsdl.schema)
+    response = parser.parse(reply)
+    for zInvoice in response.records:
+        print zInvoice.Id, zInvoice.Amount
+
+    # Or parse the records as the reply is read
+    for zInvoice in QueryStream(parser, reply_file):
+        print zInvoice.Id, zInvoice.Amount
+"""
+try:
+    import xml.etree.cElementTree as ElementTree
+except ImportError:
+    import xml.etree.ElementTree as ElementTree
+
+from suds.xsd.sxbasic import Complex
+from suds.xsd.sxbuiltin import (XBoolean, XDate, XDateTime, XFloat,
+                                XInteger, XLong, XTime)
+
+API_NS = 'http://api.zuora.com/'
+OBJECT_NS = 'http://object.api.zuora.com/'
+SOAP_ENV_NS = 'http://schemas.xmlsoap.org/soap/envelope/'
+XSI_NS = 'http://www.w3.org/2001/XMLSchema-instance'
+
+XSI_TYPE = '{%s}type' % XSI_NS
+XSI_NIL = '{%s}nil' % XSI_NS
+SOAP_BODY = '{%s}Body' % SOAP_ENV_NS
+SOAP_FAULT = '{%s}Fault' % SOAP_ENV_NS
+RECORDS = '{%s}records' % API_NS
+
+#: Builtin types whose text suds converts to python values
+CONVERTED_TYPES = (XBoolean, XDate, XDateTime, XFloat, XInteger, XLong,
+                   XTime)
+
+MISSING = object()
+
+#: Record classes of the unpickled records, by (schema_type, names)
+restored_classes = {}
+
+
+class QueryFault(Exception):
+    """
+    A soap fault returned instead of a query result
+    """
+    def __init__(self, faultcode, faultstring):
+        Exception.__init__(self, "%s: %s" % (faultcode, faultstring))
+        self.faultcode = faultcode
+        self.faultstring = faultstring
+
+
+class Record(object):
+    """
+    Base of the generated record classes.
+
+    Like a suds object, a record only has the fields present in the reply,
+    and iterating over it yields (name, value) pairs.
+    """
+    __slots__ = ()
+
+    #: name -> (convert, multiple, nested) of every field, see field_spec()
+    fields = {}
+
+    def __iter__(self):
+        for name in self.__slots__:
+            value = getattr(self, name, MISSING)
+            if value is not MISSING:
+                yield name, value
+
+    def __len__(self):
+        return len(list(iter(self)))
+
+    def __getitem__(self, name):
+        return getattr(self, name)
+
+    def __contains__(self, name):
+        return getattr(self, name, MISSING) is not MISSING
+
+    def __repr__(self):
+        return '(%s){%s}' % (self.__class__.__name__, ', '.join(
+            '%s = %r' % (name, value) for name, value in self))
+
+    def __reduce__(self):
+        # The generated classes can't be found by name when unpickling
+        return restore_record, (self.schema_type, self.__slots__, list(self))
+
+
+def restore_record(schema_type, names, items):
+    """
+    Rebuilds a pickled record, in a record class with the same fields as its
+    own (the fields spec is only needed for parsing, so it is left empty)
+    """
+    record_class = restored_classes.get((schema_type, names))
+    if record_class is None:
+        record_class = type(str(schema_type[0]), (Record,), {
+            '__slots__': names,
+            'fields': {},
+            'schema_type': schema_type})
+        restored_classes[(schema_type, names)] = record_class
+    record = record_class()
+    for name, value in items:
+        setattr(record, name, value)
+    return record
+
+
+def field_spec(element):
+    """
+    Returns (convert, multiple, nested) for a schema element:
+    the suds conversion of its text (None for strings), whether it may occur
+    more than once, and for complex types their (name, namespace)
+    """
+    resolved = element.resolve()
+    if isinstance(resolved, CONVERTED_TYPES):
+        convert = resolved.translate
+    else:
+        convert = None
+    if isinstance(resolved, Complex):
+        nested = (resolved.name, resolved.namespace()[1])
+    else:
+        nested = None
+    return convert, element.unbounded(), nested
+
+
+class QueryParser(object):
+    """
+    Parses query replies using the wsdl schema of a suds client.
+
+    Record classes are generated on first use of each type and shared by
+    every parse. Fields missing from the schema (such as custom fields of a
+    tenant) are added to the record class of the type as they are seen.
+    """
+    def __init__(self, schema):
+        self.schema = schema
+        self.classes = {}
+
+    def record_class(self, name, namespace=OBJECT_NS):
+        """
+        Returns the record class for the schema type
+        """
+        record_class = self.classes.get((name, namespace))
+        if record_class is None:
+            fields = {}
+            names = []
+            schema_type = self.schema.types.get((name, namespace))
+            if schema_type is not None:
+                for element, ancestry in schema_type.children():
+                    if element.name not in fields:
+                        names.append(str(element.name))
+                        fields[element.name] = field_spec(element)
+            record_class = self.generate(name, namespace, names, fields)
+        return record_class
+
+    def extend(self, record_class, names):
+        """
+        Returns a record class for the type of record_class with the
+        additional (string) fields
+        """
+        name, namespace = record_class.schema_type
+        fields = dict(record_class.fields)
+        for field_name in names:
+            fields[field_name] = (None, False, None)
+        return self.generate(name, namespace,
+                             list(record_class.__slots__) + names, fields)
+
+    def generate(self, name, namespace, names, fields):
+        record_class = type(str(name), (Record,), {
+            '__slots__': tuple(names),
+            'fields': fields,
+            'schema_type': (name, namespace)})
+        self.classes[(name, namespace)] = record_class
+        return record_class
+
+    def parse(self, reply):
+        """
+        Parses a query or queryMore reply
+
+        :param str reply: the soap reply
+
+        :returns: the QueryResult record
+        """
+        envelope = ElementTree.fromstring(reply)
+        body = envelope.find(SOAP_BODY)
+        response = body[0]
+        if response.tag == SOAP_FAULT:
+            raise QueryFault(response.findtext('faultcode'),
+                             response.findtext('faultstring'))
+        return self.parse_record(response[0],
+                                 self.record_class('QueryResult', API_NS))
+
+    def parse_record(self, element, record_class):
+        """
+        Returns the record holding the fields of the element
+        """
+        fields = record_class.fields
+        values = []
+        unknown = None
+        for child in element:
+            tag = child.tag
+            name = tag[tag.find('}') + 1:]
+            field = fields.get(name)
+            if field is None:
+                if unknown is None:
+                    unknown = []
+                if name not in unknown:
+                    unknown.append(name)
+                field = (None, False, None)
+            convert, multiple, nested = field
+            if nested is not None and len(child):
+                xsi_type = child.get(XSI_TYPE)
+                if xsi_type:
+                    record_type = xsi_type[xsi_type.find(':') + 1:]
+                    value = self.parse_record(child,
+                                              self.record_class(record_type))
+                else:
+                    value = self.parse_record(child,
+                                              self.record_class(*nested))
+            elif child.get(XSI_NIL) == 'true' or not child.text:
+                value = None
+            elif convert is not None:
+                value = convert(child.text)
+            else:
+                value = child.text
+            values.append((name, multiple, value))
+
+        if unknown is not None:
+            record_class = self.extend(record_class,
+                                       [str(name) for name in unknown])
+        record = record_class()
+        for name, multiple, value in values:
+            if multiple:
+                items = getattr(record, name, None)
+                if items is None:
+                    items = []
+                    setattr(record, name, items)
+                items.append(value)
+            else:
+                setattr(record, name, value)
+        return record
+
+
+class QueryStream(object):
+    """
+    A query or queryMore reply parsed as it is read.
+
+    Iterating yields the records one at a time and drops each parsed element,
+    so memory use does not grow with the size of the page. done and
+    queryLocator are set once they have been read (they precede the records
+    in the reply), size once the iteration is over. A stream can only be
+    iterated once.
+    """
+    def __init__(self, parser, source, close=None):
+        """
+        :param QueryParser parser: parser providing the record classes
+        :param file source: file-like object to read the reply from
+        :param function close: called when the iteration is over
+        """
+        self.parser = parser
+        self.source = source
+        self.close = close
+        self.done = None
+        self.queryLocator = None
+        self.size = None
+
+    def __iter__(self):
+        parser = self.parser
+        result_class = parser.record_class('QueryResult', API_NS)
+        depth = 0
+        result = None
+        try:
+            for event, element in ElementTree.iterparse(
+                                        self.source, events=('start', 'end')):
+                if event == 'start':
+                    depth += 1
+                    if depth == 4:
+                        # Envelope, Body, queryResponse, result
+                        result = element
+                    continue
+
+                depth -= 1
+                if element.tag == SOAP_FAULT:
+                    raise QueryFault(element.findtext('faultcode'),
+                                     element.findtext('faultstring'))
+                if depth != 4:
+                    continue
+                if element.tag == RECORDS:
+                    xsi_type = element.get(XSI_TYPE, '')
+                    record_class = parser.record_class(
+                                        xsi_type[xsi_type.find(':') + 1:])
+                    record = parser.parse_record(element, record_class)
+                    result.remove(element)
+                    yield record
+                else:
+                    tag = element.tag
+                    name = tag[tag.find('}') + 1:]
+                    convert = result_class.fields.get(name, (None,))[0]
+                    value = element.text or None
+                    if value is not None and convert is not None:
+                        value = convert(value)
+                    setattr(self, name, value)
+        finally:
+            if self.close is not None:
+                self.close()
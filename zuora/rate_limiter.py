@@ -0,0 +1,175 @@
+"""
+    Zuora Rate Limiter
+    ~~~~~~~~~~~~~~~~~~
+
+    Paces the SOAP and REST calls sent to a Zuora tenant. A token bucket
+    caps the request rate, and an AIMD window caps the concurrent requests:
+    the window grows by one request per window of successful calls, and
+    shrinks when Zuora rejects a call for exceeding a limit.
+
+    Usage example:
+    from zuora.rate_limiter import RateLimiter
+
+    # Share one limiter between every Zuora instance using the tenant
+    zuora_settings['rate_limiter'] = RateLimiter(rate=20, max_concurrency=16)
+    z = Zuora(zuora_settings)
+"""
+from contextlib import contextmanager
+import threading
+import time
+
+import logging
+log = logging.getLogger(__name__)
+
+
+class RateLimitExceeded(Exception):
+    """
+    Zuora answered 429 Too Many Requests
+    """
+    def __init__(self, retry_after=None):
+        Exception.__init__(self, "429 Too Many Requests")
+        self.retry_after = retry_after
+
+
+def retry_after(headers):
+    """
+    Returns the seconds of the Retry-After header, or None
+    """
+    try:
+        return float(headers.get('Retry-After'))
+    except (TypeError, ValueError):
+        return None
+
+
+class Slot(object):
+    """
+    A request admitted by the RateLimiter
+    """
+    def __init__(self, epoch):
+        self.epoch = epoch
+        self.throttled = False
+        self.retry_after = None
+
+    def throttle(self, retry_after=None):
+        """
+        Marks the request as rejected by Zuora for exceeding a limit
+        """
+        self.throttled = True
+        self.retry_after = retry_after
+
+
+class RateLimiter(object):
+    """
+    Token bucket and AIMD concurrency window, shared by the threads (and the
+    Zuora instances) sending requests to a tenant.
+
+    A throttled request shrinks the window (halves it by default), unless
+    it was sent before an earlier throttle already did, and pauses every
+    request for the Retry-After given by Zuora, or for backoff seconds when
+    the window shrinks.
+    """
+    def __init__(self, rate=None, burst=None, max_concurrency=20,
+                 min_concurrency=1, decrease=0.5, backoff=0, max_retries=3):
+        """
+        :param float rate: requests per second, None for no limit
+        :param int burst: requests sent at once after an idle period
+                          (defaults to rate)
+        :param int max_concurrency: largest window
+        :param int min_concurrency: smallest window
+        :param float decrease: factor applied to the window when throttled,
+                               closer to 1 keeps more requests in flight
+                               at the cost of more throttled ones
+        :param float backoff: seconds to pause when the window shrinks
+                              and Zuora gave no Retry-After
+        :param int max_retries: times a throttled call is repeated
+        """
+        self.rate = rate
+        self.burst = burst or max(1, rate or 1)
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min_concurrency
+        self.decrease = decrease
+        self.backoff = backoff
+        self.max_retries = max_retries
+        self.limit = float(max_concurrency)
+        self.in_flight = 0
+        self.epoch = 0
+        self.throttles = 0
+        self.tokens = float(self.burst)
+        self.refilled = time.time()
+        self.resume_at = 0
+        self.condition = threading.Condition()
+
+    def take_token(self, now):
+        """
+        Takes a token from the bucket, returning 0, or the seconds until
+        one is available
+        """
+        if self.rate is None:
+            return 0
+        self.tokens = min(self.burst,
+                          self.tokens + (now - self.refilled) * self.rate)
+        self.refilled = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate
+
+    def acquire(self):
+        """
+        Waits until a request may be sent
+
+        :returns: the Slot to release()
+        """
+        with self.condition:
+            while True:
+                now = time.time()
+                wait = self.resume_at - now
+                if wait <= 0:
+                    if self.in_flight >= int(self.limit):
+                        # Woken up by release()
+                        wait = None
+                    else:
+                        wait = self.take_token(now)
+                        if not wait:
+                            break
+                self.condition.wait(wait)
+            self.in_flight += 1
+            return Slot(self.epoch)
+
+    def release(self, slot):
+        with self.condition:
+            self.in_flight -= 1
+            if slot.throttled:
+                self.throttles += 1
+                pause = slot.retry_after
+                if slot.epoch == self.epoch:
+                    self.epoch += 1
+                    self.limit = max(self.min_concurrency, self.limit *
+                                     self.decrease)
+                    log.info("Zuora: Request limit exceeded, %d concurrent "
+                             "requests." % self.limit)
+                    if pause is None:
+                        pause = self.backoff
+                if pause:
+                    self.resume_at = max(self.resume_at, time.time() + pause)
+            else:
+                self.limit = min(self.max_concurrency,
+                                 self.limit + 1.0 / self.limit)
+            self.condition.notify_all()
+
+    @contextmanager
+    def slot(self):
+        """
+        Holds a Slot while the request runs
+
+        Usage example:
+        with limiter.slot() as slot:
+            response = send()
+            if response.status_code == 429:
+                slot.throttle()
+        """
+        slot = self.acquire()
+        try:
+            yield slot
+        finally:
+            self.release(slot)
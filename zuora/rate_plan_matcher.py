@@ -0,0 +1,208 @@
+"""
+    Zuora Rate Plan Matcher
+    ~~~~~~~~~~~~~~~~~~~~~~~
+
+    Matches and scores the rate plans of a catalog snapshot for
+    match_product_rate_plans(). The matcher is built once per snapshot: the
+    records are converted to their camel case dictionaries, and the charges
+    of every rate plan are sorted and given their tiers ahead of the calls.
+    Filter patterns are compiled once, and the result of each shortcodes and
+    filter is kept until a rate plan becomes effective or expires (or the
+    snapshot is replaced). Each call gets its own product and rate plan
+    dictionaries, the charge and tier lists under them are shared.
+
+    Usage example:
+    matcher = RatePlanMatcher(catalog.snapshot(z))
+    matcher.match(['sub_bronze'], {'site': 'mapmyrun.com'}, datetime.now())
+"""
+from datetime import datetime
+import re
+import threading
+
+from catalog import to_datetime
+from client import DoesNotExist, key_map
+
+#: Compiled filter patterns, by expression
+patterns = {}
+
+
+def pattern(expression):
+    """
+    Returns the case insensitive pattern of a rate plan filter field,
+    compiled on first use
+    """
+    compiled = patterns.get(expression)
+    if compiled is None:
+        compiled = patterns[expression] = re.compile(expression,
+                                                     re.IGNORECASE)
+    return compiled
+
+
+def priority(rp_dict):
+    """
+    Returns the priority of a rate plan dictionary as a number, the score
+    a rate plan starts from
+    """
+    value = rp_dict.get("priority", 0)
+    for convert in (int, float):
+        try:
+            return convert(value)
+        except (TypeError, ValueError):
+            pass
+    return 0
+
+
+def camel_dict(record, convert=None):
+    """
+    Returns the fields of the record by their camel converted names, as
+    the get_camel_converted_* helpers do
+    """
+    keys = key_map(record)
+    if convert is None:
+        return dict((keys[name], value) for name, value in record)
+    return dict((keys[name], convert(value)) for name, value in record)
+
+
+def tier_order(rpct_dict):
+    try:
+        return int(rpct_dict.get("tier"))
+    except (TypeError, ValueError):
+        return 0
+
+
+class RatePlanMatcher(object):
+    """
+    Index of a CatalogSnapshot answering match_product_rate_plans().
+
+    The results are kept by arguments. Every call returns new product and
+    rate plan dictionaries, which can be modified by the caller, but their
+    rate_plan_charges (and the tiers under them) are shared by the calls
+    and must not be modified.
+    """
+    def __init__(self, snapshot, max_results=1000):
+        """
+        :param CatalogSnapshot snapshot: catalog to match against
+        :param int max_results: results kept before the oldest are dropped
+        """
+        self.snapshot = snapshot
+        self.max_results = max_results
+        self.products = dict((product_id, camel_dict(record))
+                             for product_id, record
+                             in snapshot.products.items())
+
+        # The charges of each rate plan, sorted, with their tiers
+        charges = {}
+        for rate_plan_id, records in snapshot.charges_by_rate_plan.items():
+            rpc_list = []
+            for record in records:
+                rpc_dict = camel_dict(record, str)
+                rpc_dict["rate_plan_charge_tiers"] = sorted(
+                    [camel_dict(tier, str) for tier in
+                     snapshot.tiers_by_charge.get(record.Id, [])],
+                    key=tier_order)
+                rpc_list.append(rpc_dict)
+            charges[rate_plan_id] = sorted(
+                rpc_list, key=lambda k: k.get('sort_order', 999))
+
+        # (rp_dict, start, end, charges) of the rate plans of each product
+        self.rate_plans = {}
+        for product_id, records in snapshot.rate_plans_by_product.items():
+            self.rate_plans[product_id] = [
+                (camel_dict(record, str),
+                 to_datetime(getattr(record, 'EffectiveStartDate', None)),
+                 to_datetime(getattr(record, 'EffectiveEndDate', None)),
+                 charges.get(record.Id, []))
+                for record in records]
+
+        self.results = {}
+        # Scored results are kept while now is before valid_until
+        self.valid_until = datetime.min
+        self.lock = threading.Lock()
+
+    def next_change(self, now):
+        """
+        Returns when the next rate plan becomes effective or expires after
+        now, or None
+        """
+        changes = [date for rate_plans in self.rate_plans.values()
+                   for _, start, end, _ in rate_plans
+                   for date in (start, end)
+                   if date is not None and date > now]
+        return min(changes) if changes else None
+
+    def match(self, shortcodes, filter_, now):
+        """
+        Returns the products matching the shortcodes (all of them when
+        empty), with their rate plans effective at `now` scored against
+        filter_, like match_product_rate_plans()
+
+        :param list shortcodes: short codes of the products
+        :param dict filter_: values of the rate plan fields to score
+        :param datetime now: date of the effective rate plans (a date or
+                             date string is taken at midnight)
+        """
+        now = to_datetime(now)
+        key = (tuple(shortcodes), tuple(sorted(filter_.items())))
+        with self.lock:
+            if now >= self.valid_until:
+                self.results.clear()
+                # No change ahead: the results never expire
+                self.valid_until = self.next_change(now) or datetime.max
+            result = self.results.get(key)
+        if result is None:
+            result = self.score(shortcodes, filter_, now)
+            with self.lock:
+                if len(self.results) >= self.max_results:
+                    self.results.clear()
+                self.results[key] = result
+        return [dict(p_dict, rate_plans=[dict(rp_dict)
+                                         for rp_dict in p_dict["rate_plans"]])
+                for p_dict in result]
+
+    def score(self, shortcodes, filter_, now):
+        product_ids = []
+        for record in self.snapshot.get_products(shortcodes=shortcodes):
+            if record.Id not in product_ids:
+                product_ids.append(record.Id)
+        if not product_ids:
+            raise DoesNotExist("Unable to find Product for %s" % shortcodes)
+
+        matching_rate_plans = []
+        charge_count = tier_count = 0
+        for product_id in product_ids:
+            rp_list = []
+            for rp_dict, start, end, rpc_list in \
+                    self.rate_plans.get(product_id, []):
+                # Like the query, rate plans without dates don't match
+                if start is None or end is None or \
+                        not start <= now <= end:
+                    continue
+                score = priority(rp_dict)
+                for field, match in filter_.items():
+                    if rp_dict.get(field) and \
+                            pattern(rp_dict[field]).match(match):
+                        score += 1
+                charge_count += len(rpc_list)
+                tier_count += sum(len(rpc_dict["rate_plan_charge_tiers"])
+                                  for rpc_dict in rpc_list)
+                rp_list.append(dict(rp_dict, score=score,
+                                    rate_plan_charges=rpc_list))
+            p_dict = dict(self.products[product_id])
+            p_dict["rate_plans"] = sorted(rp_list,
+                                          key=lambda k: k.get('score', 0),
+                                          reverse=True)
+            matching_rate_plans.append(p_dict)
+
+        # Raised where the queries of match_product_rate_plans() find nothing
+        if not any(p_dict["rate_plans"] for p_dict in matching_rate_plans):
+            raise DoesNotExist("Unable to find Product Rate Plan for %s"
+                               % product_ids)
+        if not charge_count:
+            raise DoesNotExist(
+                "Unable to find Product Rate Plan Charges for %s"
+                % product_ids)
+        if not tier_count:
+            raise DoesNotExist(
+                "Unable to find Product Rate Plan Charges Tiers for %s"
+                % product_ids)
+        return matching_rate_plans
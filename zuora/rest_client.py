@@ -1,6 +1,5 @@
-import requests
 from rest_wrapper import (AccountManager, CatalogManager, PaymentMethodManager,
-                          SubscriptionManager, TransactionManager,
+                          RetryStats, SubscriptionManager, TransactionManager,
                           UsageManager)
 
 ## This file contains some parameters that will need to be changed to work in different tenants:
@@ -24,12 +23,48 @@ hpmCreditCardPaymentMethodId = '2c92c0f93cf64d94013cfe2d20db61a7'
 
 class ZuoraConfig(object):
     def __init__(self, zuora_settings):
+        """
+        Optional dictionary settings:
+
+        rest_pool_size : int : Connections kept open to the REST endpoint
+                               (default 10)
+        rest_keep_alive : bool : Reuse connections between REST calls
+                                 (default True)
+        rest_max_retries : int : Times a call is repeated after transient
+                                 failures (5xx, 429; for a POST only 429,
+                                 503 and the lock and limit errors)
+                                 (default 3)
+        rest_retry_backoff : float : Seconds before the first repeat,
+                                     doubled for each next one
+                                     (default 0.5)
+        rate_limiter : RateLimiter : Paces the calls (see zuora.rate_limiter)
+        timeout : tuple : (connect, read) seconds of the requests, None to
+                          wait forever (default (10, 60))
+        operation_timeouts : dict : (connect, read) seconds per manager
+                                    method name (see zuora.timeouts)
+        """
+        from adapters import pooled_session
+        from timeouts import DEFAULT_TIMEOUT, Timeouts
+
         for key, value in zuora_settings.items():
             setattr(self, key, value)
         self.default_cancellation_policy = 'EndOfCurrentTerm'
         self.headers = {'apiAccessKeyId': zuora_settings['username'],
                         'apiSecretAccessKey': zuora_settings['password'],
                         'Content-Type': 'application/json'}
+        self.timeouts = Timeouts(
+                    zuora_settings.get('timeout', DEFAULT_TIMEOUT),
+                    zuora_settings.get('operation_timeouts'))
+        # Shared by the managers, so REST calls reuse warm connections
+        self.http_session = pooled_session(
+                    pool_size=zuora_settings.get('rest_pool_size', 10),
+                    keep_alive=zuora_settings.get('rest_keep_alive', True),
+                    timeouts=self.timeouts)
+        self.rest_max_retries = zuora_settings.get('rest_max_retries', 3)
+        self.rest_retry_backoff = zuora_settings.get('rest_retry_backoff',
+                                                     0.5)
+        self.retry_stats = RetryStats()
+        self.rate_limiter = zuora_settings.get('rate_limiter')
 
 
 class RestClient(object):
@@ -42,3 +77,8 @@ class RestClient(object):
         self.transaction = TransactionManager(self.zuora_config)
         self.usage = UsageManager(self.zuora_config)
 
+    def login(self):
+        """
+        Logs in through the REST connections resource
+        """
+        return self.account.login()
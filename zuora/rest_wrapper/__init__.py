@@ -1,6 +1,7 @@
 from account_manager import AccountManager
 from catalog_manager import CatalogManager
 from payment_method_manager import PaymentMethodManager
+from request_base import RetryStats
 from subscription_manager import SubscriptionManager
 from transaction_manager import TransactionManager
 from usage_manager import UsageManager
@@ -1,5 +1,4 @@
 import json
-import requests
 from request_base import RequestBase, rest_client_reconnect
 
 # For more information on parameters and responses, please see
@@ -18,8 +17,8 @@ class AccountManager(RequestBase):
             # No parameters were passed in
             return None
     
-        response = requests.post(fullUrl, data=data,
-                                 headers=self.zuora_config.headers)
+        response = self.http.post(fullUrl, data=data,
+                                  headers=self.zuora_config.headers)
         return self.get_json(response)
     
     @rest_client_reconnect
@@ -27,14 +26,14 @@ class AccountManager(RequestBase):
         fullUrl = self.zuora_config.base_url + 'accounts/' + accountKey + \
                   '/summary'
     
-        response = requests.get(fullUrl, headers=self.zuora_config.headers)
+        response = self.http.get(fullUrl, headers=self.zuora_config.headers)
         return self.get_json(response)
     
     @rest_client_reconnect
     def get_account(self, accountKey):
         fullUrl = self.zuora_config.baseUrl + 'accounts/' + accountKey
     
-        response = requests.get(fullUrl, headers=self.zuora_config.headers)
+        response = self.http.get(fullUrl, headers=self.zuora_config.headers)
         return self.get_json(response)
     
     @rest_client_reconnect
@@ -46,6 +45,6 @@ class AccountManager(RequestBase):
         else:
             data = None
     
-        response = requests.put(fullUrl, data=data,
-                                headers=self.zuora_config.headers)
+        response = self.http.put(fullUrl, data=data,
+                                 headers=self.zuora_config.headers)
         return self.get_json(response)
@@ -1,4 +1,3 @@
-import requests
 from request_base import RequestBase, rest_client_reconnect
 
 # For more information on parameters and responses, please see
@@ -13,6 +12,6 @@ class CatalogManager(RequestBase):
         params = {'pageSize': pageSize,
                   'page': page}
     
-        response = requests.get(fullUrl, params=params,
-                                headers=self.zuora_config.headers)
+        response = self.http.get(fullUrl, params=params,
+                                 headers=self.zuora_config.headers)
         return self.get_json(response)
@@ -1,6 +1,5 @@
 from request_base import RequestBase, rest_client_reconnect
 import json
-import requests
 
 
 class PaymentMethodManager(RequestBase):
@@ -17,8 +16,8 @@ class PaymentMethodManager(RequestBase):
             return None
         data = json.dumps(kwargs)
     
-        response = requests.post(fullUrl, data=data,
-                                 headers=self.zuora_config.headers)
+        response = self.http.post(fullUrl, data=data,
+                                  headers=self.zuora_config.headers)
         return self.get_json(response)
     
     @rest_client_reconnect
@@ -27,8 +26,8 @@ class PaymentMethodManager(RequestBase):
                   'payment-methods/credit-cards/accounts/' + accountKey
         data = {'pageSize': pageSize}
     
-        response = requests.get(fullUrl, params=data,
-                                headers=self.zuora_config.headers)
+        response = self.http.get(fullUrl, params=data,
+                                 headers=self.zuora_config.headers)
         return self.get_json(response)
     
     @rest_client_reconnect
@@ -43,8 +42,8 @@ class PaymentMethodManager(RequestBase):
             print('No parameters were passed in')
             return None
     
-        response = requests.put(fullUrl, data=data,
-                                headers=self.zuora_config.headers)
+        response = self.http.put(fullUrl, data=data,
+                                 headers=self.zuora_config.headers)
         return self.get_json(response)
     
     @rest_client_reconnect
@@ -52,5 +51,5 @@ class PaymentMethodManager(RequestBase):
         fullUrl = self.zuora_config.base_url + 'payment-methods/' + \
                   paymentMethodId
     
-        response = requests.delete(fullUrl, headers=self.zuora_config.headers)
+        response = self.http.delete(fullUrl, headers=self.zuora_config.headers)
         return self.get_json(response)
@@ -1,25 +1,153 @@
-import requests
 from functools import wraps
+import threading
+import time
 
 import logging
 log = logging.getLogger(__name__)
 
+try:
+    from ..timeouts import operation, remaining
+except (ImportError, ValueError):
+    # rest_wrapper imported as a top-level package, with zuora on the path
+    from timeouts import operation, remaining
+
+#: How rest_client_reconnect handles a failed response, see classify()
+AUTHENTICATION = 'authentication'
+TRANSIENT = 'transient'
+
+#: Categories (the last two digits) of the Zuora REST error codes
+#: authentication failed
+AUTHENTICATION_CATEGORIES = ('11',)
+#: locking contention, internal error, request exceeded limit
+TRANSIENT_CATEGORIES = ('50', '60', '70')
+#: request exceeded limit
+LIMIT_CATEGORIES = ('70',)
+#: locking contention, request exceeded limit: the request wasn't run, so
+#: even a POST can be repeated
+NOT_RUN_CATEGORIES = ('50', '70')
+#: HTTP statuses of requests that weren't run
+NOT_RUN_STATUSES = (429, 503)
+
+
+def classify(response):
+    """
+    Returns AUTHENTICATION when a failed response calls for a new login,
+    TRANSIENT when the call may succeed if repeated later, or None
+    (business failures such as validation errors)
+
+    A POST isn't idempotent: a 5xx or an internal error may come after
+    Zuora ran it, and repeating it would create a second subscription or
+    payment. So a POST is only TRANSIENT when it provably didn't run (429,
+    503, locking contention, request exceeded limit).
+
+    :param dict response: json returned by RequestBase.get_json()
+    """
+    status = response.get('httpStatusCode')
+    idempotent = response.get('httpMethod') != 'POST'
+    if status == 401:
+        return AUTHENTICATION
+    if status in NOT_RUN_STATUSES or \
+            (idempotent and status is not None and status >= 500):
+        return TRANSIENT
+    transient_categories = TRANSIENT_CATEGORIES if idempotent \
+        else NOT_RUN_CATEGORIES
+    for reason in response.get('reasons') or ():
+        if not isinstance(reason, dict):
+            continue
+        category = str(reason.get('code', ''))[-2:]
+        if category in AUTHENTICATION_CATEGORIES:
+            return AUTHENTICATION
+        if category in transient_categories:
+            return TRANSIENT
+    return None
+
+
+def exceeded_limit(response):
+    """
+    Returns whether Zuora rejected the request for exceeding a rate or
+    concurrency limit
+
+    :param dict response: json returned by RequestBase.get_json()
+    """
+    if response.get('httpStatusCode') == 429:
+        return True
+    return any(isinstance(reason, dict) and
+               str(reason.get('code', ''))[-2:] in LIMIT_CATEGORIES
+               for reason in response.get('reasons') or ())
+
+
+class RetryStats(object):
+    """
+    Counters of rest_client_reconnect:
+
+    relogins: logins after an authentication failure
+    retries: calls repeated after a transient failure
+    failures: failed responses returned to the caller
+    """
+    def __init__(self):
+        self.relogins = 0
+        self.retries = 0
+        self.failures = 0
+        self.lock = threading.Lock()
+
+    def count(self, name):
+        with self.lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def __repr__(self):
+        return '<RetryStats relogins=%d retries=%d failures=%d>' % (
+            self.relogins, self.retries, self.failures)
+
 
 def rest_client_reconnect(fn):
-    """Tries to re-login if the REST request fails.
+    """Retries a failed REST request according to classify():
+       logs in again once on authentication failures, and backs off
+       exponentially on transient ones (up to rest_max_retries times, and
+       within the deadline of the thread). POSTs are only repeated when
+       they didn't run.
+       Other failures are returned as is.
+       Requests are paced by the rate_limiter of the ZuoraConfig, and use
+       the timeouts of the operation named after the method.
        Only works with RequestBase methods
     """
     @wraps(fn)
     def wrapped(self, *args, **kwargs):
-        response = fn(self, *args, **kwargs)
-        # If it worked just fine, return the response
-        if response.get('success'):
-            return response
-        # Otherwise, try to login, and then retry the call
-        else:
-            self.login()
-            log.info("Zuora: Re-logged in through REST client.")
-            return fn(self, *args, **kwargs)
+        config = self.zuora_config
+        relogged = False
+        retries = 0
+        while True:
+            with operation(fn.__name__):
+                if config.rate_limiter is None:
+                    response = fn(self, *args, **kwargs)
+                else:
+                    with config.rate_limiter.slot() as slot:
+                        response = fn(self, *args, **kwargs)
+                        if isinstance(response, dict) and \
+                                not response.get('success') and \
+                                exceeded_limit(response):
+                            slot.throttle()
+            # If it worked just fine (or returned nothing to check), return
+            # the response
+            if not isinstance(response, dict) or response.get('success'):
+                return response
+            failure = classify(response)
+            delay = config.rest_retry_backoff * 2 ** retries
+            left = remaining()
+            if failure == AUTHENTICATION and not relogged:
+                relogged = True
+                self.login()
+                config.retry_stats.count('relogins')
+                log.info("Zuora: Re-logged in through REST client.")
+            elif failure == TRANSIENT and retries < config.rest_max_retries \
+                    and (left is None or left > delay):
+                retries += 1
+                config.retry_stats.count('retries')
+                log.info("Zuora: Retrying %s in %.1fs after a transient "
+                         "failure." % (fn.__name__, delay))
+                time.sleep(delay)
+            else:
+                config.retry_stats.count('failures')
+                return response
     return wrapped
 
 
@@ -27,15 +155,46 @@ class RequestBase(object):
     def __init__(self, zuora_config):
         self.zuora_config = zuora_config
 
+    @property
+    def http(self):
+        """
+        The requests session of the ZuoraConfig, shared by its managers
+        """
+        return self.zuora_config.http_session
+
     def login(self):
         fullUrl = self.zuora_config.base_url + 'connections'
-        response = requests.post(fullUrl, headers=self.zuora_config.headers)
+        response = self.http.post(fullUrl, headers=self.zuora_config.headers)
         return self.get_json(response)
 
     def get_json(self, response):
+        """
+        Returns the json of the response, or None when it isn't json. For
+        HTTP errors, that is the error body Zuora sent (or
+        {'success': False} without one) with the status in httpStatusCode.
+        Failures also hold the request method in httpMethod (see
+        classify()).
+        """
+        from requests.exceptions import HTTPError
+
         try:
             response.raise_for_status()
-            return response.json()
-        except requests.exceptions.RequestException as e:
-            print(e)
+            body = response.json()
+        except ValueError as e:
+            log.warning("Zuora: REST response isn't json. %s" % e)
             return None
+        except HTTPError as e:
+            log.warning("Zuora: REST request failed. %s" % e)
+            try:
+                body = response.json()
+            except ValueError:
+                body = None
+            if not isinstance(body, dict):
+                body = {'success': False}
+            body.setdefault('success', False)
+            body['httpStatusCode'] = response.status_code
+        method = getattr(response.request, 'method', None)
+        if method is not None and isinstance(body, dict) and \
+                not body.get('success'):
+            body['httpMethod'] = method
+        return body
@@ -1,5 +1,4 @@
 import json
-import requests
 
 import logging
 log = logging.getLogger(__name__)
@@ -15,14 +14,14 @@ class SubscriptionManager(RequestBase):
                   accountKey
         data = {'pageSize': pageSize}
 
-        response = requests.get(fullUrl, params=data,
-                                headers=self.zuora_config.headers)
+        response = self.http.get(fullUrl, params=data,
+                                 headers=self.zuora_config.headers)
         return self.get_json(response)
 
     @rest_client_reconnect
     def get_subscriptions_by_key(self, subsKey):
         fullUrl = self.zuora_config.base_url + 'subscriptions/' + subsKey
-        response = requests.get(fullUrl, headers=self.zuora_config.headers)
+        response = self.http.get(fullUrl, headers=self.zuora_config.headers)
         return self.get_json(response)
 
     @rest_client_reconnect
@@ -31,8 +30,8 @@ class SubscriptionManager(RequestBase):
         fullUrl = self.zuora_config.base_url + 'subscriptions/' + subsKey + \
                   '/renew'
         data = json.dumps(jsonParams)
-        response = requests.put(fullUrl, data=data,
-                                headers=self.zuora_config.headers)
+        response = self.http.put(fullUrl, data=data,
+                                 headers=self.zuora_config.headers)
         return self.get_json(response)
 
     @rest_client_reconnect
@@ -43,30 +42,30 @@ class SubscriptionManager(RequestBase):
                   '/cancel'
         data = json.dumps(jsonParams)
         log.info("Zuora REST: Canceling subscription: %s" % subsKey)
-        response = requests.put(fullUrl, data=data,
-                                headers=self.zuora_config.headers)
+        response = self.http.put(fullUrl, data=data,
+                                 headers=self.zuora_config.headers)
         return self.get_json(response)
 
     @rest_client_reconnect
     def preview_subscription(self, jsonParams):
         fullUrl = self.zuora_config.base_url + 'subscriptions/preview'
         data = json.dumps(jsonParams)
-        response = requests.post(fullUrl, data=data,
-                                 headers=self.zuora_config.headers)
+        response = self.http.post(fullUrl, data=data,
+                                  headers=self.zuora_config.headers)
         return self.get_json(response)
 
     @rest_client_reconnect
     def create_subscription(self, jsonParams):
         fullUrl = self.zuora_config.base_url + 'subscriptions'
         data = json.dumps(jsonParams)
-        response = requests.post(fullUrl, data=data,
-                                 headers=self.zuora_config.headers)
+        response = self.http.post(fullUrl, data=data,
+                                  headers=self.zuora_config.headers)
         return self.get_json(response)
 
     @rest_client_reconnect
     def update_subscription(self, subsKey, jsonParams):
         fullUrl = self.zuora_config.base_url + 'subscriptions/' + subsKey
         data = json.dumps(jsonParams)
-        response = requests.put(fullUrl, data=data,
-                                headers=self.zuora_config.headers)
+        response = self.http.put(fullUrl, data=data,
+                                 headers=self.zuora_config.headers)
         return self.get_json(response)
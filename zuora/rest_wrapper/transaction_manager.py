@@ -1,5 +1,4 @@
 import json
-import requests
 from request_base import RequestBase, rest_client_reconnect
 
 
@@ -12,8 +11,8 @@ class TransactionManager(RequestBase):
         params = {
             'pageSize': pageSize
         }
-        response = requests.get(fullUrl, params=params,
-                                headers=self.zuora_config.headers)
+        response = self.http.get(fullUrl, params=params,
+                                 headers=self.zuora_config.headers)
         return self.get_json(response)
     
     @rest_client_reconnect
@@ -23,14 +22,14 @@ class TransactionManager(RequestBase):
         params = {
             'pageSize': pageSize
         }
-        response = requests.get(fullUrl, params=params,
-                                headers=self.zuora_config.headers)
+        response = self.http.get(fullUrl, params=params,
+                                 headers=self.zuora_config.headers)
         return self.get_json(response)
     
     @rest_client_reconnect
     def invoice_and_collect(self, jsonParams):
         fullUrl = self.zuora_config.base_url + 'operations/invoice-collect'
         data = json.dumps(jsonParams)
-        response = requests.post(fullUrl, data=data,
-                                 headers=self.zuora_config.headers)
+        response = self.http.post(fullUrl, data=data,
+                                  headers=self.zuora_config.headers)
         return self.get_json(response)
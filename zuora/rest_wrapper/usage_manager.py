@@ -1,4 +1,3 @@
-import requests
 from request_base import RequestBase, rest_client_reconnect
 
 
@@ -9,6 +8,6 @@ class UsageManager(RequestBase):
         fullUrl = self.zuora_config.base_url + 'usage/accounts/' + \
                   accountKey
         params = {'pageSize': pageSize}
-        response = requests.get(fullUrl, params=params,
-                                headers=self.zuora_config.headers)
+        response = self.http.get(fullUrl, params=params,
+                                 headers=self.zuora_config.headers)
         return self.get_json(response)
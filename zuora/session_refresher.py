@@ -0,0 +1,87 @@
+"""
+    Zuora Session Refresher
+    ~~~~~~~~~~~~~~~~~~~~~~~
+
+    Keeps the sessions of a Zuora instance alive from a background thread,
+    renewing them shortly before they expire, so calls never wait for a
+    login.
+
+    Usage example:
+    zuora_settings['session_refresh'] = True
+    zuora_settings['session_max_age'] = 900
+    z = Zuora(zuora_settings)
+"""
+import sys
+import threading
+import time
+import weakref
+
+import logging
+log = logging.getLogger(__name__)
+
+
+class SessionRefresher(threading.Thread):
+    """
+    Logs a Zuora instance in, then renews its SOAP session `margin` seconds
+    before it is `max_age` seconds old. The REST login is renewed at the
+    same time, once the REST client is in use.
+
+    The thread only holds a weak reference to the instance, and is stopped
+    as soon as the instance is garbage collected, or stop() is called.
+    """
+    def __init__(self, zuora, max_age, margin=60, retry_interval=30):
+        """
+        :param Zuora zuora: instance to keep logged in
+        :param int max_age: seconds a Zuora session lasts
+        :param int margin: seconds before expiry to renew the session
+        :param int retry_interval: seconds to wait after a failed renewal
+        """
+        threading.Thread.__init__(self, name='zuora-session-refresher')
+        self.daemon = True
+        self.max_age = max_age
+        self.margin = margin
+        self.retry_interval = retry_interval
+        self.stopped = threading.Event()
+        # Wakes the thread up when the instance is collected
+        self.zuora = weakref.ref(zuora, lambda _: self.stop())
+
+    def stop(self):
+        self.stopped.set()
+
+    def next_refresh(self, zuora):
+        """
+        Returns the seconds until the session of the instance needs renewing
+        """
+        if not zuora.session_id or zuora.session_created is None:
+            return 0
+        return max(0, zuora.session_created + self.max_age - self.margin -
+                   time.time())
+
+    def refresh(self, zuora):
+        if zuora.session_id:
+            zuora.refresh_session()
+        else:
+            zuora.login()
+        if 'rest_client' in zuora.__dict__:
+            zuora.rest_client.login()
+
+    def run(self):
+        wait = 0
+        while not self.stopped.wait(wait):
+            zuora = self.zuora()
+            if zuora is None:
+                return
+            try:
+                if self.next_refresh(zuora) == 0:
+                    self.refresh(zuora)
+                wait = self.next_refresh(zuora) or self.retry_interval
+            except Exception as error:
+                log.warning("Zuora: Unable to refresh the session. %s"
+                            % error)
+                wait = self.retry_interval
+                # Python 2 keeps the traceback, and the instance in it,
+                # until the next exception
+                if hasattr(sys, 'exc_clear'):
+                    sys.exc_clear()
+            # Don't keep the instance alive while waiting
+            del zuora
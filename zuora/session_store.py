@@ -0,0 +1,272 @@
+"""
+    Zuora Session Store
+    ~~~~~~~~~~~~~~~~~~~
+
+    Shares the SOAP session id between processes, so a new worker reuses the
+    session of the others instead of logging in.
+
+    Usage example:
+    from zuora import Zuora
+    from zuora.session_store import FileSessionStore
+
+    zuora_settings['session_store'] = FileSessionStore('/var/run/zuora')
+    z = Zuora(zuora_settings)
+
+    Other caches (memcache, redis, ...) plug in by implementing the
+    SessionStore methods.
+
+    The session ids grant access to the Zuora tenant, so the file and sqlite
+    stores keep them in a directory private to the user (see user_dirs).
+"""
+from contextlib import closing, contextmanager
+import hashlib
+import json
+import os
+from os import path
+import sqlite3
+import tempfile
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:
+    # Not available on Windows, locks are then per process only
+    fcntl = None
+
+from user_dirs import private_dir, private_file, user_cache_dir
+
+import logging
+log = logging.getLogger(__name__)
+
+
+def session_key(username, wsdl_file):
+    """
+    Returns the store key of the sessions of a user on a Zuora endpoint
+    """
+    return hashlib.sha1(('%s\0%s' % (username, wsdl_file))
+                        .encode('utf-8')).hexdigest()
+
+
+class SessionStore(object):
+    """
+    Interface of the session stores.
+
+    get() must never return a partially written session id, and lock() must
+    exclude the holders of the same key in every process sharing the store,
+    so only one of them logs in when the session is missing.
+    """
+    def __init__(self, max_age=None):
+        """
+        :param int max_age: seconds after which a stored session is ignored
+        """
+        self.max_age = max_age
+
+    def get(self, key):
+        """
+        Returns the stored (session_id, created) for the key, or None
+        """
+        raise NotImplementedError
+
+    def set(self, key, session_id):
+        """
+        Stores the session id for the key
+        """
+        raise NotImplementedError
+
+    def delete(self, key, session_id=None):
+        """
+        Removes the session of the key, only if it is still session_id when
+        one is given
+        """
+        raise NotImplementedError
+
+    @contextmanager
+    def lock(self, key):
+        """
+        Holds the exclusive lock of the key
+        """
+        raise NotImplementedError
+        yield
+
+    def expired(self, created):
+        return self.max_age is not None and \
+            time.time() - created >= self.max_age
+
+
+class MemorySessionStore(SessionStore):
+    """
+    Shares the session between the Zuora instances of one process
+    """
+    def __init__(self, max_age=None):
+        SessionStore.__init__(self, max_age)
+        self.sessions = {}
+        self.locks = {}
+        self.guard = threading.Lock()
+
+    def get(self, key):
+        entry = self.sessions.get(key)
+        if entry is None or self.expired(entry[1]):
+            return None
+        return entry
+
+    def set(self, key, session_id):
+        self.sessions[key] = (session_id, time.time())
+
+    def delete(self, key, session_id=None):
+        with self.guard:
+            entry = self.sessions.get(key)
+            if entry is not None and session_id in (None, entry[0]):
+                del self.sessions[key]
+
+    @contextmanager
+    def lock(self, key):
+        with self.guard:
+            lock = self.locks.setdefault(key, threading.Lock())
+        with lock:
+            yield
+
+
+@contextmanager
+def file_lock(lock_path, thread_lock):
+    """
+    Holds an exclusive flock on lock_path (and thread_lock, as flock does
+    not exclude the threads of a process)
+    """
+    with thread_lock:
+        with open(lock_path, 'a') as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+
+class FileSessionStore(SessionStore):
+    """
+    Stores each session in a json file of the directory. Files are written
+    to a temporary file and renamed into place, so reads are atomic.
+    """
+    def __init__(self, location=None, max_age=None):
+        """
+        :param str location: directory, defaults to
+                             ~/.cache/zuora-session
+        :param int max_age: seconds after which a stored session is ignored
+
+        :raises UnsafeDirectory: the directory isn't private to the user
+        """
+        SessionStore.__init__(self, max_age)
+        self.location = private_dir(location or
+                                    user_cache_dir('zuora-session'))
+        self.thread_lock = threading.Lock()
+
+    def filename(self, key):
+        return path.join(self.location, 'zuora-session-%s.json' % key)
+
+    def get(self, key):
+        try:
+            with open(self.filename(key), 'rb') as stored:
+                entry = json.loads(stored.read().decode('utf-8'))
+            session_id, created = entry['session_id'], entry['created']
+        except (IOError, OSError):
+            return None
+        except (ValueError, KeyError) as error:
+            log.warning("Zuora: Ignoring unreadable stored session. %s"
+                        % error)
+            return None
+        if self.expired(created):
+            return None
+        return session_id, created
+
+    def set(self, key, session_id):
+        fd, tmp_path = tempfile.mkstemp(prefix='.zuora-session-',
+                                        dir=self.location)
+        try:
+            with os.fdopen(fd, 'wb') as stored:
+                stored.write(json.dumps({'session_id': session_id,
+                                         'created': time.time()})
+                             .encode('utf-8'))
+            os.rename(tmp_path, self.filename(key))
+        except Exception:
+            os.remove(tmp_path)
+            raise
+
+    def delete(self, key, session_id=None):
+        # Not under lock(), which the caller may hold. At worst a session
+        # stored meanwhile is removed and costs one more login.
+        entry = self.get(key)
+        if entry is not None and session_id in (None, entry[0]):
+            try:
+                os.remove(self.filename(key))
+            except OSError:
+                pass
+
+    def lock(self, key):
+        return file_lock(self.filename(key) + '.lock', self.thread_lock)
+
+
+class SqliteSessionStore(SessionStore):
+    """
+    Stores the sessions in a sqlite database
+    """
+    def __init__(self, database=None, max_age=None):
+        """
+        :param str database: database path, defaults to
+                             ~/.cache/zuora/zuora-session.db
+        :param int max_age: seconds after which a stored session is ignored
+
+        :raises UnsafeDirectory: the database or its directory isn't private
+                                 to the user
+        """
+        SessionStore.__init__(self, max_age)
+        self.database = private_file(
+            database or path.join(user_cache_dir('zuora'), 'zuora-session.db'))
+        self.thread_lock = threading.Lock()
+        with self.transaction() as connection:
+            connection.execute("""
+                CREATE TABLE IF NOT EXISTS zuora_session (
+                    key TEXT PRIMARY KEY,
+                    session_id TEXT NOT NULL,
+                    created REAL NOT NULL
+                )""")
+
+    @contextmanager
+    def transaction(self):
+        # sqlite connections can't be shared between threads
+        with closing(sqlite3.connect(self.database, timeout=30)) as connection:
+            with connection:
+                yield connection
+
+    def get(self, key):
+        with self.transaction() as connection:
+            entry = connection.execute(
+                "SELECT session_id, created FROM zuora_session WHERE key = ?",
+                (key,)).fetchone()
+        if entry is None or self.expired(entry[1]):
+            return None
+        return entry[0], entry[1]
+
+    def set(self, key, session_id):
+        with self.transaction() as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO zuora_session "
+                "(key, session_id, created) VALUES (?, ?, ?)",
+                (key, session_id, time.time()))
+
+    def delete(self, key, session_id=None):
+        with self.transaction() as connection:
+            if session_id is None:
+                connection.execute(
+                    "DELETE FROM zuora_session WHERE key = ?", (key,))
+            else:
+                connection.execute(
+                    "DELETE FROM zuora_session "
+                    "WHERE key = ? AND session_id = ?", (key, session_id))
+
+    def lock(self, key):
+        # An open transaction would block set() from another connection,
+        # so the key is locked with a file next to the database
+        return file_lock('%s.%s.lock' % (self.database, key),
+                         self.thread_lock)
@@ -0,0 +1,407 @@
+"""
+    Zuora SOAP Client
+    ~~~~~~~~~~~~~~~~~
+
+    The suds client and transport used by zuora.Zuora. The parsed wsdl is
+    shared process-wide through the ClientRegistry.
+
+    Usage example:
+    from soap_client import client_registry
+
+    client = client_registry.checkout('/path/to/zuora.a.48.0.wsdl')
+"""
+from contextlib import contextmanager
+from copy import deepcopy
+import threading
+from xml.sax.saxutils import escape
+
+from suds.client import Client, Method, ServiceSelector, SoapClient
+from suds.options import Options
+from suds.properties import Unskin
+from suds.sudsobject import Object
+from suds.transport import Reply, Request
+from suds.transport.http import HttpAuthenticated
+from suds.xsd.doctor import Import, ImportDoctor
+
+import requests
+
+from adapters import TLSHttpAdapter
+from query_parser import QueryParser, QueryStream
+from rate_limiter import RateLimitExceeded, retry_after
+from user_dirs import UnsafeDirectory
+from wsdl_cache import WsdlCache
+
+import logging
+log = logging.getLogger(__name__)
+
+
+class RequestsTransport(HttpAuthenticated):
+    """
+    A transport adapter for suds that uses the requests library.
+
+    Copies of the transport (made when a suds client is cloned) share the
+    requests session and its connection pool, but not the timeouts.
+    """
+    #: Timeouts of the requests, None to wait forever
+    timeouts = None
+
+    def __init__(self, session=None, pool_size=10, pool_block=False,
+                 **kwargs):
+        """
+        :param Session session: requests session to share
+        :param int pool_size: connections kept per host by a new session
+        :param bool pool_block: when all of them are in use, wait for one
+                                instead of opening a connection that is
+                                closed after the request
+        """
+        # super won't work because not using new style class
+        HttpAuthenticated.__init__(self, **kwargs)
+        if session is None:
+            session = requests.Session()
+            session.mount('https://', TLSHttpAdapter(pool_maxsize=pool_size,
+                                                     pool_block=pool_block))
+        self.session = session
+
+    @property
+    def pool_stats(self):
+        """
+        PoolStats of the https connections of the session
+        """
+        return self.session.get_adapter('https://').stats
+
+    def preconnect(self, url, connections):
+        """
+        Opens connections to the host of url ahead of the first requests,
+        see TLSHttpAdapter.preconnect()
+        """
+        return self.session.get_adapter('https://').preconnect(
+                        url, connections, verify=self.session.verify)
+
+    def __deepcopy__(self, memo):
+        return self.__class__(session=self.session)
+
+    def timeout(self):
+        if self.timeouts is None:
+            return None
+        return self.timeouts.current()
+
+    def send(self, request):
+        self.addcredentials(request)
+        resp = self.session.post(request.url, data=request.message, headers=request.headers,
+                                 timeout=self.timeout())
+        if resp.status_code == 429:
+            # Not a TransportError, which suds would turn into a bare
+            # Exception
+            raise RateLimitExceeded(retry_after(resp.headers))
+        result = Reply(resp.status_code, resp.headers, resp.content)
+        return result
+
+    def stream(self, request):
+        """
+        Sends the request, returning the requests response with the body
+        left unread (read it from response.raw, then close the response)
+        """
+        self.addcredentials(request)
+        resp = self.session.post(request.url, data=request.message,
+                                 headers=request.headers, stream=True,
+                                 timeout=self.timeout())
+        if resp.status_code == 429:
+            resp.close()
+            raise RateLimitExceeded(retry_after(resp.headers))
+        resp.raw.decode_content = True
+        return resp
+
+
+class SharedOptions(object):
+    """
+    Stands in for the options of a registered wsdl.
+
+    suds bindings read options such as the soapheaders from the wsdl rather
+    than from the client, so while a SharedClient method runs on a thread
+    the wsdl options resolve to that client's options.
+    """
+    def __init__(self, options):
+        self.options = options
+        self.local = threading.local()
+
+    def __getattr__(self, name):
+        return getattr(getattr(self.local, 'options', self.options), name)
+
+    @contextmanager
+    def use(self, options):
+        previous = getattr(self.local, 'options', self.options)
+        self.local.options = options
+        try:
+            yield
+        finally:
+            self.local.options = previous
+
+
+class SharedMethod(object):
+    """
+    A suds service method invoked with the options of its SharedClient
+    """
+    def __init__(self, client, method):
+        self.client = client
+        self.method = method
+
+    def __call__(self, *args, **kwargs):
+        with self.client.wsdl.options.use(self.client.options):
+            return self.method(*args, **kwargs)
+
+
+class SharedServiceSelector(ServiceSelector):
+    """
+    A suds service selector returning SharedMethods
+    """
+    def __init__(self, client, services):
+        ServiceSelector.__init__(self, client, services)
+        self.__client = client
+
+    def __getattr__(self, name):
+        result = ServiceSelector.__getattr__(self, name)
+        if isinstance(result, Method):
+            return SharedMethod(self.__client, result)
+        return result
+
+
+def envelope_template(method, argument):
+    """
+    Returns the soap envelope of a single argument call, with placeholders
+    for the session id and the escaped argument
+    """
+    return (u'<?xml version="1.0" encoding="UTF-8"?>'
+            u'<SOAP-ENV:Envelope xmlns:ns1="http://api.zuora.com/" '
+            u'xmlns:SOAP-ENV="http://schemas.xmlsoap.org/soap/envelope/">'
+            u'<SOAP-ENV:Header><ns1:SessionHeader><ns1:session>%%s'
+            u'</ns1:session></ns1:SessionHeader></SOAP-ENV:Header>'
+            u'<SOAP-ENV:Body><ns1:%(method)s><ns1:%(argument)s>%%s'
+            u'</ns1:%(argument)s></ns1:%(method)s></SOAP-ENV:Body>'
+            u'</SOAP-ENV:Envelope>'
+            % {'method': method, 'argument': argument})
+
+
+class TemplateEnvelope(object):
+    """
+    A filled in envelope template, standing in for the suds Document that
+    SoapClient.send() expects
+    """
+    def __init__(self, text):
+        self.text = text
+
+    def root(self):
+        # There is no document for suds "marshalled" plugins to edit
+        return None
+
+    def plain(self):
+        return self.text
+
+    str = plain
+
+    def __str__(self):
+        return self.text
+
+
+class SharedClient(Client):
+    """
+    A suds client sharing the parsed wsdl, the factory and the service
+    definitions of a client registered with the ClientRegistry.
+
+    Unlike Client.clone(), option values are shared instead of deep copied.
+    Only the transport is copied, and set_options() replaces values, so
+    changing the options of one client never affects another.
+    """
+    def __init__(self, client):
+        # Client.__init__ would read the wsdl again
+        options = dict(Unskin(client.options).defined)
+        options['transport'] = deepcopy(options['transport'])
+        self.options = Options()
+        Unskin(self.options).update(options)
+        self.wsdl = client.wsdl
+        self.factory = client.factory
+        self.service = SharedServiceSelector(self, client.wsdl.services)
+        self.sd = client.sd
+        self.query_parser = client.query_parser
+        self.messages = dict(tx=None, rx=None)
+
+    #: Envelope templates of the methods supported by template_call()
+    templates = {'query': envelope_template('query', 'queryString'),
+                 'queryMore': envelope_template('queryMore', 'queryLocator')}
+
+    def template_call(self, name, session_id, value, retxml=False):
+        """
+        Calls query or queryMore with an envelope filled in from a template
+        instead of marshalled by suds. The request goes through the client
+        transport and the reply is unmarshalled by suds as usual.
+
+        :param str name: 'query' or 'queryMore'
+        :param str session_id: Zuora session id
+        :param str value: the query string or query locator
+        :param bool retxml: return the raw reply instead (for the
+                            QueryParser)
+        """
+        if retxml:
+            request = self.template_request(name, session_id, value)
+            return self.options.transport.send(request).message
+        envelope = self.templates[name] % (escape(session_id), escape(value))
+        method = self.wsdl.services[0].ports[0].methods[name]
+        with self.wsdl.options.use(self.options):
+            return SoapClient(self, method).send(TemplateEnvelope(envelope))
+
+    def template_request(self, name, session_id, value):
+        """
+        Returns the transport request of a template call
+        """
+        envelope = self.templates[name] % (escape(session_id), escape(value))
+        method = self.wsdl.services[0].ports[0].methods[name]
+        soap_client = SoapClient(self, method)
+        request = Request(soap_client.location(), envelope.encode('utf-8'))
+        request.headers = soap_client.headers()
+        return request
+
+    def preconnect(self, connections):
+        """
+        Opens connections to the soap endpoint ahead of the first calls
+        """
+        method = self.wsdl.services[0].ports[0].methods['login']
+        return self.options.transport.preconnect(
+                        SoapClient(self, method).location(), connections)
+
+    def template_stream(self, name, session_id, value):
+        """
+        Like template_call(), but returns a QueryStream parsing the records
+        as the reply is read
+        """
+        request = self.template_request(name, session_id, value)
+        response = self.options.transport.stream(request)
+        if response.status_code != 200:
+            # Raise faults such as INVALID_SESSION right away, so they can
+            # be handled like those of the other calls
+            try:
+                self.query_parser.parse(response.content)
+            finally:
+                response.close()
+        return QueryStream(self.query_parser, response.raw,
+                           close=response.close)
+
+
+def clone_object(obj):
+    """
+    Copies a suds object and the suds objects and lists nested in it. The
+    schema types referenced by the object metadata are shared, not copied.
+    """
+    clone = obj.__class__()
+    for name in obj.__metadata__.__keylist__:
+        setattr(clone.__metadata__, name, getattr(obj.__metadata__, name))
+    for name in obj.__keylist__:
+        value = getattr(obj, name)
+        if isinstance(value, Object):
+            value = clone_object(value)
+        elif isinstance(value, list):
+            value = [clone_object(item) if isinstance(item, Object) else item
+                     for item in value]
+        setattr(clone, name, value)
+    return clone
+
+
+class PrototypeFactory(object):
+    """
+    Wraps a suds Factory, building each type from the schema only once.
+    create() returns a copy of the cached prototype for the type.
+    """
+    def __init__(self, factory):
+        self.factory = factory
+        self.prototypes = {}
+
+    def __getattr__(self, name):
+        return getattr(self.factory, name)
+
+    def create(self, name):
+        prototype = self.prototypes.get(name)
+        if prototype is None:
+            prototype = self.prototypes[name] = self.factory.create(name)
+        return clone_object(prototype)
+
+    def separator(self, ps):
+        self.factory.separator(ps)
+        self.prototypes = {}
+
+
+class ClientRegistry(object):
+    """
+    Process-wide registry of suds clients, keyed by wsdl file.
+
+    The wsdl is parsed (or loaded from the WsdlCache) once per wsdl file.
+    checkout() hands out SharedClients that share the schema, the service
+    model, the PrototypeFactory and the requests session with the registered
+    client, but have their own options, so soap headers such as the
+    SessionHeader stay per Zuora instance.
+    """
+    def __init__(self):
+        self.clients = {}
+        self.lock = threading.Lock()
+
+    def checkout(self, wsdl_path, wsdl_cache=True, wsdl_cache_dir=None,
+                 pool_size=10, pool_block=False):
+        """
+        Returns a new client for the wsdl file. The cache and pool settings
+        only apply the first time the wsdl file is loaded, different ones
+        passed later are logged and ignored.
+
+        :param str wsdl_path: absolute path to the wsdl file
+        :param bool wsdl_cache: load the parsed wsdl from the WsdlCache
+        :param str wsdl_cache_dir: WsdlCache directory
+        :param int pool_size: connections kept open to the endpoint
+        :param bool pool_block: wait for a pooled connection when all are in
+                                use (see RequestsTransport)
+        """
+        settings = {'wsdl_cache': wsdl_cache,
+                    'wsdl_cache_dir': wsdl_cache_dir,
+                    'pool_size': pool_size, 'pool_block': pool_block}
+        client = self.clients.get(wsdl_path)
+        if client is None:
+            with self.lock:
+                client = self.clients.get(wsdl_path)
+                if client is None:
+                    client = self.build(wsdl_path, wsdl_cache,
+                                        wsdl_cache_dir, pool_size,
+                                        pool_block)
+                    client.registry_settings = settings
+                    self.clients[wsdl_path] = client
+        if settings != client.registry_settings:
+            log.warning("Zuora: %s is already loaded with %s, ignoring %s"
+                        % (wsdl_path, client.registry_settings, settings))
+        return SharedClient(client)
+
+    def build(self, wsdl_path, wsdl_cache=True, wsdl_cache_dir=None,
+              pool_size=10, pool_block=False):
+        cache = None
+        if wsdl_cache:
+            try:
+                cache = WsdlCache(wsdl_path, location=wsdl_cache_dir)
+            except (UnsafeDirectory, OSError) as error:
+                log.warning("Zuora: Not caching the parsed wsdl. %s" % error)
+
+        imp = Import('http://object.api.zuora.com/')
+        imp.filter.add('http://api.zuora.com/')
+        imp.filter.add('http://fault.api.zuora.com/')
+        schema_doctor = ImportDoctor(imp)
+
+        # cachingpolicy=1 caches the parsed definitions rather than the
+        # raw documents
+        client = Client(url='file://%s' % wsdl_path, doctor=schema_doctor,
+                        cache=cache, cachingpolicy=1,
+                        transport=RequestsTransport(pool_size=pool_size,
+                                                    pool_block=pool_block))
+        client.wsdl.options = SharedOptions(client.options)
+        client.factory = PrototypeFactory(client.factory)
+        client.query_parser = QueryParser(client.wsdl.schema)
+        return client
+
+    def clear(self):
+        with self.lock:
+            self.clients.clear()
+
+
+#: Shared by every Zuora instance in the process
+client_registry = ClientRegistry()
@@ -2,13 +2,108 @@
     Unit Tests for Zuora
     ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 """
+from contextlib import closing
+import copy
 import datetime
+import gc
+import io
+import json
 import mock
+import os
+import shutil
+import sqlite3
+import stat
+import subprocess
+import sys
+import tempfile
+import threading
+import time
 
-from client import (Zuora, convert_camel, zuora_serialize)
+import requests
+from suds.sudsobject import Factory
+from requests.packages.urllib3 import connectionpool
+from adapters import TLSHttpAdapter
+import client
+from client import (DoesNotExist, Zuora, ZuoraException, chunk_filters,
+                    convert_camel, key_map, price_matrix, zuora_serialize,
+                    zuora_serialize_iter, zuora_serialize_list)
+from catalog import Catalog, CatalogSnapshot, by_id, to_datetime
+from catalog_tables import CatalogTables
+from hedging import LatencyTracker, hedged_call
+from query_cache import (MemoryQueryCache, SqliteQueryCache, query_key,
+                         query_type)
+from query_parser import QueryFault, QueryStream, Record
+import rate_plan_matcher
+from rate_limiter import RateLimiter, RateLimitExceeded
+from rest_client import RestClient
+from rest_wrapper import request_base
+from session_refresher import SessionRefresher
+from session_store import (FileSessionStore, MemorySessionStore,
+                           SqliteSessionStore)
+import timeouts
+from timeouts import DeadlineExceeded, Timeouts, deadline, operation
+import soap_client
+from soap_client import ClientRegistry, PrototypeFactory, client_registry
+from user_dirs import UnsafeDirectory, user_cache_dir
+import wsdl_cache
+from wsdl_cache import WsdlCache
 
 SHORT_CODE_EXAMPLE = 'sub_bronze'
 
+SOAP_ENVELOPE = """<?xml version="1.0" encoding="UTF-8"?>
+<soapenv:Envelope xmlns:soapenv="http://schemas.xmlsoap.org/soap/envelope/"
+    xmlns:ns1="http://api.zuora.com/"
+    xmlns:ns2="http://object.api.zuora.com/"
+    xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance">
+  <soapenv:Body>%s</soapenv:Body>
+</soapenv:Envelope>"""
+
+LOGIN_RESPONSE = SOAP_ENVELOPE % """
+    <ns1:loginResponse><ns1:result>
+      <ns1:Session>%s</ns1:Session>
+      <ns1:ServerUrl>https://www.zuora.com/apps/services/a/48.0</ns1:ServerUrl>
+    </ns1:result></ns1:loginResponse>"""
+
+CREATE_RESPONSE = SOAP_ENVELOPE % """
+    <ns1:createResponse><ns1:result>
+      <ns1:Id>4028e5</ns1:Id>
+      <ns1:Success>true</ns1:Success>
+    </ns1:result></ns1:createResponse>"""
+
+UPDATE_RESPONSE = CREATE_RESPONSE.replace('createResponse',
+                                          'updateResponse')
+
+QUERY_RESPONSE = SOAP_ENVELOPE % """
+    <ns1:queryResponse><ns1:result>
+      <ns1:done>true</ns1:done>
+      <ns1:queryLocator></ns1:queryLocator>
+      <ns1:records xsi:type="ns2:Account">
+        <ns2:Id>4028e4</ns2:Id>
+        <ns2:AutoPay>false</ns2:AutoPay>
+        <ns2:Balance>10.5</ns2:Balance>
+      </ns1:records>
+      <ns1:size>1</ns1:size>
+    </ns1:result></ns1:queryResponse>"""
+
+QUERY_FAULT = SOAP_ENVELOPE % """
+    <soapenv:Fault>
+      <faultcode>fns:INVALID_SESSION</faultcode>
+      <faultstring>Invalid session</faultstring>
+    </soapenv:Fault>"""
+
+
+def mock_soap_session(z, *replies):
+    """
+    Replaces the requests session of the zuora soap client with a mock
+    answering with the given soap replies
+    """
+    session = mock.Mock()
+    session.post.side_effect = [
+        mock.Mock(status_code=200, headers={}, content=reply)
+        for reply in replies]
+    z.client.options.transport.session = session
+    return session
+
 
 class MockZuoraResponseObject(object):
 
@@ -438,10 +533,2083 @@ class TestZuora(object):
                          update_dict={})
         assert z.update.call_count == 1
 
+    @mock.patch.object(soap_client, 'client_registry')
+    def test_clients_built_on_first_use(self, client_registry):
+        z = Zuora(self.zuora_settings)
+        assert 'client' not in z.__dict__
+        assert 'rest_client' not in z.__dict__
+        assert z.client is client_registry.checkout.return_value
+        assert z.client is z.client
+        assert client_registry.checkout.call_count == 1
+        assert z.rest_client.zuora_config.username == \
+                                            self.zuora_settings['username']
+
+    @mock.patch.object(soap_client, 'client_registry')
+    def test_client_built_once_by_concurrent_threads(self, client_registry):
+        def checkout(*args, **kwargs):
+            time.sleep(0.05)
+            return mock.Mock()
+        client_registry.checkout.side_effect = checkout
+        z = Zuora(self.zuora_settings)
+        clients = []
+        threads = [threading.Thread(target=lambda: clients.append(z.client))
+                   for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert client_registry.checkout.call_count == 1
+        assert all(client is clients[0] for client in clients)
+
+    def test_import_without_suds_or_requests(self):
+        package = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        loaded = subprocess.check_output([
+            sys.executable, '-c',
+            'import sys, zuora; print(" ".join(sorted(sys.modules)))'],
+            cwd=package).split()
+        assert 'suds' not in loaded
+        assert 'requests' not in loaded
+
     def test_convert_camel(self):
         assert convert_camel("AutoRenew") == "auto_renew"
 
+    def test_convert_camel_memoized(self):
+        with mock.patch.object(client, 'CAMEL_NAMES_MAX', 2):
+            client.camel_names.clear()
+            assert convert_camel("ProductRatePlanId") == \
+                                                    "product_rate_plan_id"
+            assert client.camel_names == {
+                                "ProductRatePlanId": "product_rate_plan_id"}
+            convert_camel("AutoRenew")
+            assert convert_camel("AutoRenew") == "auto_renew"
+            assert len(client.camel_names) == 2
+            # Full, dropped before the next name is kept
+            assert convert_camel("IsOveragePrice") == "is_overage_price"
+            assert client.camel_names == {
+                                        "IsOveragePrice": "is_overage_price"}
+
+    @mock.patch.dict(client.key_maps, clear=True)
+    def test_key_map(self):
+        keys = key_map(Factory.object('ProductRatePlan'))
+        assert keys["ShortCode__c"] == "short_code"
+        assert keys["EffectiveStartDate"] == "effective_start_date"
+        assert key_map(Factory.object('ProductRatePlan')) is keys
+        assert key_map(Factory.object('Product')) is not keys
+        assert keys == {"ShortCode__c": "short_code",
+                        "EffectiveStartDate": "effective_start_date"}
+
     def test_zuora_serialize(self):
         obj = MockZuoraResponseObject()
         assert zuora_serialize(obj) == {'auto_renew': True,
                                         'short_code': SHORT_CODE_EXAMPLE}
+
+    def test_zuora_serialize_nested(self):
+        created = datetime.datetime(2014, 3, 1, 10, 15)
+        contact = Factory.object('Contact', {'FirstName': u'Ann',
+                                             'WorkEmail': None})
+        account = Factory.object('Account', {
+            'AccountNumber': 'A-1', 'Balance': 0.0, 'AutoPay': False,
+            'CreatedDate': created, 'BillToContact': contact,
+            'SoldToContact': Factory.object('Contact'),
+            'Invoices': [Factory.object('Invoice', {'Amount': 9.99}),
+                         Factory.object('Invoice', {'Amount': 5})],
+            'Payments': []})
+        assert zuora_serialize(account) == {
+            'account_number': 'A-1', 'balance': 0.0, 'auto_pay': False,
+            'created_date': created,
+            'bill_to_contact': {'first_name': u'Ann', 'work_email': None},
+            'sold_to_contact': None,
+            'invoices': [{'amount': 9.99}, {'amount': 5}],
+            'payments': None}
+        assert zuora_serialize(None) is None
+        assert zuora_serialize([]) is None
+
+    def test_zuora_serialize_iter(self):
+        records = [Factory.object('Invoice', {'Amount': amount})
+                   for amount in (1, 2)]
+        serialized = zuora_serialize_iter(records)
+        assert next(serialized) == {'amount': 1}
+        assert list(serialized) == [{'amount': 2}]
+        assert list(zuora_serialize_iter(None)) == []
+        assert zuora_serialize_list(records) == [{'amount': 1},
+                                                 {'amount': 2}]
+        assert zuora_serialize_list([]) == []
+
+
+class TestWsdlCache(object):
+
+    def setup_method(self, method):
+        self.location = tempfile.mkdtemp()
+        self.wsdl_path = os.path.join(self.location, 'test.wsdl')
+        with open(self.wsdl_path, 'w') as wsdl:
+            wsdl.write('<definitions/>')
+
+    def teardown_method(self, method):
+        shutil.rmtree(self.location)
+
+    def test_put_get(self):
+        cache = WsdlCache(self.wsdl_path, location=self.location)
+        cache.put('1-wsdl', {'schema': 1})
+        assert cache.get('1-wsdl') == {'schema': 1}
+
+    def test_get_missing(self):
+        cache = WsdlCache(self.wsdl_path, location=self.location)
+        assert cache.get('1-wsdl') is None
+
+    def test_changed_wsdl_misses(self):
+        cache = WsdlCache(self.wsdl_path, location=self.location)
+        cache.put('1-wsdl', {'schema': 1})
+        with open(self.wsdl_path, 'w') as wsdl:
+            wsdl.write('<definitions name="changed"/>')
+        cache = WsdlCache(self.wsdl_path, location=self.location)
+        assert cache.get('1-wsdl') is None
+
+    def test_corrupt_entry_purged(self):
+        cache = WsdlCache(self.wsdl_path, location=self.location)
+        with open(cache.filename('1-wsdl'), 'w') as cached:
+            cached.write('not a pickle')
+        assert cache.get('1-wsdl') is None
+        assert not os.path.exists(cache.filename('1-wsdl'))
+
+    def test_private_location(self):
+        location = os.path.join(self.location, 'cache', 'zuora-wsdl')
+        WsdlCache(self.wsdl_path, location=location)
+        assert stat.S_IMODE(os.stat(location).st_mode) == 0o700
+        cache = WsdlCache(self.wsdl_path, location=location)
+        cache.put('1-wsdl', {'schema': 1})
+        assert stat.S_IMODE(os.stat(cache.filename('1-wsdl')).st_mode) == \
+            0o600
+
+    def test_default_location_per_user(self):
+        with mock.patch.dict(os.environ, {'XDG_CACHE_HOME': self.location}):
+            assert user_cache_dir('zuora-wsdl') == \
+                os.path.join(self.location, 'zuora-wsdl')
+        assert not wsdl_cache.DEFAULT_LOCATION.startswith(
+                                                    tempfile.gettempdir())
+
+    def test_shared_location_refused(self):
+        os.chmod(self.location, 0o777)
+        try:
+            WsdlCache(self.wsdl_path, location=self.location)
+        except UnsafeDirectory:
+            pass
+        else:
+            assert False, 'UnsafeDirectory not raised'
+
+    def test_foreign_location_refused(self):
+        with mock.patch('os.getuid', return_value=os.getuid() + 1):
+            try:
+                WsdlCache(self.wsdl_path, location=self.location)
+            except UnsafeDirectory:
+                pass
+            else:
+                assert False, 'UnsafeDirectory not raised'
+
+    def test_unsafe_location_not_cached(self):
+        os.chmod(self.location, 0o777)
+        client = ClientRegistry().build(
+            os.path.abspath('zuora/zuora.a.43.0.dev.wsdl'),
+            wsdl_cache_dir=self.location)
+        assert not isinstance(client.options.cache, WsdlCache)
+        assert not [fn for fn in os.listdir(self.location)
+                    if fn.startswith(WsdlCache.fnprefix)]
+
+    def test_zuora_loads_cached_wsdl(self):
+        client_registry.clear()
+        settings = {'username': mock.Mock(),
+                    'password': mock.Mock(),
+                    'wsdl_file': 'zuora.a.43.0.dev.wsdl',
+                    'wsdl_cache_dir': self.location}
+        Zuora(settings).client
+        cached = [fn for fn in os.listdir(self.location)
+                  if fn.startswith(WsdlCache.fnprefix)]
+        assert len(cached) == 1
+        client_registry.clear()
+        z = Zuora(settings)
+        assert z.client.factory.create('ns2:Account') is not None
+
+
+class TestClientRegistry(object):
+
+    def setup_method(self, method):
+        self.zuora_settings = {'username': mock.Mock(),
+                               'password': mock.Mock(),
+                               'wsdl_file': 'zuora.a.43.0.dev.wsdl'}
+
+    def test_instances_share_wsdl_and_session(self):
+        z1 = Zuora(self.zuora_settings)
+        z2 = Zuora(self.zuora_settings)
+        assert z1.client is not z2.client
+        assert z1.client.wsdl is z2.client.wsdl
+        assert z1.client.factory is z2.client.factory
+        assert z1.client.options.transport.session is \
+                                        z2.client.options.transport.session
+
+    def test_instances_keep_their_own_soapheaders(self):
+        z1 = Zuora(self.zuora_settings)
+        z2 = Zuora(self.zuora_settings)
+        z1.client.set_options(soapheaders=['header'])
+        assert z2.client.options.soapheaders == ()
+
+    def test_instances_send_their_own_session(self):
+        z1 = Zuora(self.zuora_settings)
+        z2 = Zuora(self.zuora_settings)
+        session1 = mock_soap_session(z1, LOGIN_RESPONSE % 'session-one',
+                                     QUERY_RESPONSE)
+        session2 = mock_soap_session(z2, LOGIN_RESPONSE % 'session-two',
+                                     QUERY_RESPONSE)
+        z1.login()
+        z2.login()
+        response = z1.query("SELECT Id FROM Account")
+        sent = session1.post.call_args[1]['data']
+        assert 'session-one' in sent
+        assert 'session-two' not in sent
+        assert response.records[0].Id == '4028e4'
+        assert session2.post.call_count == 1
+
+    @mock.patch.object(soap_client, 'SharedClient')
+    def test_build_once_per_wsdl_file(self, SharedClient):
+        registry = ClientRegistry()
+        registry.build = mock.Mock()
+        registry.checkout('/tmp/a.wsdl')
+        registry.checkout('/tmp/a.wsdl')
+        registry.checkout('/tmp/b.wsdl')
+        assert registry.build.call_count == 2
+        assert SharedClient.call_count == 3
+
+    @mock.patch.object(soap_client, 'SharedClient')
+    def test_later_settings_logged(self, SharedClient):
+        registry = ClientRegistry()
+        registry.build = mock.Mock()
+        with mock.patch.object(soap_client, 'log') as log:
+            registry.checkout('/tmp/a.wsdl', pool_size=10)
+            registry.checkout('/tmp/a.wsdl', pool_size=10)
+            assert not log.warning.called
+            registry.checkout('/tmp/a.wsdl', pool_size=20)
+            assert log.warning.call_count == 1
+        assert registry.build.call_count == 1
+
+
+class TestPrototypeFactory(object):
+
+    def setup_method(self, method):
+        self.zuora_settings = {'username': mock.Mock(),
+                               'password': mock.Mock(),
+                               'wsdl_file': 'zuora.a.43.0.dev.wsdl'}
+
+    def test_client_factory_is_shared_prototype_factory(self):
+        z1 = Zuora(self.zuora_settings)
+        z2 = Zuora(self.zuora_settings)
+        assert isinstance(z1.client.factory, PrototypeFactory)
+        assert z1.client.factory is z2.client.factory
+
+    def test_create_builds_each_type_once(self):
+        factory = PrototypeFactory(mock.Mock())
+        factory.factory.create.return_value = \
+            Zuora(self.zuora_settings).client.factory.create('ns2:Account')
+        factory.create('ns2:Account')
+        factory.create('ns2:Account')
+        assert factory.factory.create.call_count == 1
+
+    def test_create_returns_independent_copies(self):
+        factory = Zuora(self.zuora_settings).client.factory
+        zAccount = factory.create('ns2:Account')
+        zAccount.Name = 'Doe, John'
+        zAccount.fieldsToNull.append('Notes')
+        zAccount2 = factory.create('ns2:Account')
+        assert zAccount2.Name is None
+        assert zAccount2.fieldsToNull == []
+        assert zAccount2.__keylist__ == zAccount.__keylist__
+
+    def test_create_copies_nested_objects(self):
+        factory = Zuora(self.zuora_settings).client.factory
+        zSubscribeRequest = factory.create('ns0:SubscribeRequest')
+        zSubscribeRequest.Account.Name = 'Doe, John'
+        zSubscribeRequest2 = factory.create('ns0:SubscribeRequest')
+        assert zSubscribeRequest2.Account.Name is None
+
+    def test_copies_marshal_like_built_objects(self):
+        z = Zuora(self.zuora_settings)
+        sent = []
+        for factory in (z.client.factory.factory, z.client.factory):
+            session = mock_soap_session(z, LOGIN_RESPONSE % 'session',
+                                        CREATE_RESPONSE)
+            z.session_id = None
+            zAccount = factory.create('ns2:Account')
+            zAccount.Name = 'Doe, John'
+            z.create(zAccount)
+            sent.append(session.post.call_args[1]['data'])
+        assert sent[0] == sent[1]
+
+
+class TestFastQuery(object):
+
+    def setup_method(self, method):
+        self.zuora_settings = {'username': mock.Mock(),
+                               'password': mock.Mock(),
+                               'wsdl_file': 'zuora.a.43.0.dev.wsdl',
+                               'fast_query': True}
+
+    def test_query_sends_session_and_escaped_zql(self):
+        z = Zuora(self.zuora_settings)
+        session = mock_soap_session(z, LOGIN_RESPONSE % 'session&amp;id',
+                                    QUERY_RESPONSE)
+        z.query("SELECT Id FROM Account WHERE Name = 'A & B <C>'")
+        url, = session.post.call_args[0]
+        sent = session.post.call_args[1]['data']
+        assert url == z.client.wsdl.services[0].ports[0].location
+        assert '<ns1:session>session&amp;id</ns1:session>' in sent
+        assert ("<ns1:queryString>SELECT Id FROM Account WHERE "
+                "Name = 'A &amp; B &lt;C&gt;'</ns1:queryString>") in sent
+
+    def test_query_more_sends_query_locator(self):
+        z = Zuora(self.zuora_settings)
+        session = mock_soap_session(z, LOGIN_RESPONSE % 'session',
+                                    QUERY_RESPONSE)
+        z.query_more('2c92c0f8-locator')
+        sent = session.post.call_args[1]['data']
+        assert ('<ns1:queryMore><ns1:queryLocator>2c92c0f8-locator'
+                '</ns1:queryLocator></ns1:queryMore>') in sent
+
+    def test_query_returns_records_like_suds(self):
+        responses = []
+        for fast_query in (False, True):
+            self.zuora_settings['fast_query'] = fast_query
+            z = Zuora(self.zuora_settings)
+            mock_soap_session(z, LOGIN_RESPONSE % 'session', QUERY_RESPONSE)
+            responses.append(z.query("SELECT Id FROM Account"))
+        assert str(responses[0]) == str(responses[1])
+        assert responses[1].records[0].Balance == 10.5
+
+
+class TestQueryParser(object):
+
+    def setup_method(self, method):
+        self.zuora_settings = {'username': mock.Mock(),
+                               'password': mock.Mock(),
+                               'wsdl_file': 'zuora.a.43.0.dev.wsdl'}
+        self.parser = Zuora(self.zuora_settings).client.query_parser
+
+    def test_parse_converts_like_suds(self):
+        z = Zuora(self.zuora_settings)
+        mock_soap_session(z, LOGIN_RESPONSE % 'session', QUERY_RESPONSE)
+        response = z.query("SELECT Id FROM Account")
+        parsed = self.parser.parse(QUERY_RESPONSE)
+        assert zuora_serialize(parsed) == zuora_serialize(response)
+        assert parsed.done is True
+        assert parsed.size == 1
+        assert parsed.records[0].Balance == 10.5
+
+    def test_records_are_compact(self):
+        zAccount = self.parser.parse(QUERY_RESPONSE).records[0]
+        assert isinstance(zAccount, Record)
+        assert not hasattr(zAccount, '__dict__')
+        assert dict(zAccount) == {'Id': '4028e4', 'AutoPay': False,
+                                  'Balance': 10.5}
+        assert zAccount['Id'] == '4028e4'
+        assert not hasattr(zAccount, 'Name')
+
+    def test_parse_empty_and_unknown_fields(self):
+        reply = SOAP_ENVELOPE % """
+            <ns1:queryResponse><ns1:result>
+              <ns1:done>true</ns1:done>
+              <ns1:records xsi:type="ns2:Account">
+                <ns2:Name/>
+                <ns2:Notes xsi:nil="true"/>
+                <ns2:ShortCode__c>sub_bronze</ns2:ShortCode__c>
+              </ns1:records>
+              <ns1:size>1</ns1:size>
+            </ns1:result></ns1:queryResponse>"""
+        zAccount = self.parser.parse(reply).records[0]
+        assert zAccount.Name is None
+        assert zAccount.Notes is None
+        assert zAccount.ShortCode__c == 'sub_bronze'
+
+    def test_parse_fault(self):
+        try:
+            self.parser.parse(QUERY_FAULT)
+        except QueryFault as error:
+            assert error.faultcode == 'fns:INVALID_SESSION'
+        else:
+            assert False, 'QueryFault not raised'
+
+    def test_native_query(self):
+        self.zuora_settings['native_query'] = True
+        z = Zuora(self.zuora_settings)
+        session = mock_soap_session(z, LOGIN_RESPONSE % 'session',
+                                    QUERY_RESPONSE)
+        response = z.query("SELECT Id FROM Account")
+        assert '<ns1:session>session</ns1:session>' in \
+                                        session.post.call_args[1]['data']
+        assert isinstance(response.records[0], Record)
+        assert response.records[0].Id == '4028e4'
+
+
+class TestQueryStream(object):
+
+    def setup_method(self, method):
+        self.zuora_settings = {'username': mock.Mock(),
+                               'password': mock.Mock(),
+                               'wsdl_file': 'zuora.a.43.0.dev.wsdl'}
+        self.parser = Zuora(self.zuora_settings).client.query_parser
+
+    def page(self, rows):
+        return SOAP_ENVELOPE % """
+            <ns1:queryMoreResponse><ns1:result>
+              <ns1:done>false</ns1:done>
+              <ns1:queryLocator>2c92c0f8-locator</ns1:queryLocator>
+              %s
+              <ns1:size>%d</ns1:size>
+            </ns1:result></ns1:queryMoreResponse>""" % (''.join(
+                '<ns1:records xsi:type="ns2:Account">'
+                '<ns2:Id>%032x</ns2:Id><ns2:Balance>%d.5</ns2:Balance>'
+                '</ns1:records>' % (row, row) for row in range(rows)), rows)
+
+    def test_stream_yields_records_like_parse(self):
+        reply = self.page(3)
+        stream = QueryStream(self.parser, io.BytesIO(reply))
+        records = list(stream)
+        parsed = self.parser.parse(reply)
+        assert [dict(record) for record in records] == \
+                            [dict(record) for record in parsed.records]
+        assert stream.done is False
+        assert stream.queryLocator == '2c92c0f8-locator'
+        assert stream.size == 3
+
+    def test_stream_reads_incrementally(self):
+        source = io.BytesIO(self.page(2000))
+        stream = iter(QueryStream(self.parser, source))
+        record = next(stream)
+        assert record.Id == '%032x' % 0
+        assert source.tell() < len(source.getvalue()) / 10
+
+    def test_stream_fault(self):
+        close = mock.Mock()
+        stream = QueryStream(self.parser, io.BytesIO(QUERY_FAULT),
+                             close=close)
+        try:
+            list(stream)
+        except QueryFault as error:
+            assert error.faultcode == 'fns:INVALID_SESSION'
+        else:
+            assert False, 'QueryFault not raised'
+        assert close.called
+
+    def test_query_stream(self):
+        z = Zuora(self.zuora_settings)
+        mock_soap_session(z, LOGIN_RESPONSE % 'session')
+        z.login()
+        response = mock.Mock(status_code=200, raw=io.BytesIO(QUERY_RESPONSE))
+        z.client.options.transport.session.post.side_effect = [response]
+        stream = z.query_stream("SELECT Id FROM Account")
+        assert z.client.options.transport.session.post.call_args[1][
+                                                            'stream'] is True
+        assert [record.Id for record in stream] == ['4028e4']
+        assert stream.done is True
+        assert response.close.called
+
+
+class TestQueryIter(object):
+
+    def setup_method(self, method):
+        self.zuora_settings = {'username': mock.Mock(),
+                               'password': mock.Mock(),
+                               'wsdl_file': 'zuora.a.43.0.dev.wsdl'}
+
+    def pages(self, *pages):
+        responses = []
+        for number, records in enumerate(pages):
+            done = number == len(pages) - 1
+            responses.append(mock.Mock(done=done, records=records,
+                                       queryLocator=None if done else
+                                       'locator-%d' % (number + 1)))
+        return responses
+
+    def test_query_all_follows_query_locator(self):
+        z = Zuora(self.zuora_settings)
+        first, second, third = self.pages([1, 2], [3, 4], [5])
+        z.query = mock.Mock(return_value=first)
+        z.query_more = mock.Mock(side_effect=[second, third])
+        assert z.query_all("SELECT Id FROM Invoice") == [1, 2, 3, 4, 5]
+        assert z.query_more.call_args_list == [mock.call('locator-1'),
+                                               mock.call('locator-2')]
+
+    def test_query_iter_is_lazy(self):
+        z = Zuora(self.zuora_settings)
+        first, second = self.pages([1, 2], [3])
+        z.query = mock.Mock(return_value=first)
+        z.query_more = mock.Mock(return_value=second)
+        records = z.query_iter("SELECT Id FROM Invoice")
+        assert next(records) == 1
+        assert next(records) == 2
+        assert not z.query_more.called
+        assert list(records) == [3]
+
+    def test_query_iter_prefetches_next_page(self):
+        z = Zuora(self.zuora_settings)
+        first, second = self.pages([1, 2], [3])
+        requested = threading.Event()
+
+        def query_more(query_locator):
+            requested.set()
+            return second
+        z.query = mock.Mock(return_value=first)
+        z.query_more = mock.Mock(side_effect=query_more)
+        records = z.query_iter("SELECT Id FROM Invoice", prefetch=True)
+        assert next(records) == 1
+        # the first page is not consumed yet, but its successor is requested
+        assert requested.wait(5)
+        assert z.query_more.call_args == mock.call('locator-1')
+        assert list(records) == [2, 3]
+        assert z.query_more.call_count == 1
+
+    def test_query_iter_raises_prefetch_error(self):
+        z = Zuora(self.zuora_settings)
+        first, = self.pages([1])
+        first.done = False
+        z.query = mock.Mock(return_value=first)
+        z.query_more = mock.Mock(side_effect=ZuoraException('expired'))
+        records = z.query_iter("SELECT Id FROM Invoice", prefetch=True)
+        assert next(records) == 1
+        try:
+            next(records)
+        except ZuoraException:
+            pass
+        else:
+            assert False, 'ZuoraException not raised'
+
+    def test_query_all_empty_result(self):
+        z = Zuora(self.zuora_settings)
+        mock_soap_session(z, LOGIN_RESPONSE % 'session', SOAP_ENVELOPE % """
+            <ns1:queryResponse><ns1:result>
+              <ns1:done>true</ns1:done>
+              <ns1:size>0</ns1:size>
+            </ns1:result></ns1:queryResponse>""")
+        assert z.query_all("SELECT Id FROM Invoice") == []
+
+
+class TestQueryChunked(object):
+
+    def setup_method(self, method):
+        self.zuora_settings = {'username': mock.Mock(),
+                               'password': mock.Mock(),
+                               'wsdl_file': 'zuora.a.43.0.dev.wsdl',
+                               'query_chunk_size': 2}
+
+    def test_chunk_filters_limits_conditions(self):
+        conditions = ["Id = '%d'" % number for number in range(5)]
+        assert chunk_filters(conditions, 2, 1000) == [
+            conditions[0:2], conditions[2:4], conditions[4:5]]
+
+    def test_chunk_filters_limits_length(self):
+        conditions = ["Id = '%d'" % number for number in range(5)]
+        # two conditions joined by " OR " are 20 characters
+        assert chunk_filters(conditions, 100, 20) == [
+            conditions[0:2], conditions[2:4], conditions[4:5]]
+        assert chunk_filters(conditions, 100, 19) == [
+            [condition] for condition in conditions]
+
+    def test_chunk_filters_drops_duplicates(self):
+        assert chunk_filters(["Id = '1'", "Id = '2'", "Id = '1'"], 2, 100) \
+                                            == [["Id = '1'", "Id = '2'"]]
+
+    def test_query_chunked_merges_chunks(self):
+        z = Zuora(self.zuora_settings)
+        z.login = mock.Mock()
+        z.query_all = mock.Mock(side_effect=lambda qs: [qs.split("'")[1]])
+        records = z.query_chunked("SELECT Id FROM ProductRatePlanCharge",
+                                  ["Id = '%d'" % number
+                                   for number in range(5)])
+        assert records == ['0', '2', '4']
+        queries = sorted(call[0][0] for call in z.query_all.call_args_list)
+        assert queries == [
+            "SELECT Id FROM ProductRatePlanCharge WHERE Id = '0' OR Id = '1'",
+            "SELECT Id FROM ProductRatePlanCharge WHERE Id = '2' OR Id = '3'",
+            "SELECT Id FROM ProductRatePlanCharge WHERE Id = '4'"]
+        assert z.login.call_count == 1
+
+    def test_instances_share_query_pool(self):
+        def run_chunked():
+            z = Zuora(self.zuora_settings)
+            z.login = mock.Mock()
+            z.query_all = mock.Mock(return_value=[])
+            z.query_chunked("SELECT Id FROM ProductRatePlanCharge",
+                            ["Id = '%d'" % number for number in range(5)])
+            return z
+
+        z = run_chunked()
+        threads = threading.active_count()
+        for _ in range(5):
+            assert run_chunked().query_pool is z.query_pool
+        assert threading.active_count() == threads
+        settings = dict(self.zuora_settings, query_pool_size=2)
+        assert Zuora(settings).query_pool is not z.query_pool
+
+    def test_get_product_rate_plan_charge_tiers_chunked(self):
+        z = Zuora(self.zuora_settings)
+        z.login = mock.Mock()
+        z.query = mock.Mock()
+        response = mock.Mock()
+        response.records = [1]
+        z.query.return_value = response
+        tiers = z.get_product_rate_plan_charge_tiers(
+                    product_rate_plan_charge_id_list=['a', 'b', 'c'])
+        assert tiers == [1, 1]
+        assert z.query.call_count == 2
+
+
+class SessionStoreTests(object):
+
+    def setup_method(self, method):
+        self.location = tempfile.mkdtemp()
+        self.store = self.make_store()
+
+    def teardown_method(self, method):
+        shutil.rmtree(self.location)
+
+    def test_set_get(self):
+        assert self.store.get('key') is None
+        self.store.set('key', 'session-one')
+        session_id, created = self.store.get('key')
+        assert session_id == 'session-one'
+        assert created <= time.time()
+
+    def test_delete_only_given_session(self):
+        self.store.set('key', 'session-two')
+        self.store.delete('key', 'session-one')
+        assert self.store.get('key')[0] == 'session-two'
+        self.store.delete('key', 'session-two')
+        assert self.store.get('key') is None
+
+    def test_expired_session_ignored(self):
+        self.store.max_age = 60
+        self.store.set('key', 'session-one')
+        with mock.patch('time.time', return_value=time.time() + 61):
+            assert self.store.get('key') is None
+
+    def test_lock_is_exclusive(self):
+        order = []
+
+        def hold():
+            with self.store.lock('key'):
+                order.append('second')
+        with self.store.lock('key'):
+            thread = threading.Thread(target=hold)
+            thread.start()
+            thread.join(0.2)
+            order.append('first')
+        thread.join()
+        assert order == ['first', 'second']
+
+
+class TestMemorySessionStore(SessionStoreTests):
+
+    def make_store(self):
+        return MemorySessionStore()
+
+
+class TestFileSessionStore(SessionStoreTests):
+
+    def make_store(self):
+        return FileSessionStore(self.location)
+
+    def test_shared_between_instances(self):
+        self.store.set('key', 'session-one')
+        assert FileSessionStore(self.location).get('key')[0] == 'session-one'
+
+    def test_private_files(self):
+        self.store.set('key', 'session-one')
+        assert stat.S_IMODE(
+            os.stat(self.store.filename('key')).st_mode) == 0o600
+        location = os.path.join(self.location, 'sessions')
+        FileSessionStore(location)
+        assert stat.S_IMODE(os.stat(location).st_mode) == 0o700
+
+    def test_shared_location_refused(self):
+        os.chmod(self.location, 0o777)
+        try:
+            FileSessionStore(self.location)
+        except UnsafeDirectory:
+            pass
+        else:
+            assert False, 'UnsafeDirectory not raised'
+
+
+class TestSqliteSessionStore(SessionStoreTests):
+
+    def make_store(self):
+        return SqliteSessionStore(os.path.join(self.location, 'session.db'))
+
+    def test_private_database(self):
+        assert stat.S_IMODE(os.stat(self.store.database).st_mode) == 0o600
+
+    def test_readable_database_refused(self):
+        os.chmod(self.store.database, 0o644)
+        try:
+            self.make_store()
+        except UnsafeDirectory:
+            pass
+        else:
+            assert False, 'UnsafeDirectory not raised'
+
+    def test_default_database_per_user(self):
+        with mock.patch.dict(os.environ, {'XDG_CACHE_HOME': self.location}):
+            store = SqliteSessionStore()
+        assert store.database == os.path.join(self.location, 'zuora',
+                                              'zuora-session.db')
+        assert stat.S_IMODE(os.stat(os.path.dirname(store.database))
+                            .st_mode) == 0o700
+
+
+class TestZuoraSessionStore(object):
+
+    def setup_method(self, method):
+        self.zuora_settings = {'username': 'username',
+                               'password': 'password',
+                               'wsdl_file': 'zuora.a.43.0.dev.wsdl',
+                               'session_store': MemorySessionStore()}
+
+    def test_login_stores_session(self):
+        z = Zuora(self.zuora_settings)
+        session = mock_soap_session(z, LOGIN_RESPONSE % 'session-one')
+        z.login()
+        assert z.session_id == 'session-one'
+        assert session.post.call_count == 1
+        z2 = Zuora(self.zuora_settings)
+        session2 = mock_soap_session(z2)
+        z2.login()
+        assert z2.session_id == 'session-one'
+        assert not session2.post.called
+
+    def test_other_user_logs_in(self):
+        Zuora(self.zuora_settings).session_store.set(
+                'other', 'session-one')
+        z = Zuora(self.zuora_settings)
+        mock_soap_session(z, LOGIN_RESPONSE % 'session-two')
+        z.login()
+        assert z.session_id == 'session-two'
+
+
+class TestInvalidSession(object):
+
+    def setup_method(self, method):
+        self.zuora_settings = {'username': 'username',
+                               'password': 'password',
+                               'wsdl_file': 'zuora.a.43.0.dev.wsdl'}
+
+    def test_call_logs_in_again_and_retries(self):
+        z = Zuora(self.zuora_settings)
+        session = mock_soap_session(z, LOGIN_RESPONSE % 'session-one',
+                                    QUERY_FAULT,
+                                    LOGIN_RESPONSE % 'session-two',
+                                    QUERY_RESPONSE)
+        response = z.query("SELECT Id FROM Account")
+        assert response.records[0].Id == '4028e4'
+        assert z.session_id == 'session-two'
+        assert 'session-two' in session.post.call_args[1]['data']
+
+    def test_native_query_logs_in_again_and_retries(self):
+        self.zuora_settings['native_query'] = True
+        z = Zuora(self.zuora_settings)
+        mock_soap_session(z, LOGIN_RESPONSE % 'session-one', QUERY_FAULT,
+                          LOGIN_RESPONSE % 'session-two', QUERY_RESPONSE)
+        response = z.query("SELECT Id FROM Account")
+        assert response.records[0].Id == '4028e4'
+        assert z.session_id == 'session-two'
+
+    def test_call_retries_once(self):
+        z = Zuora(self.zuora_settings)
+        session = mock_soap_session(z, LOGIN_RESPONSE % 'session-one',
+                                    QUERY_FAULT,
+                                    LOGIN_RESPONSE % 'session-two',
+                                    QUERY_FAULT)
+        try:
+            z.query("SELECT Id FROM Account")
+        except ZuoraException:
+            pass
+        else:
+            assert False, 'ZuoraException not raised'
+        assert session.post.call_count == 4
+
+    def test_other_errors_not_retried(self):
+        z = Zuora(self.zuora_settings)
+        z.session_id = 'session-one'
+        fn = mock.Mock(side_effect=ValueError('INVALID_SESSION'))
+        try:
+            z.call(fn)
+        except ZuoraException:
+            pass
+        else:
+            assert False, 'ZuoraException not raised'
+        assert fn.call_count == 1
+
+    def test_threads_share_one_login(self):
+        z = Zuora(self.zuora_settings)
+        z.session_id = 'session-one'
+        z.client.set_options = mock.Mock()
+        z.new_session = mock.Mock(return_value='session-two')
+        threads = [threading.Thread(target=z.relogin, args=('session-one',))
+                   for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert z.new_session.call_count == 1
+        assert z.session_id == 'session-two'
+
+    def test_invalid_session_removed_from_store(self):
+        self.zuora_settings['session_store'] = MemorySessionStore()
+        z = Zuora(self.zuora_settings)
+        z.session_store.set(z.session_key, 'session-one')
+        mock_soap_session(z, QUERY_FAULT, LOGIN_RESPONSE % 'session-two',
+                          QUERY_RESPONSE)
+        z.query("SELECT Id FROM Account")
+        assert z.session_store.get(z.session_key)[0] == 'session-two'
+
+    def test_create_keeps_session_header(self):
+        z = Zuora(self.zuora_settings)
+        session = mock_soap_session(z, LOGIN_RESPONSE % 'session-one',
+                                    CREATE_RESPONSE, QUERY_RESPONSE)
+        z.create(z.client.factory.create('ns2:Account'))
+        z.query("SELECT Id FROM Account")
+        assert 'session-one' in session.post.call_args[1]['data']
+        assert session.post.call_count == 3
+
+
+class TestSessionRefresher(object):
+
+    def setup_method(self, method):
+        self.zuora_settings = {'username': 'username',
+                               'password': 'password',
+                               'wsdl_file': 'zuora.a.43.0.dev.wsdl'}
+
+    def test_next_refresh(self):
+        z = Zuora(self.zuora_settings)
+        refresher = SessionRefresher(z, max_age=900, margin=60)
+        assert refresher.next_refresh(z) == 0
+        z.session_id = 'session-one'
+        z.session_created = time.time() - 100
+        assert 735 < refresher.next_refresh(z) <= 740
+        z.session_created = time.time() - 850
+        assert refresher.next_refresh(z) == 0
+
+    def test_login_records_session_age(self):
+        z = Zuora(self.zuora_settings)
+        mock_soap_session(z, LOGIN_RESPONSE % 'session-one')
+        z.login()
+        assert time.time() - z.session_created < 5
+
+    def test_refresh_session_replaces_session(self):
+        z = Zuora(self.zuora_settings)
+        mock_soap_session(z, LOGIN_RESPONSE % 'session-one',
+                          LOGIN_RESPONSE % 'session-two')
+        z.login()
+        z.session_created -= 1000
+        z.refresh_session()
+        assert z.session_id == 'session-two'
+        assert time.time() - z.session_created < 5
+
+    def test_calls_keep_session_during_refresh(self):
+        z = Zuora(self.zuora_settings)
+        z.client.set_options = mock.Mock()
+        z.set_session('session-one', time.time() - 1000)
+
+        def new_session():
+            time.sleep(0.3)
+            return 'session-two'
+        z.new_session = mock.Mock(side_effect=new_session)
+        refresh = threading.Thread(target=z.refresh_session)
+        refresh.start()
+        time.sleep(0.05)
+        started = time.time()
+        z.login()
+        assert time.time() - started < 0.1
+        assert z.session_id == 'session-one'
+        refresh.join()
+        assert z.session_id == 'session-two'
+        assert time.time() - z.session_created < 5
+
+    def test_refresh_adopts_session_stored_by_another_process(self):
+        self.zuora_settings['session_store'] = MemorySessionStore()
+        z = Zuora(self.zuora_settings)
+        z.client.set_options = mock.Mock()
+        z.set_session('session-one', time.time() - 1000)
+        z.session_store.set(z.session_key, 'session-two')
+        z.new_session = mock.Mock()
+        z.refresh_session()
+        assert z.session_id == 'session-two'
+        assert not z.new_session.called
+
+    def test_refresh_renews_rest_login(self):
+        z = Zuora(self.zuora_settings)
+        z.session_id = 'session-one'
+        z.refresh_session = mock.Mock()
+        refresher = SessionRefresher(z, max_age=900)
+        refresher.refresh(z)
+        assert z.refresh_session.call_count == 1
+        z.rest_client = mock.Mock()
+        refresher.refresh(z)
+        assert z.rest_client.login.call_count == 1
+
+    def test_setting_starts_refresher(self):
+        self.zuora_settings['session_refresh'] = True
+        with mock.patch.object(SessionRefresher, 'start') as start:
+            z = Zuora(self.zuora_settings)
+        assert start.call_count == 1
+        assert z.session_refresher.max_age == 900
+
+    def test_run_logs_in_until_stopped(self):
+        z = Zuora(self.zuora_settings)
+        logged_in = threading.Event()
+
+        def login():
+            z.session_id = 'session-one'
+            z.session_created = time.time()
+            logged_in.set()
+        z.login = login
+        refresher = SessionRefresher(z, max_age=900)
+        refresher.start()
+        assert logged_in.wait(5)
+        refresher.stop()
+        refresher.join(5)
+        assert not refresher.is_alive()
+
+    def test_run_ends_when_instance_collected(self):
+        for fails in (False, True):
+            logged_in = threading.Event()
+
+            def login(z):
+                logged_in.set()
+                if fails:
+                    raise ZuoraException('Unable to log in')
+                z.session_id = 'session-one'
+                z.session_created = time.time()
+            self.zuora_settings['session_refresh'] = True
+            with mock.patch.object(Zuora, 'login', login):
+                z = Zuora(self.zuora_settings)
+                refresher = z.session_refresher
+                assert logged_in.wait(5)
+                time.sleep(0.05)
+                del z
+                gc.collect()
+                refresher.join(5)
+            assert not refresher.is_alive()
+
+
+class TestRestSession(object):
+
+    def setup_method(self, method):
+        self.zuora_settings = {'username': 'username',
+                               'password': 'password',
+                               'wsdl_file': 'zuora.a.43.0.dev.wsdl',
+                               'base_url': 'https://localhost/rest/v1/'}
+
+    def test_managers_share_one_session(self):
+        rest_client = RestClient(self.zuora_settings)
+        assert rest_client.account.http is rest_client.catalog.http
+        assert rest_client.account.http is \
+                                rest_client.zuora_config.http_session
+        assert rest_client.account.http is not \
+                                RestClient(self.zuora_settings).account.http
+
+    def test_pool_settings(self):
+        self.zuora_settings['rest_pool_size'] = 25
+        self.zuora_settings['rest_keep_alive'] = False
+        http = RestClient(self.zuora_settings).account.http
+        assert http.get_adapter('https://localhost/')._pool_maxsize == 25
+        assert http.headers['Connection'] == 'close'
+
+    def test_requests_use_session(self):
+        rest_client = RestClient(self.zuora_settings)
+        rest_client.zuora_config.http_session = mock.Mock()
+        rest_client.zuora_config.http_session.post.return_value.json\
+                                        .return_value = {'success': True}
+        assert rest_client.login() == {'success': True}
+        url = rest_client.zuora_config.http_session.post.call_args[0][0]
+        assert url == 'https://localhost/rest/v1/connections'
+
+
+def connected(conn):
+    conn.sock = mock.Mock()
+
+
+@mock.patch.object(connectionpool, 'is_connection_dropped',
+                   mock.Mock(return_value=False))
+@mock.patch.object(connectionpool.HTTPSConnectionPool.ConnectionCls,
+                   'connect', autospec=True, side_effect=connected)
+class TestConnectionPool(object):
+
+    def setup_method(self, method):
+        self.zuora_settings = {'username': 'username',
+                               'password': 'password',
+                               'wsdl_file': 'zuora.a.43.0.dev.wsdl'}
+
+    def test_hits_and_misses(self, connect):
+        adapter = TLSHttpAdapter(pool_maxsize=1)
+        pool = adapter.get_connection('https://localhost/')
+        first = pool._get_conn()
+        first.connect()
+        # The pool is empty, a second connection is opened
+        second = pool._get_conn()
+        second.connect()
+        pool._put_conn(first)
+        pool._put_conn(second)
+        assert pool._get_conn() is first
+        assert (adapter.stats.hits, adapter.stats.misses,
+                adapter.stats.discarded) == (1, 2, 1)
+
+    def test_preconnect(self, connect):
+        adapter = TLSHttpAdapter(pool_maxsize=3)
+        assert adapter.preconnect('https://localhost/', 5) == 3
+        assert adapter.preconnect('https://localhost/', 2) == 0
+        assert connect.call_count == 3
+        pool = adapter.get_connection('https://localhost/')
+        for _ in range(3):
+            assert pool._get_conn().sock is not None
+        assert (adapter.stats.hits, adapter.stats.misses) == (3, 0)
+
+    def test_transport_pool_settings(self, connect):
+        transport = soap_client.RequestsTransport(pool_size=25,
+                                                  pool_block=True)
+        adapter = transport.session.get_adapter('https://')
+        assert (adapter._pool_maxsize, adapter._pool_block) == (25, True)
+        assert transport.pool_stats is adapter.stats
+
+    @mock.patch.object(soap_client, 'SharedClient')
+    def test_checkout_pool_settings(self, SharedClient, connect):
+        registry = ClientRegistry()
+        registry.build = mock.Mock()
+        registry.checkout('/tmp/a.wsdl', pool_size=25, pool_block=True)
+        registry.build.assert_called_once_with('/tmp/a.wsdl', True, None,
+                                               25, True)
+
+    @mock.patch.object(soap_client.SharedClient, 'preconnect')
+    def test_preconnect_setting(self, preconnect, connect):
+        z = Zuora(self.zuora_settings)
+        z.client
+        assert preconnect.call_count == 0
+        self.zuora_settings['pool_preconnect'] = 4
+        z = Zuora(self.zuora_settings)
+        z.client
+        preconnect.assert_called_once_with(4)
+
+    def test_pool_stats(self, connect):
+        z = Zuora(self.zuora_settings)
+        assert z.pool_stats() is z.client.options.transport.pool_stats
+
+
+def rest_response(status_code, body, method=None):
+    response = requests.Response()
+    response.status_code = status_code
+    response._content = body.encode('utf-8')
+    if method is not None:
+        response.request = requests.Request(
+                                method, 'https://localhost/').prepare()
+    return response
+
+
+@mock.patch.object(request_base.time, 'sleep')
+class TestRestRetry(object):
+
+    def setup_method(self, method):
+        self.rest_client = RestClient({'username': 'username',
+                                       'password': 'password',
+                                       'base_url': 'https://localhost/'})
+        self.http = self.rest_client.zuora_config.http_session = mock.Mock()
+        self.stats = self.rest_client.zuora_config.retry_stats
+
+    def test_business_failure_returned_at_once(self, sleep):
+        self.http.get.return_value = rest_response(200,
+            '{"success": false, "reasons": [{"code": 50000020, '
+            '"message": "invalid value"}]}')
+        response = self.rest_client.account.get_account_summary('A1')
+        assert response['reasons'][0]['message'] == 'invalid value'
+        assert self.http.get.call_count == 1
+        assert self.http.post.call_count == 0
+        assert self.stats.failures == 1
+
+    def test_not_found(self, sleep):
+        self.http.get.return_value = rest_response(404, 'Not Found')
+        response = self.rest_client.account.get_account_summary('A1')
+        assert response == {'success': False, 'httpStatusCode': 404}
+        assert self.http.get.call_count == 1
+
+    def test_authentication_failure_logs_in_once(self, sleep):
+        self.http.get.side_effect = [
+            rest_response(401, '{"success": false}'),
+            rest_response(200, '{"success": false, "reasons": '
+                               '[{"code": 90000011}]}'),
+            rest_response(200, '{"success": true}')]
+        self.http.post.return_value = rest_response(200, '{"success": true}')
+        response = self.rest_client.account.get_account_summary('A1')
+        assert response['reasons'] == [{'code': 90000011}]
+        assert self.http.get.call_count == 2
+        assert self.http.post.call_count == 1
+        assert (self.stats.relogins, self.stats.failures) == (1, 1)
+
+    def test_transient_failure_backs_off(self, sleep):
+        self.http.get.side_effect = [
+            rest_response(503, ''),
+            rest_response(429, '{"success": false}'),
+            rest_response(200, '{"success": true}')]
+        response = self.rest_client.account.get_account_summary('A1')
+        assert response == {'success': True}
+        assert [call[0][0] for call in sleep.call_args_list] == [0.5, 1.0]
+        assert self.stats.retries == 2
+
+    def test_transient_failure_gives_up(self, sleep):
+        self.http.get.return_value = rest_response(500, '')
+        response = self.rest_client.account.get_account_summary('A1')
+        assert response['httpStatusCode'] == 500
+        assert self.http.get.call_count == 4
+        assert (self.stats.retries, self.stats.failures) == (3, 1)
+
+    def test_nothing_returned(self, sleep):
+        assert self.rest_client.account.create_account() is None
+
+    def test_post_not_repeated_once_run(self, sleep):
+        for status, body in (
+                (502, ''), (504, ''), (500, ''),
+                (200, '{"success": false, "reasons": [{"code": 50000060}]}')):
+            self.http.post.reset_mock()
+            self.http.post.return_value = rest_response(status, body, 'POST')
+            response = self.rest_client.subscription.create_subscription({})
+            assert response['success'] is False
+            assert response['httpMethod'] == 'POST'
+            assert self.http.post.call_count == 1
+        assert self.stats.retries == 0
+
+    def test_post_repeated_when_not_run(self, sleep):
+        self.http.post.side_effect = [
+            rest_response(429, '', 'POST'),
+            rest_response(503, '', 'POST'),
+            rest_response(200, '{"success": false, "reasons": '
+                               '[{"code": 50000050}]}', 'POST'),
+            rest_response(200, '{"success": false, "reasons": '
+                               '[{"code": 50000070}]}', 'POST'),
+            rest_response(200, '{"success": true}', 'POST')]
+        self.rest_client.zuora_config.rest_max_retries = 4
+        response = self.rest_client.subscription.create_subscription({})
+        assert response == {'success': True}
+        assert self.stats.retries == 4
+
+    def test_put_repeated_after_server_error(self, sleep):
+        self.http.put.side_effect = [
+            rest_response(502, '', 'PUT'),
+            rest_response(200, '{"success": false, "reasons": '
+                               '[{"code": 50000060}]}', 'PUT'),
+            rest_response(200, '{"success": true}', 'PUT')]
+        response = self.rest_client.subscription.update_subscription('S1',
+                                                                     {})
+        assert response == {'success': True}
+        assert self.stats.retries == 2
+
+    def test_non_json_reply(self, sleep):
+        self.http.get.return_value = rest_response(200, '<html/>', 'GET')
+        assert self.rest_client.account.get_account_summary('A1') is None
+        assert self.http.get.call_count == 1
+
+
+class TestRateLimiter(object):
+
+    def setup_method(self, method):
+        self.zuora_settings = {'username': 'username',
+                               'password': 'password',
+                               'wsdl_file': 'zuora.a.43.0.dev.wsdl',
+                               'base_url': 'https://localhost/'}
+
+    def test_window_halves_once_per_throttle(self):
+        limiter = RateLimiter(max_concurrency=20, backoff=0)
+        slots = [limiter.acquire(), limiter.acquire()]
+        for slot in slots:
+            slot.throttle()
+            limiter.release(slot)
+        assert limiter.limit == 10
+        assert limiter.throttles == 2
+        slot = limiter.acquire()
+        slot.throttle()
+        limiter.release(slot)
+        assert limiter.limit == 5
+
+    def test_window_grows(self):
+        limiter = RateLimiter(max_concurrency=8, backoff=0)
+        limiter.limit = 4
+        limiter.release(limiter.acquire())
+        assert limiter.limit == 4.25
+        for _ in range(100):
+            limiter.release(limiter.acquire())
+        assert limiter.limit == 8
+
+    def test_window_blocks(self):
+        limiter = RateLimiter(max_concurrency=1)
+        slot = limiter.acquire()
+        acquired = threading.Event()
+        thread = threading.Thread(
+                        target=lambda: (limiter.acquire(), acquired.set()))
+        thread.start()
+        assert not acquired.wait(0.05)
+        limiter.release(slot)
+        assert acquired.wait(1)
+        thread.join()
+
+    def test_token_bucket(self):
+        limiter = RateLimiter(rate=20, burst=2)
+        start = time.time()
+        for _ in range(4):
+            limiter.release(limiter.acquire())
+        # 2 at once, then one every 50ms
+        assert time.time() - start >= 0.09
+
+    def test_pause_after_throttle(self):
+        limiter = RateLimiter(backoff=5)
+        slot = limiter.acquire()
+        slot.throttle(retry_after=0.1)
+        start = time.time()
+        limiter.release(slot)
+        limiter.release(limiter.acquire())
+        assert 0.09 <= time.time() - start < 1
+
+    def test_soap_call_retried(self):
+        limiter = RateLimiter(backoff=0)
+        self.zuora_settings['rate_limiter'] = limiter
+        z = Zuora(self.zuora_settings)
+        z.session_id = 'session'
+        fn = mock.Mock(side_effect=[
+                QueryFault('fns:REQUEST_EXCEEDED_LIMIT', 'limit exceeded'),
+                RateLimitExceeded(), 'response'])
+        assert z.call(fn) == 'response'
+        assert fn.call_count == 3
+        assert limiter.throttles == 2
+        assert limiter.in_flight == 0
+
+    def test_soap_call_gives_up(self):
+        limiter = RateLimiter(backoff=0, max_retries=1)
+        self.zuora_settings['rate_limiter'] = limiter
+        z = Zuora(self.zuora_settings)
+        z.session_id = 'session'
+        fn = mock.Mock(side_effect=RateLimitExceeded())
+        try:
+            z.call(fn)
+        except ZuoraException:
+            pass
+        else:
+            assert False, 'ZuoraException not raised'
+        assert fn.call_count == 2
+
+    def test_transport_raises_on_429(self):
+        transport = soap_client.RequestsTransport(session=mock.Mock())
+        transport.session.post.return_value = mock.Mock(
+                        status_code=429, headers={'Retry-After': '3'})
+        try:
+            transport.send(soap_client.Request('https://localhost/', 'x'))
+        except RateLimitExceeded as error:
+            assert error.retry_after == 3
+        else:
+            assert False, 'RateLimitExceeded not raised'
+
+    @mock.patch.object(request_base.time, 'sleep')
+    def test_rest_call_throttles(self, sleep):
+        limiter = RateLimiter(backoff=0)
+        self.zuora_settings['rate_limiter'] = limiter
+        rest_client = RestClient(self.zuora_settings)
+        http = rest_client.zuora_config.http_session = mock.Mock()
+        http.get.side_effect = [
+            rest_response(429, ''),
+            rest_response(200, '{"success": false, "reasons": '
+                               '[{"code": 90000070}]}'),
+            rest_response(200, '{"success": true}')]
+        response = rest_client.account.get_account_summary('A1')
+        assert response == {'success': True}
+        assert limiter.throttles == 2
+        assert limiter.in_flight == 0
+
+
+class TestTimeouts(object):
+
+    def setup_method(self, method):
+        self.zuora_settings = {'username': 'username',
+                               'password': 'password',
+                               'wsdl_file': 'zuora.a.43.0.dev.wsdl',
+                               'base_url': 'https://localhost/',
+                               'timeout': (3, 30),
+                               'operation_timeouts': {'query': (4, 40)}}
+
+    def test_operation_timeouts(self):
+        t = Timeouts((3, 30), {'query': (4, 40)})
+        assert t.current() == (3, 30)
+        with operation('query'):
+            assert t.current() == (4, 40)
+        with operation('subscribe'):
+            assert t.current() == timeouts.OPERATION_TIMEOUTS['subscribe']
+        assert Timeouts(5).current() == (5, 5)
+        assert Timeouts(None).current() is None
+
+    def test_no_timeout_skips_builtin_operation_timeouts(self):
+        t = Timeouts(None, {'subscribe': (4, 40)})
+        for name in ('query', 'invoice_pdf'):
+            with operation(name):
+                assert t.current() is None
+        with operation('subscribe'):
+            assert t.current() == (4, 40)
+
+    def test_outer_operation_kept(self):
+        t = Timeouts((3, 30), {'query': (4, 40), 'invoice_pdf': (5, 500)})
+        with operation('invoice_pdf'):
+            with operation('query'):
+                assert t.current() == (5, 500)
+
+    def test_deadline_shortens_timeouts(self):
+        t = Timeouts((3, 30))
+        with deadline(10):
+            connect, read = t.current()
+            assert connect == 3
+            assert 9 < read <= 10
+            with deadline(60):
+                assert t.current()[1] <= 10
+        assert t.current() == (3, 30)
+
+    def test_deadline_exceeded(self):
+        t = Timeouts((3, 30))
+        with deadline(0):
+            try:
+                t.current()
+            except DeadlineExceeded:
+                pass
+            else:
+                assert False, 'DeadlineExceeded not raised'
+
+    def test_bind(self):
+        results = []
+        with deadline(10):
+            with operation('subscribe'):
+                fn = timeouts.bind(lambda: (timeouts.remaining(),
+                                            timeouts.local.operation))
+        thread = threading.Thread(target=lambda: results.append(fn()))
+        thread.start()
+        thread.join()
+        left, name = results[0]
+        assert 9 < left <= 10
+        assert name == 'subscribe'
+
+    def test_with_deadline(self):
+        @timeouts.with_deadline
+        def flow():
+            return timeouts.remaining()
+        assert flow() is None
+        assert 4 < flow(deadline=5) <= 5
+
+    def test_soap_timeouts(self):
+        z = Zuora(self.zuora_settings)
+        session = mock_soap_session(z, LOGIN_RESPONSE % 'session',
+                                    QUERY_RESPONSE)
+        z.login()
+        assert session.post.call_args[1]['timeout'] == (3, 30)
+        z.query("SELECT Id FROM Account")
+        assert session.post.call_args[1]['timeout'] == (4, 40)
+
+    def test_soap_call_after_deadline(self):
+        z = Zuora(self.zuora_settings)
+        z.session_id = 'session'
+        fn = mock.Mock()
+        with deadline(0):
+            try:
+                z.call(fn)
+            except ZuoraException:
+                pass
+            else:
+                assert False, 'ZuoraException not raised'
+        assert fn.call_count == 0
+
+    @mock.patch.object(requests.adapters.HTTPAdapter, 'send')
+    def test_rest_timeouts(self, send):
+        send.return_value = rest_response(200, '{"success": true}')
+        rest_client = RestClient(self.zuora_settings)
+        rest_client.account.get_account_summary('A1')
+        assert send.call_args[1]['timeout'] == (3, 30)
+        self.zuora_settings['operation_timeouts'] = {
+                                    'get_account_summary': (1, 10)}
+        rest_client = RestClient(self.zuora_settings)
+        rest_client.account.get_account_summary('A1')
+        assert send.call_args[1]['timeout'] == (1, 10)
+
+    @mock.patch.object(request_base.time, 'sleep')
+    def test_rest_retries_within_deadline(self, sleep):
+        rest_client = RestClient(self.zuora_settings)
+        http = rest_client.zuora_config.http_session = mock.Mock()
+        http.get.return_value = rest_response(503, '')
+        with deadline(0.8):
+            response = rest_client.account.get_account_summary('A1')
+        assert response['httpStatusCode'] == 503
+        # Backs off 0.5s, then gives up as 1s would pass the deadline
+        assert http.get.call_count == 2
+
+
+class TestHedging(object):
+
+    def setup_method(self, method):
+        self.tracker = LatencyTracker(min_samples=20)
+        for _ in range(20):
+            self.tracker.record(0.01)
+        self.release = threading.Event()
+
+    def slow_then_fast(self):
+        calls = []
+
+        def fn(value):
+            calls.append(value)
+            if len(calls) == 1:
+                self.release.wait(1)
+                return 'slow'
+            return 'fast'
+        return fn, calls
+
+    def teardown_method(self, method):
+        self.release.set()
+
+    def test_percentile(self):
+        tracker = LatencyTracker(min_samples=3)
+        tracker.record(0.3)
+        tracker.record(0.1)
+        assert tracker.percentile(95) is None
+        tracker.record(0.2)
+        assert tracker.percentile(50) == 0.2
+        assert tracker.percentile(95) == 0.3
+
+    def test_fast_call_not_hedged(self):
+        fn = mock.Mock(return_value='value')
+        assert hedged_call(self.tracker, 95, fn, 1) == 'value'
+        fn.assert_called_once_with(1)
+        assert self.tracker.hedged == 0
+
+    def test_slow_call_hedged(self):
+        fn, calls = self.slow_then_fast()
+        assert hedged_call(self.tracker, 95, fn, 'query') == 'fast'
+        assert calls == ['query', 'query']
+        assert (self.tracker.hedged, self.tracker.hedge_wins) == (1, 1)
+
+    def test_hedge_keeps_deadline(self):
+        fn, calls = self.slow_then_fast()
+        with deadline(10):
+            left = hedged_call(self.tracker, 95,
+                               lambda: fn(timeouts.remaining()))
+        assert left == 'fast'
+        assert 9 < calls[1] <= 10
+
+    def test_error_raised_once_all_failed(self):
+        fn = mock.Mock(side_effect=ZuoraException('failed'))
+        try:
+            hedged_call(self.tracker, 95, fn)
+        except ZuoraException:
+            pass
+        else:
+            assert False, 'ZuoraException not raised'
+        assert fn.call_count == 1
+
+    def test_no_hedging_while_learning(self):
+        fn = mock.Mock(return_value='value')
+        tracker = LatencyTracker(min_samples=2)
+        hedged_call(tracker, 95, fn)
+        assert tracker.percentile(95) is None
+        hedged_call(tracker, 95, fn)
+        assert tracker.percentile(95) is not None
+
+    def test_zuora_query_hedged(self):
+        z = Zuora({'username': 'username', 'password': 'password',
+                   'wsdl_file': 'zuora.a.43.0.dev.wsdl',
+                   'fast_query': True, 'hedge_queries': True,
+                   'query_latency': self.tracker})
+        assert z.query_latency is self.tracker
+        fn, calls = self.slow_then_fast()
+        z.call = mock.Mock(side_effect=lambda *args: fn(args))
+        assert z.query("SELECT Id FROM Account") == 'fast'
+        assert calls[0] == (z.template_query, 'query',
+                            'SELECT Id FROM Account')
+        assert self.tracker.hedge_wins == 1
+
+
+class QueryCacheTests(object):
+
+    def setup_method(self, method):
+        self.location = tempfile.mkdtemp()
+        self.cache = self.make_cache()
+        self.parser = Zuora({'username': 'username', 'password': 'password',
+                             'wsdl_file': 'zuora.a.43.0.dev.wsdl'}
+                            ).client.query_parser
+        self.response = self.parser.parse(QUERY_RESPONSE)
+
+    def teardown_method(self, method):
+        shutil.rmtree(self.location)
+
+    def test_set_get_copy(self):
+        assert self.cache.get('key') is None
+        self.cache.set('key', 'Account', self.response, time.time())
+        cached = self.cache.get('key')
+        assert zuora_serialize(cached) == zuora_serialize(self.response)
+        cached.records[0].Balance = 0
+        assert self.cache.get('key').records[0].Balance == 10.5
+        assert (self.cache.hits, self.cache.misses) == (2, 1)
+
+    def test_suds_objects_and_dates(self):
+        created = datetime.datetime(2014, 3, 1, 10, 15, 0, 500)
+        response = Factory.object('QueryResult', {
+            'done': True, 'size': 1,
+            'records': [Factory.object('Account', {
+                'Id': '4028e4', 'Balance': 10.5, 'AutoPay': False,
+                'CreatedDate': created,
+                'BillCycleStartDate': datetime.date(2014, 3, 1)})]})
+        self.cache.set('key', 'Account', response, time.time())
+        cached = self.cache.get('key')
+        assert cached.__class__.__name__ == 'QueryResult'
+        assert cached.records[0].__class__.__name__ == 'Account'
+        assert zuora_serialize(cached) == zuora_serialize(response)
+        assert type(cached.records[0].BillCycleStartDate) is datetime.date
+
+    def test_expired_reply_ignored(self):
+        self.cache.ttls = {'Account': 60}
+        self.cache.set('key', 'Account', self.response, time.time())
+        with mock.patch('time.time', return_value=time.time() + 61):
+            assert self.cache.get('key') is None
+
+    def test_type_not_cached(self):
+        self.cache.ttls = {'Account': 0}
+        self.cache.set('key', 'Account', self.response, time.time())
+        assert self.cache.get('key') is None
+
+    def test_least_recently_used_dropped(self):
+        self.cache.max_entries = 2
+        for key in ('one', 'two'):
+            self.cache.set(key, 'Account', self.response, time.time())
+            time.sleep(0.01)
+        self.cache.get('one')
+        time.sleep(0.01)
+        self.cache.set('three', 'Account', self.response, time.time())
+        assert self.cache.get('two') is None
+        assert self.cache.get('one') is not None
+        assert self.cache.get('three') is not None
+
+    def test_invalidate(self):
+        started = time.time()
+        self.cache.set('account', 'Account', self.response, started)
+        self.cache.set('product', 'Product', self.response, started)
+        self.cache.invalidate(['Account'])
+        assert self.cache.get('account') is None
+        assert self.cache.get('product') is not None
+        # Sent before the write, the reply may be stale
+        self.cache.set('account', 'Account', self.response, started)
+        assert self.cache.get('account') is None
+
+
+class TestMemoryQueryCache(QueryCacheTests):
+
+    def make_cache(self):
+        return MemoryQueryCache()
+
+
+class TestSqliteQueryCache(QueryCacheTests):
+
+    def make_cache(self):
+        return SqliteQueryCache(os.path.join(self.location, 'query.db'))
+
+    def test_private_database(self):
+        assert stat.S_IMODE(os.stat(self.cache.database).st_mode) == 0o600
+        with mock.patch.dict(os.environ, {'XDG_CACHE_HOME': self.location}):
+            cache = SqliteQueryCache()
+        assert cache.database == os.path.join(self.location, 'zuora',
+                                              'zuora-query.db')
+
+    def test_readable_database_refused(self):
+        os.chmod(self.cache.database, 0o644)
+        try:
+            self.make_cache()
+        except UnsafeDirectory:
+            pass
+        else:
+            assert False, 'UnsafeDirectory not raised'
+
+    def test_stored_as_json(self):
+        self.cache.set('key', 'Account', self.response, time.time())
+        with closing(sqlite3.connect(self.cache.database)) as connection:
+            data = connection.execute(
+                "SELECT response FROM zuora_query").fetchone()[0]
+        assert json.loads(data)['record'][0][0] == 'QueryResult'
+        # Anything else (such as a planted pickle) is a miss
+        with closing(sqlite3.connect(self.cache.database)) as connection:
+            with connection:
+                connection.execute("UPDATE zuora_query SET response = ?",
+                                   ("cos\nsystem\n(S'true'\ntR.",))
+        assert self.cache.get('key') is None
+
+    def test_shared_between_instances(self):
+        self.cache.set('key', 'Account', self.response, time.time())
+        other = SqliteQueryCache(self.cache.database)
+        assert other.get('key').records[0].Id == '4028e4'
+        other.invalidate(['Account'])
+        assert self.cache.get('key') is None
+
+
+class TestZuoraQueryCache(object):
+
+    def setup_method(self, method):
+        self.zuora_settings = {'username': 'username',
+                               'password': 'password',
+                               'wsdl_file': 'zuora.a.43.0.dev.wsdl',
+                               'query_cache': MemoryQueryCache()}
+
+    def test_query_type_and_key(self):
+        assert query_type("SELECT Id FROM Account WHERE Id = '1'") == \
+                                                                    'Account'
+        assert query_type("SELECT Id from  Product") == 'Product'
+        assert query_key('tenant', "SELECT Id\n  FROM Account") == \
+            query_key('tenant', "SELECT Id FROM Account")
+        assert query_key('tenant', "SELECT Id FROM Account") != \
+            query_key('other', "SELECT Id FROM Account")
+
+    def test_repeated_query_cached(self):
+        for native_query in (False, True):
+            self.zuora_settings['native_query'] = native_query
+            z = Zuora(self.zuora_settings)
+            session = mock_soap_session(z, LOGIN_RESPONSE % 'session',
+                                        QUERY_RESPONSE)
+            first = z.query("SELECT Id FROM Account")
+            second = z.query("""
+                SELECT Id
+                FROM Account""")
+            assert session.post.call_count == 2
+            assert zuora_serialize(first) == zuora_serialize(second)
+            assert second.records[0].Balance == 10.5
+
+    def test_write_invalidates_type(self):
+        z = Zuora(self.zuora_settings)
+        session = mock_soap_session(z, LOGIN_RESPONSE % 'session',
+                                    QUERY_RESPONSE, CREATE_RESPONSE,
+                                    QUERY_RESPONSE)
+        z.query("SELECT Id FROM Account")
+        zAccount = z.client.factory.create('ns2:Account')
+        zAccount.Name = 'Name'
+        z.create(zAccount)
+        z.query("SELECT Id FROM Account")
+        assert session.post.call_count == 4
+
+    def test_amendment_invalidates_subscription(self):
+        z = Zuora(self.zuora_settings)
+        session = mock_soap_session(z, LOGIN_RESPONSE % 'session',
+                                    QUERY_RESPONSE, CREATE_RESPONSE,
+                                    CREATE_RESPONSE, UPDATE_RESPONSE,
+                                    QUERY_RESPONSE)
+        z.query("SELECT Id FROM Subscription")
+        z.add_product_amendment('Name', '4028e4', '4028e6')
+        z.query("SELECT Id FROM Subscription")
+        assert session.post.call_count == 6
+
+    def test_payment_invalidates_invoice(self):
+        z = Zuora(self.zuora_settings)
+        session = mock_soap_session(z, LOGIN_RESPONSE % 'session',
+                                    QUERY_RESPONSE, CREATE_RESPONSE,
+                                    QUERY_RESPONSE)
+        z.query("SELECT Id FROM Invoice")
+        zPayment = z.client.factory.create('ns2:Payment')
+        zPayment.Amount = 10.5
+        z.create(zPayment)
+        z.query("SELECT Id FROM Invoice")
+        assert session.post.call_count == 4
+
+    def test_partial_reply_not_cached(self):
+        reply = QUERY_RESPONSE.replace('<ns1:done>true</ns1:done>',
+                                       '<ns1:done>false</ns1:done>')
+        z = Zuora(self.zuora_settings)
+        session = mock_soap_session(z, LOGIN_RESPONSE % 'session', reply,
+                                    reply)
+        z.query("SELECT Id FROM Account")
+        z.query("SELECT Id FROM Account")
+        assert session.post.call_count == 3
+
+
+class TestCatalog(object):
+
+    def setup_method(self, method):
+        self.catalog = Catalog()
+        self.z = Zuora({'username': 'username', 'password': 'password',
+                        'wsdl_file': 'zuora.a.43.0.dev.wsdl',
+                        'catalog': self.catalog})
+        start = datetime.datetime(2000, 1, 1)
+        end = datetime.datetime(2100, 1, 1)
+        self.rows = {
+            'Product': [
+                Factory.object('Product', {
+                    'Id': 'p1', 'Name': 'Bronze',
+                    'ShortCode__c': 'sub_bronze'}),
+                Factory.object('Product', {
+                    'Id': 'p2', 'Name': 'Gold', 'ShortCode__c': 'sub_gold'})],
+            'ProductRatePlan': [
+                Factory.object('ProductRatePlan', {
+                    'Id': 'prp1', 'Name': 'Monthly', 'ProductId': 'p1',
+                    'EffectiveStartDate': start, 'EffectiveEndDate': end}),
+                Factory.object('ProductRatePlan', {
+                    'Id': 'prp2', 'Name': 'Expired', 'ProductId': 'p1',
+                    'EffectiveStartDate': start,
+                    'EffectiveEndDate': datetime.datetime(2001, 1, 1)})],
+            'ProductRatePlanCharge': [
+                Factory.object('ProductRatePlanCharge', {
+                    'Id': 'prpc1', 'ProductRatePlanId': 'prp1',
+                    'ChargeModel': 'Flat Fee Pricing',
+                    'ChargeType': 'Recurring'})],
+            'ProductRatePlanChargeTier': [
+                Factory.object('ProductRatePlanChargeTier', {
+                    'Id': 'prpct1', 'ProductRatePlanChargeId': 'prpc1',
+                    'IsOveragePrice': False, 'Price': 9.99})],
+        }
+        self.queries = []
+        self.z.query_all = mock.Mock(side_effect=self.query_all)
+
+    def query_all(self, query_string):
+        self.queries.append(' '.join(query_string.split()))
+        return self.rows[query_type(query_string)]
+
+    def test_match_served_from_snapshot(self):
+        for _ in range(2):
+            matched = self.z.match_product_rate_plans(
+                                                shortcodes=['sub_bronze'])
+        assert len(self.queries) == 4
+        product, = matched
+        assert product['short_code'] == 'sub_bronze'
+        rate_plan, = product['rate_plans']
+        assert rate_plan['name'] == 'Monthly'
+        charge, = rate_plan['rate_plan_charges']
+        assert charge['rate_plan_charge_tiers'][0]['price'] == '9.99'
+
+    def test_pricing_served_from_snapshot(self):
+        pricing = self.z.get_product_rate_plan_charge_pricing('prp1')
+        assert list(pricing) == ['flat fee pricing']
+        assert list(pricing['flat fee pricing']) == ['recurring']
+        assert len(self.queries) == 4
+
+    def test_missing_rows(self):
+        try:
+            self.z.get_products(shortcodes=['sub_silver'])
+        except DoesNotExist:
+            pass
+        else:
+            assert False, 'DoesNotExist not raised'
+        assert [zProduct.Id for zProduct in
+                self.z.get_products(product_id='p2')] == ['p2']
+
+    def test_refresh_merges_updated_rows(self):
+        self.z.get_products()
+        self.catalog.refresh_interval = 0
+        self.rows['ProductRatePlan'] = [Factory.object('ProductRatePlan', {
+            'Id': 'prp1', 'Name': 'Renamed', 'ProductId': 'p1',
+            'EffectiveStartDate': datetime.datetime(2000, 1, 1),
+            'EffectiveEndDate': datetime.datetime(2100, 1, 1)})]
+        zProductRatePlans = self.z.get_product_rate_plans(
+                                                    product_id_list=['p1'])
+        assert len(self.queries) == 8
+        assert all("WHERE UpdatedDate >= '" in query
+                   for query in self.queries[4:])
+        assert sorted(zProductRatePlan.Name for zProductRatePlan in
+                      zProductRatePlans) == ['Expired', 'Renamed']
+
+    def test_reload_drops_deleted_rows(self):
+        self.z.get_products()
+        self.catalog.reload_interval = 0
+        self.rows['Product'] = self.rows['Product'][:1]
+        assert len(self.z.get_products()) == 1
+        assert 'WHERE' not in self.queries[4]
+
+    def test_failed_refresh_keeps_snapshot(self):
+        self.z.get_products()
+        self.catalog.refresh_interval = 0
+        self.z.query_all.side_effect = ZuoraException('failed')
+        assert len(self.z.get_products()) == 2
+
+    def test_to_datetime(self):
+        assert to_datetime('2020-01-01') == datetime.datetime(2020, 1, 1)
+        assert to_datetime('2020-01-01T10:15:00') == \
+            datetime.datetime(2020, 1, 1, 10, 15)
+        assert to_datetime(datetime.date(2020, 1, 1)) == \
+            datetime.datetime(2020, 1, 1)
+        assert to_datetime(None) is None
+
+    def test_effective_dates_as_dates(self):
+        for rate_plan in self.rows['ProductRatePlan']:
+            rate_plan.EffectiveStartDate = \
+                rate_plan.EffectiveStartDate.date()
+            rate_plan.EffectiveEndDate = rate_plan.EffectiveEndDate.date()
+        for effective_start, effective_end in (
+                ('2000-06-01', None), ('2000-06-01', '2000-12-31'),
+                (datetime.date(2000, 6, 1), None),
+                ('2000-06-01T00:00:00', None)):
+            zProductRatePlans = self.z.get_product_rate_plans(
+                                            product_id_list=['p1'],
+                                            effective_start=effective_start,
+                                            effective_end=effective_end)
+            assert sorted(zProductRatePlan.Id for zProductRatePlan in
+                          zProductRatePlans) == ['prp1', 'prp2']
+        zProductRatePlans = self.z.get_product_rate_plans(
+                                            product_id_list=['p1'],
+                                            effective_start='2002-01-01')
+        assert [zProductRatePlan.Id for zProductRatePlan in
+                zProductRatePlans] == ['prp1']
+
+    def test_matcher_matches_like_queries(self):
+        rate_plans = self.rows['ProductRatePlan']
+        rate_plans[1].EffectiveEndDate = datetime.datetime(2100, 1, 1)
+        rate_plans[0].Site__c = 'run'
+        rate_plans[0].Priority__c = '1'
+        rate_plans[1].Site__c = '(run|ride)'
+        rate_plans[1].Gender__c = 'female'
+        self.rows['ProductRatePlanCharge'].append(
+            Factory.object('ProductRatePlanCharge', {
+                'Id': 'prpc2', 'ProductRatePlanId': 'prp1',
+                'ChargeModel': 'Per Unit Pricing', 'ChargeType': 'OneTime',
+                'SortOrder__c': '0'}))
+        filter_ = {'site': 'ride.com', 'gender': 'Female'}
+        matched = sorted(self.z.match_product_rate_plans([], filter_),
+                         key=lambda p_dict: p_dict['id'])
+
+        z = Zuora({'username': 'username', 'password': 'password',
+                   'wsdl_file': 'zuora.a.43.0.dev.wsdl'})
+        z.query_all = mock.Mock(side_effect=self.query_all)
+        z.query = mock.Mock(side_effect=lambda query_string: mock.Mock(
+                                records=self.query_all(query_string)))
+        assert matched == sorted(z.match_product_rate_plans([], filter_),
+                                 key=lambda p_dict: p_dict['id'])
+        assert [(rp_dict['id'], rp_dict['score']) for rp_dict
+                in matched[0]['rate_plans']] == [('prp2', 2), ('prp1', 1)]
+
+    def test_matcher_keeps_results(self):
+        matcher = self.catalog.snapshot(self.z).matcher()
+        now = datetime.datetime(2000, 6, 1)
+        filter_ = {'site': 'mapmyrun.com'}
+        with mock.patch.object(matcher, 'score', wraps=matcher.score):
+            matched = matcher.match(['sub_bronze'], filter_, now)
+            assert matcher.match(['sub_bronze'], filter_, now) == matched
+            assert matcher.score.call_count == 1
+            matcher.match(['sub_bronze'], {}, now)
+            assert matcher.score.call_count == 2
+
+    def test_matcher_returns_copies(self):
+        matched = self.z.match_product_rate_plans(['sub_bronze'])
+        expected = copy.deepcopy(matched)
+        matched[0]['name'] = 'Modified'
+        matched[0]['rate_plans'][0]['name'] = 'Modified'
+        matched[0]['rate_plans'][0]['score'] = 10
+        matched[0]['rate_plans'].pop()
+        assert self.z.match_product_rate_plans(['sub_bronze']) == expected
+
+    def test_matcher_keeps_results_without_changes_ahead(self):
+        now = datetime.datetime(2200, 1, 1)
+        self.rows['ProductRatePlan'][0].EffectiveEndDate = now
+        matcher = self.catalog.snapshot(self.z).matcher()
+        with mock.patch.object(matcher, 'score', wraps=matcher.score):
+            matcher.match(['sub_bronze'], {}, now)
+            matcher.match(['sub_bronze'], {}, now)
+            assert matcher.score.call_count == 1
+        assert matcher.valid_until == datetime.datetime.max
+
+    def test_matcher_drops_results_when_rate_plan_expires(self):
+        matcher = self.catalog.snapshot(self.z).matcher()
+        before = datetime.datetime(2000, 6, 1)
+        matched = matcher.match(['sub_bronze'], {}, before)
+        assert sorted(rp_dict['id']
+                      for rp_dict in matched[0]['rate_plans']) == \
+            ['prp1', 'prp2']
+        matcher.match(['sub_bronze'], {'site': 'run'}, before)
+        assert len(matcher.results) == 2
+        matched = matcher.match(['sub_bronze'], {},
+                                datetime.datetime(2002, 1, 1))
+        assert len(matcher.results) == 1
+        assert [rp_dict['id'] for rp_dict in matched[0]['rate_plans']] == \
+            ['prp1']
+
+    def test_matcher_effective_dates_as_dates(self):
+        for rate_plan in self.rows['ProductRatePlan']:
+            rate_plan.EffectiveStartDate = \
+                rate_plan.EffectiveStartDate.date()
+            rate_plan.EffectiveEndDate = rate_plan.EffectiveEndDate.date()
+        matcher = self.catalog.snapshot(self.z).matcher()
+        for now in ('2000-06-01', datetime.date(2000, 6, 1),
+                    datetime.datetime(2000, 6, 1, 12)):
+            matched = matcher.match(['sub_bronze'], {}, now)
+            assert sorted(rp_dict['id']
+                          for rp_dict in matched[0]['rate_plans']) == \
+                ['prp1', 'prp2']
+        assert matcher.valid_until == datetime.datetime(2001, 1, 1)
+        matched = matcher.match(['sub_bronze'], {}, '2002-01-01')
+        assert [rp_dict['id'] for rp_dict in matched[0]['rate_plans']] == \
+            ['prp1']
+
+    def test_pattern_compiled_once(self):
+        compiled = rate_plan_matcher.pattern('(run|ride)')
+        assert rate_plan_matcher.pattern('(run|ride)') is compiled
+        assert compiled.match('Ride.com')
+
+
+class TestBatchPricing(object):
+
+    def setup_method(self, method):
+        self.z = Zuora({'username': 'username', 'password': 'password',
+                        'wsdl_file': 'zuora.a.43.0.dev.wsdl'})
+        self.charges = [
+            Factory.object('ProductRatePlanCharge', {
+                'Id': 'c1', 'ProductRatePlanId': 'prp1',
+                'ChargeModel': 'Tiered Pricing', 'ChargeType': 'Recurring'}),
+            Factory.object('ProductRatePlanCharge', {
+                'Id': 'c2', 'ProductRatePlanId': 'prp1',
+                'ChargeModel': 'Flat Fee Pricing', 'ChargeType': 'OneTime'}),
+            Factory.object('ProductRatePlanCharge', {
+                'Id': 'c3', 'ProductRatePlanId': 'prp2',
+                'ChargeModel': 'Tiered Pricing', 'ChargeType': 'Recurring'})]
+        self.tiers = [
+            Factory.object('ProductRatePlanChargeTier', {
+                'ProductRatePlanChargeId': charge_id, 'Currency': currency,
+                'Price': price, 'IsOveragePrice': overage})
+            for charge_id, currency, price, overage in (
+                ('c1', 'USD', 10.0, False), ('c1', 'USD', 5.5, False),
+                ('c1', 'USD', 99.0, True), ('c1', 'EUR', 9.0, False),
+                ('c2', 'USD', 20.0, False), ('c3', 'USD', 1.25, False))]
+
+    def test_price_matrix(self):
+        pricing = price_matrix(['prp1', 'prp2', 'prp3'], self.charges,
+                               self.tiers)
+        assert pricing == {
+            'prp1': {'tiered pricing': {'recurring': {'USD': 15.5,
+                                                      'EUR': 9.0}},
+                     'flat fee pricing': {'onetime': {'USD': 20.0}}},
+            'prp2': {'tiered pricing': {'recurring': {'USD': 1.25}}},
+            'prp3': {}}
+
+    def test_charges_without_model_or_type_skipped(self):
+        self.charges[1].ChargeModel = None
+        del self.charges[2].ChargeType
+        pricing = price_matrix(['prp1', 'prp2'], self.charges, self.tiers)
+        assert pricing == {
+            'prp1': {'tiered pricing': {'recurring': {'USD': 15.5,
+                                                      'EUR': 9.0}}},
+            'prp2': {}}
+
+    def test_queries_batched(self):
+        self.z.get_product_rate_plan_charges = mock.Mock(
+                                                return_value=self.charges)
+        self.z.get_product_rate_plan_charge_tiers = mock.Mock(
+                                                return_value=self.tiers)
+        pricing = self.z.get_product_rate_plans_pricing(['prp1', 'prp2'])
+        self.z.get_product_rate_plan_charges.assert_called_once_with(
+                                product_rate_plan_id_list=['prp1', 'prp2'])
+        self.z.get_product_rate_plan_charge_tiers.assert_called_once_with(
+                        product_rate_plan_charge_id_list=['c1', 'c2', 'c3'])
+        assert pricing['prp2'] == {
+                            'tiered pricing': {'recurring': {'USD': 1.25}}}
+
+    def test_rate_plans_without_charges(self):
+        self.z.get_product_rate_plan_charges = mock.Mock(
+                                side_effect=DoesNotExist('no charges'))
+        self.z.get_product_rate_plan_charge_tiers = mock.Mock()
+        assert self.z.get_product_rate_plans_pricing(['prp1']) == \
+                                                            {'prp1': {}}
+        assert self.z.get_product_rate_plans_pricing([]) == {}
+        assert self.z.get_product_rate_plan_charges.call_count == 1
+        assert not self.z.get_product_rate_plan_charge_tiers.called
+
+
+class TestCatalogTables(object):
+
+    def setup_method(self, method):
+        self.rate_plans = [
+            Factory.object('ProductRatePlan', {'Id': rate_plan_id,
+                                               'ProductId': product_id})
+            for rate_plan_id, product_id in (('prp1', 'p1'), ('prp2', 'p1'),
+                                             ('prp3', 'p2'), ('prp4', 'p3'))]
+        self.charges = [
+            Factory.object('ProductRatePlanCharge', {
+                'Id': charge_id, 'ProductRatePlanId': rate_plan_id,
+                'ChargeModel': 'Tiered Pricing', 'ChargeType': 'Recurring'})
+            for charge_id, rate_plan_id in (('c1', 'prp1'), ('c2', 'prp1'),
+                                            ('c3', 'prp2'), ('c4', 'prp3'))]
+        self.tiers = [
+            Factory.object('ProductRatePlanChargeTier', {
+                'Id': 't%d' % number, 'ProductRatePlanChargeId': charge_id,
+                'Currency': currency, 'Price': price,
+                'StartingUnit': starting_unit, 'EndingUnit': ending_unit,
+                'IsOveragePrice': overage, 'Tier': tier})
+            for number, (charge_id, currency, price, starting_unit,
+                         ending_unit, overage, tier) in enumerate((
+                ('c1', 'USD', 10.0, 11.0, None, False, 2),
+                ('c1', 'USD', 20.0, 1.0, 10.0, False, 1),
+                ('c1', 'USD', 99.0, 0.0, None, True, 3),
+                ('c1', 'EUR', 9.0, 1.0, None, False, 1),
+                ('c2', 'USD', 5.0, 1.0, None, False, 1),
+                ('c3', 'USD', 2.5, 5.0, 10.0, False, 1),
+                ('c4', 'USD', 7.0, None, None, False, 1),
+                ('c9', 'USD', 1.0, None, None, False, 1)))]
+        self.tables = CatalogTables(self.rate_plans, self.charges,
+                                    self.tiers)
+
+    def test_columns(self):
+        tables = self.tables
+        assert tables.charge_ids == ['c1', 'c2', 'c3', 'c4']
+        # The tier of an unknown charge is left out
+        assert 't7' not in tables.tier_index
+        assert list(tables.price[tables.tier_start[0]:tables.tier_end[0]]) \
+            == [99.0, 20.0, 9.0, 10.0]
+        assert tables.tier(tables.tier_index['t0']) == {
+            'Id': 't0', 'ProductRatePlanChargeId': 'c1',
+            'ProductRatePlanId': 'prp1', 'Currency': 'USD', 'Price': 10.0,
+            'PriceFormat': None, 'StartingUnit': 11.0,
+            'EndingUnit': None,
+            'IsOveragePrice': False, 'Tier': 2}
+        charge = tables.charge('c3')
+        assert charge['ChargeModel'] == 'Tiered Pricing'
+        assert [tables.tier_ids[row] for row in charge['tiers']] == ['t5']
+
+    def test_rate_plan_totals(self):
+        assert self.tables.rate_plan_totals(currency='USD') == {
+            'prp1': 35.0, 'prp2': 2.5, 'prp3': 7.0, 'prp4': 0.0}
+        assert self.tables.rate_plan_totals()['prp1'] == 44.0
+        assert self.tables.rate_plan_totals(currency='GBP')['prp1'] == 0.0
+
+    def test_product_price_range(self):
+        assert self.tables.product_price_range(currency='USD') == {
+            'p1': (2.5, 20.0), 'p2': (7.0, 7.0)}
+        assert self.tables.product_price_range(currency='GBP') == {}
+
+    def test_find_tier(self):
+        tables = self.tables
+
+        def tier_id(charge_id, quantity, currency='USD'):
+            row = tables.find_tier(charge_id, quantity, currency)
+            return None if row is None else tables.tier_ids[row]
+
+        assert tier_id('c1', 1) == 't1'
+        assert tier_id('c1', 10) == 't1'
+        assert tier_id('c1', 10.5) is None
+        assert tier_id('c1', 500) == 't0'
+        assert tier_id('c1', 500, 'EUR') == 't3'
+        assert tier_id('c1', 1, None) == 't3'
+        assert tier_id('c3', 4) is None
+        assert tier_id('c3', 11) is None
+        assert tier_id('c9', 1) is None
+        assert [tables.tier_ids[row] for row in
+                tables.find_tiers('c1', [1, 25], 'USD')] == ['t1', 't0']
+
+    def test_snapshot_tables(self):
+        snapshot = CatalogSnapshot({}, by_id(self.rate_plans),
+                                   by_id(self.charges), by_id(self.tiers), 0)
+        assert snapshot.tables() is snapshot.tables()
+        assert snapshot.tables().rate_plan_totals('USD')['prp1'] == 35.0
+
+    def test_get_catalog_tables(self):
+        z = Zuora({'username': 'username', 'password': 'password',
+                   'wsdl_file': 'zuora.a.43.0.dev.wsdl'})
+        z.get_product_rate_plans = mock.Mock(return_value=self.rate_plans[:2])
+        z.get_product_rate_plan_charges = mock.Mock(
+                                            return_value=self.charges[:3])
+        z.get_product_rate_plan_charge_tiers = mock.Mock(
+                                            return_value=self.tiers)
+        tables = z.get_catalog_tables(product_id_list=['p1'])
+        z.get_product_rate_plans.assert_called_once_with(
+            product_id_list=['p1'], effective_start=None, effective_end=None)
+        z.get_product_rate_plan_charges.assert_called_once_with(
+                                product_rate_plan_id_list=['prp1', 'prp2'])
+        z.get_product_rate_plan_charge_tiers.assert_called_once_with(
+                        product_rate_plan_charge_id_list=['c1', 'c2', 'c3'])
+        assert tables.rate_plan_totals('USD') == {'prp1': 35.0, 'prp2': 2.5}
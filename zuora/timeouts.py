@@ -0,0 +1,168 @@
+"""
+    Zuora Timeouts
+    ~~~~~~~~~~~~~~
+
+    Connect and read timeouts of the SOAP and REST requests, per operation,
+    and deadlines bounding every request a thread makes within a block.
+
+    Usage example:
+    from zuora.timeouts import deadline
+
+    zuora_settings['timeout'] = (5, 30)
+    zuora_settings['operation_timeouts'] = {'invoice_pdf': (5, 600)}
+    z = Zuora(zuora_settings)
+
+    # subscribe() and every call it makes must be done within 20 seconds
+    z.subscribe(product_rate_plan_id, 12, deadline=20)
+
+    with deadline(20):
+        z.create_active_account(user=user)
+        z.subscribe(product_rate_plan_id, 12)
+"""
+from contextlib import contextmanager
+from functools import wraps
+import threading
+import time
+
+#: (connect, read) seconds of the operations without their own timeouts
+DEFAULT_TIMEOUT = (10, 60)
+
+#: (connect, read) seconds per operation
+OPERATION_TIMEOUTS = {
+    'query': (10, 120),
+    'subscribe': (10, 120),
+    'invoice_pdf': (10, 300),
+}
+
+local = threading.local()
+
+
+class DeadlineExceeded(Exception):
+    """
+    The deadline of the thread passed before the request was sent
+    """
+    pass
+
+
+@contextmanager
+def deadline(seconds):
+    """
+    Requests sent by the thread within the block must be done in `seconds`.
+    A nested deadline can only shorten the one around it.
+    """
+    expires = time.time() + seconds
+    previous = getattr(local, 'deadline', None)
+    if previous is not None:
+        expires = min(expires, previous)
+    local.deadline = expires
+    try:
+        yield
+    finally:
+        local.deadline = previous
+
+
+@contextmanager
+def operation(name):
+    """
+    Requests sent by the thread within the block use the timeouts of the
+    operation. An operation set by the caller is kept, so the query made by
+    get_invoice_pdf() uses the invoice_pdf timeouts rather than query's.
+    """
+    previous = getattr(local, 'operation', None)
+    if previous is None:
+        local.operation = name
+    try:
+        yield
+    finally:
+        local.operation = previous
+
+
+def remaining():
+    """
+    Returns the seconds left before the deadline of the thread, or None
+    """
+    expires = getattr(local, 'deadline', None)
+    if expires is None:
+        return None
+    return expires - time.time()
+
+
+def check_deadline():
+    """
+    Raises DeadlineExceeded once the deadline of the thread has passed
+    """
+    left = remaining()
+    if left is not None and left <= 0:
+        raise DeadlineExceeded("Zuora: Deadline exceeded")
+
+
+def bind(fn):
+    """
+    Returns fn running with the deadline and operation of the calling
+    thread, to hand to another thread
+    """
+    expires = getattr(local, 'deadline', None)
+    name = getattr(local, 'operation', None)
+
+    def bound(*args, **kwargs):
+        previous = (getattr(local, 'deadline', None),
+                    getattr(local, 'operation', None))
+        local.deadline, local.operation = expires, name
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            local.deadline, local.operation = previous
+    return bound
+
+
+def with_deadline(fn):
+    """
+    Lets the method take a deadline keyword argument: seconds within which
+    it and every request it sends must be done
+    """
+    @wraps(fn)
+    def wrapped(*args, **kwargs):
+        seconds = kwargs.pop('deadline', None)
+        if seconds is None:
+            return fn(*args, **kwargs)
+        with deadline(seconds):
+            return fn(*args, **kwargs)
+    return wrapped
+
+
+class Timeouts(object):
+    """
+    The connect and read timeouts of a client
+    """
+    def __init__(self, default=DEFAULT_TIMEOUT, operations=None):
+        """
+        :param default: (connect, read) seconds, or one value for both,
+                        None to wait forever
+        :param dict operations: timeouts per operation, added to
+                                OPERATION_TIMEOUTS (only these apply when
+                                default is None)
+        """
+        self.default = default
+        self.operations = dict(OPERATION_TIMEOUTS) \
+            if default is not None else {}
+        self.operations.update(operations or {})
+
+    def current(self):
+        """
+        Returns the (connect, read) timeouts of the operation of the thread,
+        shortened to the time left before its deadline. The read timeout
+        applies to each read of the reply, so a slow reply can still overrun
+        the deadline by up to that much.
+        """
+        timeout = self.operations.get(getattr(local, 'operation', None),
+                                      self.default)
+        if timeout is not None and not isinstance(timeout, (tuple, list)):
+            timeout = (timeout, timeout)
+        left = remaining()
+        if left is None:
+            return timeout
+        if left <= 0:
+            raise DeadlineExceeded("Zuora: Deadline exceeded")
+        if timeout is None:
+            return (left, left)
+        return (min(timeout[0], left), min(timeout[1], left))
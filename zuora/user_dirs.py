@@ -0,0 +1,83 @@
+"""
+    Zuora User Directories
+    ~~~~~~~~~~~~~~~~~~~~~~
+
+    Per-user directories for the on-disk caches and stores. They hold
+    pickles, session ids and account data, so they must never be readable
+    or writable by other local users: the default directories live under
+    the user's cache directory (~/.cache, or $XDG_CACHE_HOME) and are
+    created 0700, and an existing directory is only used if it's owned by
+    the current user and not writable by the group or others. Database
+    files are created 0600, and only used if no one else can access them.
+
+    Usage example:
+    location = private_dir(user_cache_dir('zuora-wsdl'))
+    database = private_file(path.join(location, 'zuora.db'))
+"""
+import errno
+import os
+from os import path
+import stat
+
+
+class UnsafeDirectory(Exception):
+    pass
+
+
+def user_cache_dir(name):
+    """
+    Returns the path of a directory of the user's cache directory
+    """
+    root = os.environ.get('XDG_CACHE_HOME') or path.expanduser('~/.cache')
+    return path.join(root, name)
+
+
+def check_owner(location, mode):
+    """
+    Raises UnsafeDirectory if the file isn't owned by the current user, or
+    has any of the mode bits
+    """
+    info = os.stat(location)
+    getuid = getattr(os, 'getuid', None)
+    if getuid is not None and info.st_uid != getuid():
+        raise UnsafeDirectory("%s isn't owned by the current user"
+                              % location)
+    if stat.S_IMODE(info.st_mode) & mode:
+        raise UnsafeDirectory("%s is accessible by other users (mode %o)"
+                              % (location, stat.S_IMODE(info.st_mode)))
+
+
+def private_dir(location):
+    """
+    Creates the directory 0700 if it doesn't exist, and returns it.
+
+    :raises UnsafeDirectory: the directory isn't owned by the current user
+                             or is writable by the group or others
+    """
+    try:
+        os.makedirs(location, 0o700)
+    except OSError as error:
+        if error.errno != errno.EEXIST:
+            raise
+    check_owner(location, stat.S_IWGRP | stat.S_IWOTH)
+    return location
+
+
+def private_file(file_path):
+    """
+    Creates the file 0600 (in a private directory, see private_dir()) if it
+    doesn't exist, and returns it.
+
+    :raises UnsafeDirectory: the file or its directory isn't owned by the
+                             current user, the directory is writable by
+                             others or the file is accessible by them
+    """
+    private_dir(path.dirname(path.abspath(file_path)))
+    try:
+        os.close(os.open(file_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL,
+                         0o600))
+    except OSError as error:
+        if error.errno != errno.EEXIST:
+            raise
+    check_owner(file_path, stat.S_IRWXG | stat.S_IRWXO)
+    return file_path
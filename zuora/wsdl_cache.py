@@ -0,0 +1,131 @@
+"""
+    Zuora WSDL Cache
+    ~~~~~~~~~~~~~~~~
+
+    On-disk cache of the parsed WSDL definitions, so that building a new suds
+    client loads the pickled schema instead of re-parsing the WSDL and
+    re-running the ImportDoctor.
+
+    The cache directory holds pickles, so it's private to the user (see
+    user_dirs): a directory owned by another user or writable by others is
+    refused with UnsafeDirectory.
+
+    Usage example:
+    from suds.client import Client
+
+    cache = WsdlCache('/path/to/zuora.a.48.0.wsdl')
+    client = Client(url, cache=cache, cachingpolicy=1)
+"""
+import hashlib
+import os
+from os import path
+import tempfile
+
+import suds
+from suds.cache import ObjectCache
+
+from user_dirs import private_dir, user_cache_dir
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+import logging
+log = logging.getLogger(__name__)
+
+#: Default cache location, shared by the processes of the user
+DEFAULT_LOCATION = user_cache_dir('zuora-wsdl')
+
+
+def wsdl_digest(wsdl_path):
+    """
+    Returns the sha1 hex digest of the contents of a WSDL file
+    """
+    with open(wsdl_path, 'rb') as wsdl:
+        return hashlib.sha1(wsdl.read()).hexdigest()
+
+
+class WsdlCache(ObjectCache):
+    """
+    A suds ObjectCache for parsed WSDL definitions (use with cachingpolicy=1).
+
+    Entries are keyed by the WSDL file name, a hash of its contents and the
+    suds version, so replacing a WSDL never serves a stale schema. Entries are
+    written to a temporary file and renamed into place, so many processes can
+    share one cache directory without reading a partially written file.
+    """
+    fnprefix = 'zuora-wsdl'
+
+    def __init__(self, wsdl_path, location=None):
+        """
+        :param str wsdl_path: path to the local wsdl file
+        :param str location: cache directory, defaults to DEFAULT_LOCATION
+
+        :raises UnsafeDirectory: the directory isn't private to the user
+        """
+        self.wsdl_name = path.basename(wsdl_path)
+        self.wsdl_digest = wsdl_digest(wsdl_path)
+        ObjectCache.__init__(self, private_dir(location or DEFAULT_LOCATION))
+
+    def mktmp(self):
+        # Recreated private if it was removed since
+        private_dir(self.location)
+        return self
+
+    def checkversion(self):
+        # The suds version is part of every file name, so unlike the base
+        # FileCache there is never a reason to clear the directory (which
+        # would race with other processes reading it).
+        pass
+
+    def filename(self, id):
+        """
+        Returns the cache file path for the suds object id
+        """
+        name = '%s-%s-%s-%s-%s.%s' % (self.fnprefix, self.wsdl_name,
+                                      self.wsdl_digest, suds.__version__,
+                                      id, self.fnsuffix())
+        return path.join(self.location, name)
+
+    def get(self, id):
+        try:
+            with open(self.filename(id), 'rb') as cached:
+                return pickle.load(cached)
+        except IOError:
+            # Not cached yet
+            return None
+        except Exception as error:
+            log.warning("Zuora: Discarding unreadable WSDL cache entry. %s"
+                        % error)
+            self.purge(id)
+            return None
+
+    def put(self, id, object):
+        tmp_path = None
+        try:
+            bfr = pickle.dumps(object, self.protocol)
+            self.mktmp()
+            fd, tmp_path = tempfile.mkstemp(prefix='.%s-' % self.fnprefix,
+                                            dir=self.location)
+            # mkstemp creates the file owner-only
+            with os.fdopen(fd, 'wb') as cached:
+                cached.write(bfr)
+            # rename is atomic, readers see the old file or the complete one
+            os.rename(tmp_path, self.filename(id))
+            tmp_path = None
+        except Exception as error:
+            log.warning("Zuora: Unable to write WSDL cache entry. %s" % error)
+        finally:
+            if tmp_path:
+                try:
+                    os.remove(tmp_path)
+                except OSError:
+                    pass
+        return object
+
+    def purge(self, id):
+        try:
+            os.remove(self.filename(id))
+        except OSError:
+            pass